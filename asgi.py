@@ -0,0 +1,9 @@
+from src.app.asgi import create_asgi_app
+import os
+
+app = create_asgi_app()
+
+if __name__ == '__main__':
+    import uvicorn
+    port = int(os.getenv('PORT', 8080))
+    uvicorn.run(app, host='0.0.0.0', port=port)
@@ -0,0 +1,107 @@
+"""
+Speed and recovery rate of the artwork analysis JSON extraction.
+
+Runs every model output in benchmarks/data/artwork_outputs.jsonl through
+the previous extraction (fence regex, greedy brace regex, json.loads,
+then the four-regex _repair_json and a second parse) and through
+extract_json_object. An output counts as recovered when the result
+passes the analyzer's structure checks (comments, questions and
+story_elements present), and as exact when it also equals the object the
+model meant to send (where the corpus records one). Anything not
+recovered ends up as the default analysis.
+
+    python -m benchmarks.bench_json_extract [--repeat 200] [--verbose]
+"""
+import argparse
+import json
+import os
+import re
+import time
+
+from src.llm_models.json_extract import extract_json_object
+
+CORPUS = os.path.join(os.path.dirname(__file__), 'data', 'artwork_outputs.jsonl')
+
+
+def previous_extract(text):
+    """ArtworkAnalyzer._parse_response's extraction and _repair_json before the single-pass parser."""
+    match = re.search(r'```json\s*(.*?)\s*```', text, re.DOTALL)
+    if not match:
+        match = re.search(r'(\{.*\})', text, re.DOTALL)
+        if not match:
+            raise ValueError("no JSON")
+    json_text = match.group(1)
+    try:
+        return json.loads(json_text)
+    except json.JSONDecodeError:
+        json_text = re.sub(r'"\s*"', '", "', json_text)
+        json_text = re.sub(r'"\s*\n?\s*"', '", "', json_text)
+        json_text = re.sub(r',\s*]', ']', json_text)
+        json_text = re.sub(r',\s*}', '}', json_text)
+        json_text = re.sub(r'([{,]\s*)([a-zA-Z0-9_]+)(\s*:)', r'\1"\2"\3', json_text)
+        return json.loads(json_text)
+
+
+def current_extract(text):
+    return extract_json_object(text)[0]
+
+
+def usable(analysis):
+    return (
+        isinstance(analysis, dict)
+        and all(key in analysis for key in ('comments', 'questions', 'story_elements'))
+        and isinstance(analysis['story_elements'], dict)
+    )
+
+
+def evaluate(extract, records, repeat):
+    recovered = exact = 0
+    failures = []
+    started = time.perf_counter()
+    for record in records:
+        for _ in range(repeat):
+            try:
+                analysis = extract(record['text'])
+            except ValueError:
+                analysis = None
+        if usable(analysis):
+            recovered += 1
+            exact += record['expected'] is not None and analysis == record['expected']
+        else:
+            failures.append(record['name'])
+    per_output = (time.perf_counter() - started) / (len(records) * repeat) * 1e6
+    return per_output, recovered, exact, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200, help='parses per output, for timing')
+    parser.add_argument('--verbose', action='store_true', help='list the outputs each extractor lost')
+    args = parser.parse_args()
+
+    with open(CORPUS) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    with_expected = sum(record['expected'] is not None for record in records)
+
+    print(f"{len(records)} outputs ({with_expected} with an expected object)\n")
+    print(f"{'extractor':<12} {'us/output':>10} {'recovered':>10} {'exact':>8}")
+    for name, extract in (('previous', previous_extract), ('single-pass', current_extract)):
+        per_output, recovered, exact, failures = evaluate(extract, records, args.repeat)
+        print(f"{name:<12} {per_output:>10.1f} {recovered:>6}/{len(records):<3} {exact:>4}/{with_expected}")
+        if args.verbose and failures:
+            print(f"  lost: {', '.join(failures)}")
+
+    # Timing split between outputs the C decoder takes as they are and those needing repair
+    for label, subset in (
+        ('valid', [record for record in records if not extract_json_object(record['text'])[1]]),
+        ('repaired', [record for record in records if extract_json_object(record['text'])[1]]),
+    ):
+        if subset:
+            print(f"\n{label} outputs ({len(subset)}):", end='')
+            for name, extract in (('previous', previous_extract), ('single-pass', current_extract)):
+                print(f"  {name} {evaluate(extract, subset, args.repeat)[0]:.1f} us", end='')
+    print()
+
+
+if __name__ == '__main__':
+    main()
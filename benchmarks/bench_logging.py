@@ -0,0 +1,138 @@
+"""
+Per-request logging overhead, before and after the production logging setup.
+
+Replays the log calls one artwork story request makes. "before" is the
+old setup: root at DEBUG, f-strings, indented JSON dumps of whole
+responses, the environment key dump and a hex dump of the upload, all
+written by the request thread. The other rows use the current calls
+through BackgroundHandler at INFO (production) and at DEBUG with payload
+sampling. Reports the time the request thread spends in logging and the
+bytes written per request (after the listener has drained).
+
+    python -m benchmarks.bench_logging [--requests 2000] [--payload-rate 0.01]
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+
+from src.app.utils.logs import (
+    PAYLOAD, PROMPT, TEXT_FORMAT, BackgroundHandler, Lazy, RequestContextFilter, SamplingFilter, lazy_json,
+)
+
+STORY = "Once upon a time, a small fox found a lantern in the snow. " * 40
+ANALYSIS = {
+    'primary_subject': 'a fox holding a lantern',
+    'setting': 'a snowy forest at night',
+    'colors': ['deep blue', 'white', 'warm orange'],
+    'mood': 'quiet and hopeful',
+    'story_elements': ['curiosity', 'friendship', 'finding the way home'] * 5,
+}
+RESPONSE = {
+    'id': 'gen-123',
+    'model': 'vision-model',
+    'choices': [{'message': {'role': 'assistant', 'content': json.dumps(ANALYSIS)}}],
+    'usage': {'prompt_tokens': 1200, 'completion_tokens': 350},
+}
+RESPONSE_TEXT = json.dumps({'choices': [{'message': {'content': STORY}}]})
+REQUEST = {
+    'mainPrompt': 'A fox who finds a lantern', 'ageGroup': 'preschool', 'isArtworkFlow': True,
+    'context': {'analysis': ANALYSIS, 'keywords': 'fox, lantern, snow'},
+}
+PROMPT_TEXT = "Write a story for a preschool child about: " + json.dumps(REQUEST) * 3
+
+
+def before_request(log, image):
+    log.debug(f"Received story generation request: {REQUEST}")
+    log.debug(f"Environment variables:")
+    log.debug(f"OPENROUTER_API_KEY present: {True}")
+    log.debug(f"All env vars: {list(os.environ.keys())}")
+    log.debug(f"Image data length: {len(image.getvalue())} bytes")
+    log.debug(f"First 20 bytes: {image.read(20).hex()}")
+    image.seek(0)
+    log.debug(f"API Response Status: {200}")
+    log.debug(f"API Response: {json.dumps(RESPONSE, indent=2)}")
+    log.debug("Raw analysis from _try_analyze:")
+    log.debug(json.dumps(ANALYSIS, indent=2))
+    log.debug(f"Story context: {REQUEST['context']}")
+    log.info(f"Selected template: {'adventure'} (Score: {3})")
+    log.info(f"Final prompt:\n{PROMPT_TEXT}")
+    log.info("Starting API request...")
+    log.debug(f"API Response status: {200}")
+    log.debug(f"API Response: {RESPONSE_TEXT[:500]}...")
+    log.debug(f"Generated story length: {len(STORY)}")
+    log.debug(f"Generated story: {STORY[:100]}...")
+
+
+def after_request(log, image):
+    log.debug("Received story generation request: %s", REQUEST, extra=PAYLOAD)
+    log.debug("Image data length: %d bytes", len(image.getvalue()))
+    log.debug("API Response Status: %s", 200)
+    log.debug("API Response: %s", lazy_json(RESPONSE), extra=PAYLOAD)
+    log.debug("Raw analysis from _try_analyze: %s", lazy_json(ANALYSIS), extra=PAYLOAD)
+    log.debug("Story context: %s", REQUEST['context'], extra=PAYLOAD)
+    log.info("Selected template: %s (Score: %s)", 'adventure', 3)
+    log.debug("Final prompt:\n%s", PROMPT_TEXT, extra=PROMPT)
+    log.info("Starting API request...")
+    log.debug("API Response status: %s", 200)
+    log.debug("API Response: %.500s...", Lazy(str, RESPONSE_TEXT), extra=PAYLOAD)
+    log.debug("Generated story length: %d", len(STORY))
+    log.debug("Generated story: %.100s...", STORY, extra=PAYLOAD)
+
+
+def run(name, calls, level, handler, requests, path):
+    log = logging.getLogger(f'bench.{name}')
+    log.propagate = False
+    log.setLevel(level)
+    log.addHandler(handler)
+    image = io.BytesIO(os.urandom(256 * 1024))
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        calls(log, image)
+    elapsed = time.perf_counter() - started
+
+    if isinstance(handler, BackgroundHandler):
+        handler.stop()
+    for output in getattr(handler, 'handlers', [handler]):
+        output.close()
+    size = os.path.getsize(path)
+    print(f"{name:<28} {elapsed / requests * 1e6:>12.1f} {size / requests:>12.0f}")
+
+
+def background(path, sample_rates):
+    output = logging.FileHandler(path)
+    output.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handler = BackgroundHandler([output])
+    handler.addFilter(SamplingFilter(sample_rates))
+    handler.addFilter(RequestContextFilter())
+    return handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--payload-rate', type=float, default=0.01, help='LOG_SAMPLE_RATES payload rate')
+    args = parser.parse_args()
+    rates = {'payload': args.payload_rate, 'prompt': 0.1}
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'setup':<28} {'us/request':>12} {'bytes/req':>12}")
+
+        path = os.path.join(directory, 'before.log')
+        handler = logging.FileHandler(path)
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        run('before (DEBUG, sync)', before_request, logging.DEBUG, handler, args.requests, path)
+
+        path = os.path.join(directory, 'after-info.log')
+        run('after (INFO)', after_request, logging.INFO, background(path, rates), args.requests, path)
+
+        path = os.path.join(directory, 'after-debug.log')
+        run('after (DEBUG, sampled)', after_request, logging.DEBUG, background(path, rates), args.requests, path)
+
+
+if __name__ == '__main__':
+    main()
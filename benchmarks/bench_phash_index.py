@@ -0,0 +1,78 @@
+"""
+Lookup cost of the perceptual-hash index as it grows.
+
+Compares PerceptualIndex.search with a linear Hamming scan at several
+index sizes, for near-duplicate queries (a stored hash with a few bits
+flipped) and unrelated queries (random hashes).
+
+    python -m benchmarks.bench_phash_index [--sizes 1000,10000,100000] [--distance 6]
+"""
+import argparse
+import random
+import time
+
+from src.app.utils.phash_index import PerceptualIndex
+
+
+def flip_bits(value, count, rng):
+    for bit in rng.sample(range(64), count):
+        value ^= 1 << bit
+    return value
+
+
+def linear_search(entries, phash, max_distance):
+    best = None
+    for entry_hash, value in entries:
+        distance = bin(phash ^ entry_hash).count('1')
+        if distance <= max_distance and (best is None or distance < best[1]):
+            best = (value, distance)
+    return best
+
+
+def time_per_call(fn, queries):
+    started = time.perf_counter()
+    for query in queries:
+        fn(query)
+    return (time.perf_counter() - started) / len(queries) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--distance', type=int, default=6)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"max_distance={args.distance}, {args.queries} queries per case")
+    print(f"{'entries':>8} {'near index us':>14} {'near scan us':>13} {'miss index us':>14} "
+          f"{'miss scan us':>13} {'recall':>7} {'avg cand':>9}")
+
+    for size in (int(s) for s in args.sizes.split(',')):
+        index = PerceptualIndex(max_distance=args.distance, max_entries=size)
+        entries = []
+        for i in range(size):
+            phash = rng.getrandbits(64)
+            index.add(phash, i)
+            entries.append((phash, i))
+
+        near = [flip_bits(entries[rng.randrange(size)][0], rng.randint(0, args.distance), rng)
+                for _ in range(args.queries)]
+        misses = [rng.getrandbits(64) for _ in range(args.queries)]
+
+        near_index = time_per_call(index.search, near)
+        stats = index.stats()
+        miss_index = time_per_call(index.search, misses)
+        # The scan is slow at 100k; a subset of queries is enough for a per-call figure
+        scan_queries = max(20, args.queries // max(1, size // 1000))
+        near_scan = time_per_call(lambda q: linear_search(entries, q, args.distance), near[:scan_queries])
+        miss_scan = time_per_call(lambda q: linear_search(entries, q, args.distance), misses[:scan_queries])
+
+        found = sum(1 for q in near if index.search(q) is not None)
+        print(f"{size:>8} {near_index:>14.1f} {near_scan:>13.1f} {miss_index:>14.1f} "
+              f"{miss_scan:>13.1f} {found / len(near):>7.1%} {stats['avg_candidates']:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Per-check cost of the rate limiter storages and strategies.
+
+Times one hit() against the in-process memory storage (what every worker
+used to keep separately) and the shared SQLite storage, for a single
+process and for several processes hitting the same file at once. The
+contended run also checks that the shared buckets never grant more than
+their capacity in total.
+
+    python -m benchmarks.bench_ratelimit [--checks 20000] [--processes 4] [--clients 100]
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import STRATEGIES
+
+# Registers the sqlite storage and the token-bucket strategy
+import src.app.utils.limiter  # noqa: F401
+
+LIMIT = parse("5 per minute")
+
+
+def time_checks(uri, strategy, checks, clients):
+    limiter = STRATEGIES[strategy](storage_from_string(uri))
+    started = time.perf_counter()
+    for i in range(checks):
+        limiter.hit(LIMIT, f"10.0.{i % clients // 256}.{i % 256}", 'story-generation')
+    return (time.perf_counter() - started) / checks * 1e6
+
+
+def contended_worker(args):
+    uri, checks, capacity = args
+    limiter = STRATEGIES['token-bucket'](storage_from_string(uri))
+    item = parse(f"{capacity} per day")
+    granted = 0
+    started = time.perf_counter()
+    for _ in range(checks):
+        granted += limiter.hit(item, '10.0.0.1', 'story-generation')
+    return granted, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--checks', type=int, default=20000)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=100, help='distinct client addresses')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        sqlite_uri = 'sqlite:///' + os.path.join(directory, 'ratelimit.sqlite3')
+        print(f"{'storage':<10} {'strategy':<16} {'us/check':>10}")
+        for uri, strategy in (
+            ('memory://', 'fixed-window'),
+            ('memory://', 'moving-window'),
+            (sqlite_uri, 'fixed-window'),
+            (sqlite_uri, 'token-bucket'),
+        ):
+            per_check = time_checks(uri, strategy, args.checks, args.clients)
+            print(f"{uri.split(':')[0]:<10} {strategy:<16} {per_check:>10.1f}")
+
+        # Every process hammers one client's bucket; together they may only take its capacity
+        capacity = args.checks // 2
+        per_process = args.checks // args.processes
+        contended_uri = 'sqlite:///' + os.path.join(directory, 'contended.sqlite3')
+        storage_from_string(contended_uri)  # Create the schema before the workers race
+        with multiprocessing.get_context('spawn').Pool(args.processes) as pool:
+            results = pool.map(contended_worker, [(contended_uri, per_process, capacity)] * args.processes)
+        granted = sum(result[0] for result in results)
+        per_check = max(result[1] for result in results) / per_process * 1e6
+        print(
+            f"\n{args.processes} processes, one shared bucket: {per_check:.1f} us/check, "
+            f"granted {granted} of {per_process * args.processes} (capacity {capacity})"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Lookup cost and hit rate of the similar-story index as it grows.
+
+Fills a MinHashIndex with generated story requests, then looks up
+paraphrases of stored requests (words reordered, filler words and
+plurals changed, now and then a typo) and unrelated requests. Compares
+MinHashIndex.search with an exact Jaccard scan over every entry: the
+scan finds every paraphrase above the threshold, so "recall" is the
+share of those the index also finds.
+
+    python -m benchmarks.bench_story_similarity [--sizes 1000,10000,50000] [--threshold 0.8]
+"""
+import argparse
+import random
+import time
+
+from src.app.utils.similarity import MinHashIndex, story_features
+
+ADJECTIVES = 'brave tiny sleepy curious grumpy shy clever silly gentle golden purple magic lost happy'.split()
+CREATURES = ('dragon unicorn bunny fox owl turtle kitten puppy robot mermaid dinosaur penguin bear '
+             'giraffe pirate princess knight wizard fairy monster').split()
+PLACES = ('castle forest ocean moon garden jungle city farm desert island cave meadow volcano '
+          'library bakery rainbow cloud river mountain school').split()
+ACTIONS = 'finds loses builds visits paints bakes discovers shares rescues chases'.split()
+OBJECTS = 'treasure map cake kite star lantern seashell balloon key crown song friend'.split()
+MORALS = ('sharing is caring', 'be kind to others', 'never give up', 'honesty matters', 'be yourself')
+FILLER = ('a', 'the', 'in a', 'with the', 'and')
+AGE_GROUPS = ('baby', 'preK', 'growing')
+
+
+def random_request(rng):
+    words = [rng.choice(ADJECTIVES), rng.choice(CREATURES), rng.choice(ACTIONS),
+             rng.choice(OBJECTS), rng.choice(PLACES)]
+    request = {'ageGroup': rng.choice(AGE_GROUPS), 'mainPrompt': words}
+    if rng.random() < 0.3:
+        request['moral'] = rng.choice(MORALS)
+    return request
+
+
+def render(request, rng, paraphrase=False):
+    """The canonical request (see canonical_story_request) for one wording of request."""
+    words = list(request['mainPrompt'])
+    if paraphrase:
+        rng.shuffle(words)
+        if rng.random() < 0.3:
+            i = rng.randrange(len(words))
+            words[i] += 's'
+        if rng.random() < 0.2:
+            i = rng.randrange(len(words))
+            word = words[i]
+            j = rng.randrange(len(word) - 1)
+            words[i] = word[:j] + word[j + 1] + word[j] + word[j + 2:]
+    prompt = ' '.join(f'{rng.choice(FILLER)} {word}' if rng.random() < 0.5 else word for word in words)
+    canonical = {'ageGroup': request['ageGroup'], 'mainPrompt': prompt}
+    if 'moral' in request:
+        canonical['moral'] = request['moral']
+    return story_features(canonical)
+
+
+def linear_search(entries, features, group, threshold):
+    best = None
+    for entry_features, entry_group, value in entries:
+        if entry_group != group:
+            continue
+        similarity = len(features & entry_features) / len(features | entry_features)
+        if similarity >= threshold and (best is None or similarity > best[1]):
+            best = (value, similarity)
+    return best
+
+
+def time_per_call(fn, queries):
+    started = time.perf_counter()
+    for query in queries:
+        fn(*query)
+    return (time.perf_counter() - started) / len(queries) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,50000')
+    parser.add_argument('--threshold', type=float, default=0.8)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"threshold={args.threshold}, {args.queries} queries per case")
+    print(f"{'entries':>8} {'add us':>7} {'para index us':>14} {'para scan us':>13} {'miss index us':>14} "
+          f"{'miss scan us':>13} {'para hits':>10} {'recall':>7} {'false hits':>11} {'avg cand':>9}")
+
+    for size in (int(s) for s in args.sizes.split(',')):
+        index = MinHashIndex(threshold=args.threshold, max_entries=size)
+        requests = [random_request(rng) for _ in range(size)]
+        entries = []
+        started = time.perf_counter()
+        for i, request in enumerate(requests):
+            features, group = render(request, rng)
+            index.add(features, i, group)
+            entries.append((features, group, i))
+        add_us = (time.perf_counter() - started) / size * 1e6
+
+        paraphrases = [render(requests[rng.randrange(size)], rng, paraphrase=True) for _ in range(args.queries)]
+        unrelated = [render(random_request(rng), rng) for _ in range(args.queries)]
+
+        para_index = time_per_call(index.search, paraphrases)
+        stats = index.stats()
+        miss_index = time_per_call(index.search, unrelated)
+        # The scan is slow for large indexes; a subset of queries is enough for a per-call figure
+        scan_queries = max(20, args.queries // max(1, size // 1000))
+        scan = lambda features, group: linear_search(entries, features, group, args.threshold)
+        para_scan = time_per_call(scan, paraphrases[:scan_queries])
+        miss_scan = time_per_call(scan, unrelated[:scan_queries])
+
+        found = [index.search(*query) is not None for query in paraphrases[:scan_queries]]
+        expected = [scan(*query) is not None for query in paraphrases[:scan_queries]]
+        recall = sum(f and e for f, e in zip(found, expected)) / max(1, sum(expected))
+        hits = sum(1 for query in paraphrases if index.search(*query) is not None) / len(paraphrases)
+        # Unrelated requests that still clear the threshold: random collisions in a small vocabulary
+        false_hits = sum(1 for query in unrelated if index.search(*query) is not None) / len(unrelated)
+        print(f"{size:>8} {add_us:>7.1f} {para_index:>14.1f} {para_scan:>13.1f} {miss_index:>14.1f} "
+              f"{miss_scan:>13.1f} {hits:>10.1%} {recall:>7.1%} {false_hits:>11.1%} {stats['avg_candidates']:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
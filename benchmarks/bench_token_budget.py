@@ -0,0 +1,82 @@
+"""
+Story max_tokens: the old fixed table against the learned TokenBudget.
+
+Simulates story completions per age group. A story's natural length is
+log-normal around a share of the target word count and costs
+--tokens-per-word tokens a word (the old table assumed 1.3); a story
+longer than max_tokens is cut off there. "fixed" is the old table
+(target words x 1.3, within the 2000-token context), "learned" feeds each
+completion's usage back into TokenBudget. Reports the budget sent, the
+share of stories cut off, and output tokens at p50/p95 (generation time
+scales with them).
+
+    python -m benchmarks.bench_token_budget [--requests 2000] [--tokens-per-word 1.45] [--length-share 0.8]
+"""
+import argparse
+import math
+import random
+
+from src.app.utils.token_budget import TokenBudget
+from src.llm_models.story_generator import TARGET_WORDS
+
+PROMPT_WORDS = 60
+
+
+def fixed_max_tokens(target_words):
+    """StoryGenerator.calculate_max_tokens before the budget was learned."""
+    return int(min(2000 - PROMPT_WORDS * 1.3, target_words * 1.3))
+
+
+def simulate(max_tokens_for, record, target_words, args, rng):
+    budgets, outputs, truncated = [], [], 0
+    for _ in range(args.requests):
+        budget = max_tokens_for()
+        words = max(20, int(rng.lognormvariate(0, args.sigma) * args.length_share * target_words))
+        tokens = int(words * args.tokens_per_word)
+        finish_reason = 'stop'
+        if tokens > budget:
+            tokens, finish_reason = budget, 'length'
+            words = int(budget / args.tokens_per_word)
+            truncated += 1
+        record({'completion_tokens': tokens, 'prompt_tokens': int(PROMPT_WORDS * args.tokens_per_word)},
+               finish_reason, ' '.join(['word'] * words))
+        budgets.append(budget)
+        outputs.append(tokens)
+    outputs.sort()
+    return (
+        sum(budgets) / len(budgets),
+        truncated / args.requests,
+        outputs[len(outputs) // 2],
+        outputs[min(len(outputs) - 1, math.ceil(0.95 * len(outputs)) - 1)],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000, help='stories per age group')
+    parser.add_argument('--tokens-per-word', type=float, default=1.45, help="the model's actual tokens per word")
+    parser.add_argument('--length-share', type=float, default=0.8, help='median story length / target words')
+    parser.add_argument('--sigma', type=float, default=0.25, help='log-normal spread of story length')
+    parser.add_argument('--truncation-rate', type=float, default=0.02, help='STORY_TRUNCATION_RATE')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'age group':<10} {'budget':<8} {'max_tokens':>10} {'cut off':>8} {'p50 out':>8} {'p95 out':>8}")
+    for age_group, lengths in TARGET_WORDS.items():
+        target_words = lengths['normal']
+        budget = TokenBudget('bench', 'BENCH', truncation_rate=args.truncation_rate)
+        key = (age_group, 'normal')
+        runs = (
+            ('fixed', lambda: fixed_max_tokens(target_words), lambda *_: None),
+            ('learned', lambda: budget.max_tokens(key, target_words, PROMPT_WORDS),
+             lambda usage, finish, text: budget.record(key, usage, finish, text, PROMPT_WORDS)),
+        )
+        for name, max_tokens_for, record in runs:
+            mean_budget, cut_off, p50, p95 = simulate(
+                max_tokens_for, record, target_words, args, random.Random(args.seed)
+            )
+            print(f"{age_group:<10} {name:<8} {mean_budget:>10.0f} {cut_off:>8.1%} {p50:>8} {p95:>8}")
+
+
+if __name__ == '__main__':
+    main()
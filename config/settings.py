@@ -21,6 +21,10 @@ class Config:
     OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY', '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')
     PERPLEXITY_API_KEY = os.environ.get('PERPLEXITY_API_KEY', 'your-default-key')  # Add your key here
     
+    # Upstream endpoints; point both at scripts/mock_upstream.py for offline load tests
+    PERPLEXITY_BASE_URL = os.environ.get('PERPLEXITY_BASE_URL', 'https://api.perplexity.ai')
+    OPENROUTER_BASE_URL = os.environ.get('OPENROUTER_BASE_URL', 'https://openrouter.ai')
+    
     # Model settings
     PERPLEXITY_MODEL = "llama-3.1-sonar-large-128k-online"
     TEMPERATURE = 0.7
@@ -28,12 +32,144 @@ class Config:
     TOKENS_PER_KEYWORD = 50
     ABSOLUTE_MAX_TOKENS = 500
     
+    # Story max_tokens, learned per age group from the usage the upstream reports
+    STORY_CONTEXT_TOKENS = int(os.environ.get('STORY_CONTEXT_TOKENS', 2000))  # Prompt + story
+    STORY_TRUNCATION_RATE = float(os.environ.get('STORY_TRUNCATION_RATE', 0.02))  # Share of stories allowed to hit max_tokens
+    STORY_TOKEN_HEADROOM = float(os.environ.get('STORY_TOKEN_HEADROOM', 1.5))  # Budget before calibration, x target length
+    STORY_TOKEN_GROWTH = float(os.environ.get('STORY_TOKEN_GROWTH', 1.5))  # Budget step up while too many are cut off
+    STORY_TOKEN_WINDOW = int(os.environ.get('STORY_TOKEN_WINDOW', 200))  # Recent completions kept per age group
+    STORY_TOKEN_MIN_SAMPLES = int(os.environ.get('STORY_TOKEN_MIN_SAMPLES', 20))
+    
     # Rate limiting settings
-    HOURLY_RATE_LIMIT = 10
-    DAILY_RATE_LIMIT = 80
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', 'True').lower() == 'true'  # Off only for load tests
+    # Token buckets in a SQLite file shared by all workers on the node; memory:// needs another strategy
+    RATELIMIT_STORAGE_URI = os.environ.get(
+        'RATELIMIT_STORAGE_URI',
+        'sqlite:///' + os.path.join(os.path.dirname(os.path.dirname(__file__)), 'instance', 'ratelimit.sqlite3')
+    )
+    RATELIMIT_STRATEGY = os.environ.get('RATELIMIT_STRATEGY', 'token-bucket')
+    RATELIMIT_SWALLOW_ERRORS = True  # A broken limiter store lets requests through instead of failing them
+    # Story generations per client, shared across the generation routes
+    MINUTE_RATE_LIMIT = int(os.environ.get('MINUTE_RATE_LIMIT', 5))
+    HOURLY_RATE_LIMIT = int(os.environ.get('HOURLY_RATE_LIMIT', 10))
+    DAILY_RATE_LIMIT = int(os.environ.get('DAILY_RATE_LIMIT', 80))
+    
+    # Artwork images are downscaled and re-encoded before upload to the vision model
+    ARTWORK_IMAGE_MAX_SIDE = int(os.environ.get('ARTWORK_IMAGE_MAX_SIDE', 768))
+    ARTWORK_IMAGE_BYTE_BUDGET = int(os.environ.get('ARTWORK_IMAGE_BYTE_BUDGET', 100 * 1024))
+    ARTWORK_IMAGE_FORMAT = os.environ.get('ARTWORK_IMAGE_FORMAT', 'JPEG')  # JPEG or WEBP
+    
+    # Vision models in order of preference; later ones hedge a slow first model and replace a failed one
+    ARTWORK_MODELS = [m.strip() for m in os.environ.get(
+        'ARTWORK_MODELS',
+        'google/learnlm-1.5-pro-experimental:free,google/gemini-flash-1.5-8b'
+    ).split(',') if m.strip()]
+    ARTWORK_HEDGE_QUANTILE = float(os.environ.get('ARTWORK_HEDGE_QUANTILE', 0.95))  # Hedge after this latency quantile
+    ARTWORK_HEDGE_DEFAULT_DELAY = float(os.environ.get('ARTWORK_HEDGE_DEFAULT_DELAY', 8))  # Until enough latencies are seen
+    ARTWORK_HEDGE_MIN_DELAY = float(os.environ.get('ARTWORK_HEDGE_MIN_DELAY', 1))
+    ARTWORK_HEDGE_MAX_RATE = float(os.environ.get('ARTWORK_HEDGE_MAX_RATE', 0.1))  # Most requests that may be hedged
+    ARTWORK_HEDGE_THREADS = int(os.environ.get('ARTWORK_HEDGE_THREADS', 32))
+    
+    # Upstream connection pooling
+    UPSTREAM_POOL_MAXSIZE = int(os.environ.get('UPSTREAM_POOL_MAXSIZE', 20))
+    UPSTREAM_WARM_CONNECTIONS = int(os.environ.get('UPSTREAM_WARM_CONNECTIONS', 2))  # 0 disables warm-up
+    # Per-provider circuit breaker: opens when this share of the last WINDOW calls failed or were slow
+    UPSTREAM_BREAKER_WINDOW = int(os.environ.get('UPSTREAM_BREAKER_WINDOW', 20))
+    UPSTREAM_BREAKER_MIN_CALLS = int(os.environ.get('UPSTREAM_BREAKER_MIN_CALLS', 10))
+    UPSTREAM_BREAKER_FAILURE_RATE = float(os.environ.get('UPSTREAM_BREAKER_FAILURE_RATE', 0.5))
+    UPSTREAM_BREAKER_SLOW_SECONDS = float(os.environ.get('UPSTREAM_BREAKER_SLOW_SECONDS', 20))
+    UPSTREAM_BREAKER_COOLDOWN = float(os.environ.get('UPSTREAM_BREAKER_COOLDOWN', 30))  # Seconds open before probing
+    # Bulkhead: concurrent calls per provider per process, and how long a caller waits for a slot
+    UPSTREAM_BULKHEAD_SIZE = int(os.environ.get('UPSTREAM_BULKHEAD_SIZE', 32))
+    UPSTREAM_BULKHEAD_WAIT = float(os.environ.get('UPSTREAM_BULKHEAD_WAIT', 2))
+    # Time budget per request, from arrival; upstream timeouts, retries and backoff all come out of it
+    REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', 45))
+    UPSTREAM_MAX_ATTEMPTS = int(os.environ.get('UPSTREAM_MAX_ATTEMPTS', 3))
+    UPSTREAM_MIN_ATTEMPT_SECONDS = float(os.environ.get('UPSTREAM_MIN_ATTEMPT_SECONDS', 5))  # Don't start an attempt with less left
+    UPSTREAM_BACKOFF_BASE = float(os.environ.get('UPSTREAM_BACKOFF_BASE', 0.5))  # Full-jitter exponential backoff
+    UPSTREAM_BACKOFF_MAX = float(os.environ.get('UPSTREAM_BACKOFF_MAX', 8))
+    
+    # Async (ASGI) serving: max concurrent upstream-bound requests per process
+    ASYNC_MAX_INFLIGHT = int(os.environ.get('ASYNC_MAX_INFLIGHT', 200))
+    ASYNC_WSGI_THREADS = int(os.environ.get('ASYNC_WSGI_THREADS', 64))  # Threads for routes served by Flask
+    
+    # Logging: records are written by a background thread, as text or LOG_FORMAT=json lines
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+    LOG_FILE = os.environ.get('LOG_FILE', '')  # Empty writes to stderr
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))  # Records beyond this are dropped, not waited for
+    # Share of the verbose DEBUG categories kept (request bodies and API responses, prompts); 1 keeps all
+    LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', 'payload=0.01,prompt=0.1')
+    
+    # Prometheus text-format metrics at /metrics (per worker process), served over HTTPS
+    # only to scrapers sending "Authorization: Bearer <METRICS_TOKEN>" (unset hides the endpoint)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() == 'true'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
     
     # Cache settings
-    CACHE_TTL = 3600  # Cache stories for 1 hour 
+    CACHE_TTL = 3600  # Cache stories for 1 hour
+    CACHE_MEMORY_SIZE = int(os.environ.get('CACHE_MEMORY_SIZE', 100))  # Per-process LRU entries
+    # Shared on-disk tier; point at a persistent volume to survive deploys, empty to disable
+    CACHE_DISK_PATH = os.environ.get(
+        'CACHE_DISK_PATH',
+        os.path.join(os.path.dirname(os.path.dirname(__file__)), 'instance', 'story_cache.sqlite3')
+    )
+    CACHE_DISK_MAX_ENTRIES = int(os.environ.get('CACHE_DISK_MAX_ENTRIES', 5000))
+    CACHE_SWEEP_INTERVAL = int(os.environ.get('CACHE_SWEEP_INTERVAL', 300))  # Seconds between expiry sweeps
+    
+    # Background pre-generation of popular stories; budget is upstream calls per hour for the node,
+    # shared through RATELIMIT_STORAGE_URI (per worker if rate limiting is off) (0 disables)
+    STORY_WARMER_BUDGET = int(os.environ.get('STORY_WARMER_BUDGET', 30))
+    STORY_WARMER_INTERVAL = int(os.environ.get('STORY_WARMER_INTERVAL', 60))  # Seconds between rounds
+    STORY_WARMER_REFRESH_WINDOW = int(os.environ.get('STORY_WARMER_REFRESH_WINDOW', 600))  # Refresh this close to expiry
+    STORY_WARMER_TOP_N = int(os.environ.get('STORY_WARMER_TOP_N', 10))  # Hottest keys per age group
+    STORY_WARMER_MIN_HITS = int(os.environ.get('STORY_WARMER_MIN_HITS', 2))
+    # Generated stories kept indefinitely and served when the upstream fails; empty to disable
+    STORY_FALLBACK_PATH = os.environ.get(
+        'STORY_FALLBACK_PATH',
+        os.path.join(os.path.dirname(os.path.dirname(__file__)), 'instance', 'fallback_stories.sqlite3')
+    )
+    STORY_FALLBACK_MAX_ENTRIES = int(os.environ.get('STORY_FALLBACK_MAX_ENTRIES', 1000))
+    
+    # Story library in SQLALCHEMY_DATABASE_URI: repeats served after the cache expires, GET /story/<id>, search
+    STORY_LIBRARY_ENABLED = os.environ.get('STORY_LIBRARY_ENABLED', 'True').lower() == 'true'
+    STORY_LIBRARY_BATCH_SIZE = int(os.environ.get('STORY_LIBRARY_BATCH_SIZE', 50))  # Stories per write transaction
+    STORY_LIBRARY_FLUSH_INTERVAL = float(os.environ.get('STORY_LIBRARY_FLUSH_INTERVAL', 1.0))  # Seconds a batch may gather
+    STORY_LIBRARY_QUEUE_SIZE = int(os.environ.get('STORY_LIBRARY_QUEUE_SIZE', 1000))  # Pending writes per process
+    STORY_LIBRARY_MAX_AGE = int(os.environ.get('STORY_LIBRARY_MAX_AGE', 86400))  # Cache-Control for GET /story/<id>
+    # Similar requests (same age group) share a story: min Jaccard similarity of prompt shingles (0 disables)
+    STORY_SIMILARITY_THRESHOLD = float(os.environ.get('STORY_SIMILARITY_THRESHOLD', 0.8))
+    STORY_SIMILARITY_INDEX_SIZE = int(os.environ.get('STORY_SIMILARITY_INDEX_SIZE', 10000))  # Requests indexed per process
+    
+    # Threads per process running the items of POST /story/generate/batch
+    STORY_BATCH_THREADS = int(os.environ.get('STORY_BATCH_THREADS', 16))
+    
+    # Job mode (POST /story/jobs): queue shared by the node's workers; empty path disables it
+    STORY_JOBS_PATH = os.environ.get(
+        'STORY_JOBS_PATH',
+        os.path.join(os.path.dirname(os.path.dirname(__file__)), 'instance', 'story_jobs.sqlite3')
+    )
+    STORY_JOB_WORKERS = int(os.environ.get('STORY_JOB_WORKERS', 2))  # Generation threads per process
+    STORY_JOB_DEADLINE = float(os.environ.get('STORY_JOB_DEADLINE', 120))  # Longer than a request's; nobody is waiting on it
+    STORY_JOB_MAX_WAIT = float(os.environ.get('STORY_JOB_MAX_WAIT', 25))  # Longest ?wait= long-poll
+    STORY_JOB_RETENTION = int(os.environ.get('STORY_JOB_RETENTION', 86400))  # Seconds finished jobs are kept
+    
+    # Artwork analysis cache, keyed by image content hash and normalized keywords
+    ARTWORK_CACHE_TTL = int(os.environ.get('ARTWORK_CACHE_TTL', 3600))
+    ARTWORK_CACHE_MEMORY_SIZE = int(os.environ.get('ARTWORK_CACHE_MEMORY_SIZE', 100))
+    ARTWORK_CACHE_DISK_PATH = os.environ.get(
+        'ARTWORK_CACHE_DISK_PATH',
+        os.path.join(os.path.dirname(os.path.dirname(__file__)), 'instance', 'artwork_cache.sqlite3')
+    )
+    ARTWORK_CACHE_DISK_MAX_ENTRIES = int(os.environ.get('ARTWORK_CACHE_DISK_MAX_ENTRIES', 2000))
+    # Near-duplicate uploads: max dHash bit distance to reuse an analysis (-1 disables)
+    ARTWORK_PHASH_MAX_DISTANCE = int(os.environ.get('ARTWORK_PHASH_MAX_DISTANCE', 6))
+    ARTWORK_PHASH_INDEX_SIZE = int(os.environ.get('ARTWORK_PHASH_INDEX_SIZE', 10000))
+
+    # Fingerprinted static files built by scripts/build_assets.py (default: static/dist/manifest.json)
+    ASSETS_MANIFEST = os.environ.get('ASSETS_MANIFEST')
+    ASSETS_MAX_AGE = int(os.environ.get('ASSETS_MAX_AGE', 31536000))  # Seconds; built names never change content
+
 
     @staticmethod
     def init_app(app):
@@ -0,0 +1,145 @@
+"""
+Build fingerprinted, precompressed static assets and their manifest.
+
+Copies the CSS, JS and images the templates use into static/dist under
+content-hashed names (so they can be cached for good), writes .gz and,
+with Brotli installed, .br copies of text assets, and resizes the hero
+image into AVIF (with pillow-avif-plugin), WebP and JPEG variants for
+srcset. dist/manifest.json maps each source name to its build; see
+src/app/utils/assets.py. Run it again whenever a source file changes.
+
+    python -m scripts.build_assets [--static src/app/static] [--widths 480,800,1200,1600]
+"""
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+
+from PIL import Image, ImageOps
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import pillow_avif  # noqa: F401 -- registers the AVIF codec with Pillow
+    AVIF = True
+except ImportError:
+    AVIF = False
+
+# Files the templates load as they are (relative to the static folder)
+ASSETS = ('css/main.css', 'js/story.js', 'images/logo.png')
+# Images served as <picture> with width variants
+RESPONSIVE_IMAGES = ('images/story-hero.JPG',)
+COMPRESSIBLE = ('.css', '.js', '.json', '.svg', '.txt')
+MIN_COMPRESS_SIZE = 1024
+
+DEFAULT_STATIC = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'src', 'app', 'static')
+
+
+def fingerprint(name, content):
+    """'css/main.css' -> 'css/main.<hash>.css'"""
+    root, ext = os.path.splitext(name)
+    return f'{root}.{hashlib.sha256(content).hexdigest()[:12]}{ext.lower()}'
+
+
+class Build:
+    def __init__(self, out):
+        self.out = out
+        self.manifest = {'files': {}, 'images': {}, 'encodings': {}}
+        self.sizes = []
+
+    def write(self, name, content):
+        """Write content under its fingerprinted name (plus compressed copies); returns that name."""
+        built = fingerprint(name, content)
+        path = os.path.join(self.out, built)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        encodings = {}
+        if built.endswith(COMPRESSIBLE) and len(content) >= MIN_COMPRESS_SIZE:
+            # mtime=0 keeps the .gz byte-identical between builds
+            encodings['gzip'] = gzip.compress(content, compresslevel=9, mtime=0)
+            if brotli is not None:
+                encodings['br'] = brotli.compress(content, mode=brotli.MODE_TEXT, quality=11)
+        kept = []
+        for encoding, compressed in encodings.items():
+            if len(compressed) < len(content):
+                with open(f'{path}.{"gz" if encoding == "gzip" else encoding}', 'wb') as f:
+                    f.write(compressed)
+                kept.append(encoding)
+        if kept:
+            self.manifest['encodings'][built] = kept
+        self.sizes.append((built, len(content), {e: len(encodings[e]) for e in kept}))
+        return built
+
+    def asset(self, static, name):
+        with open(os.path.join(static, name), 'rb') as f:
+            self.manifest['files'][name] = self.write(name, f.read())
+
+    def responsive_image(self, static, name, widths, quality):
+        with Image.open(os.path.join(static, name)) as source:
+            image = ImageOps.exif_transpose(source).convert('RGB')
+            icc_profile = source.info.get('icc_profile')
+        root = os.path.splitext(name)[0]
+        formats = [('image/jpeg', 'JPEG', 'jpg', {'quality': quality, 'optimize': True, 'progressive': True}),
+                   ('image/webp', 'WEBP', 'webp', {'quality': quality, 'method': 6})]
+        if AVIF:
+            # AVIF holds up at a lower quality setting than JPEG/WebP
+            formats.insert(0, ('image/avif', 'AVIF', 'avif', {'quality': max(1, quality - 20), 'speed': 4}))
+        widths = sorted({min(width, image.width) for width in widths})
+        sources = {mime: [] for mime, *_ in formats}
+        for width in widths:
+            height = round(image.height * width / image.width)
+            resized = image.resize((width, height), Image.LANCZOS) if width < image.width else image
+            for mime, fmt, ext, options in formats:
+                buffer = io.BytesIO()
+                if icc_profile:
+                    options = dict(options, icc_profile=icc_profile)
+                resized.save(buffer, fmt, **options)
+                sources[mime].append([self.write(f'{root}-{width}w.{ext}', buffer.getvalue()), width])
+        largest = sources['image/jpeg'][-1][0]
+        self.manifest['files'][name] = largest
+        self.manifest['images'][name] = {
+            'width': widths[-1],
+            'height': round(image.height * widths[-1] / image.width),
+            'sources': sources,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--static', default=DEFAULT_STATIC, help='the Flask static folder')
+    parser.add_argument('--widths', default='480,800,1200,1600', help='hero image widths for srcset')
+    parser.add_argument('--quality', type=int, default=78, help='JPEG/WebP quality (AVIF uses 20 less)')
+    args = parser.parse_args()
+
+    out = os.path.join(args.static, 'dist')
+    # Start clean so stale builds don't pile up; the old manifest goes with them
+    shutil.rmtree(out, ignore_errors=True)
+    os.makedirs(out)
+    build = Build(out)
+    for name in ASSETS:
+        build.asset(args.static, name)
+    for name in RESPONSIVE_IMAGES:
+        build.responsive_image(args.static, name, [int(w) for w in args.widths.split(',')], args.quality)
+
+    # Written last: an interrupted build leaves no manifest and the app serves the sources
+    with open(os.path.join(out, 'manifest.json'), 'w') as f:
+        json.dump(build.manifest, f, indent=2, sort_keys=True)
+
+    if brotli is None:
+        print("Brotli not installed: gzip copies only")
+    if not AVIF:
+        print("pillow-avif-plugin not installed: no AVIF variants")
+    print(f"{'file':<48} {'bytes':>9} {'gzip':>8} {'br':>8}")
+    for built, size, compressed in build.sizes:
+        print(f"{built:<48} {size:>9} {compressed.get('gzip', '-'):>8} {compressed.get('br', '-'):>8}")
+
+
+if __name__ == '__main__':
+    main()
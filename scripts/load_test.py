@@ -0,0 +1,340 @@
+"""
+End-to-end load test for the story and artwork routes.
+
+Drives /story/generate, /story/generate/stream and /story/artwork/analyze
+at a fixed concurrency and reports latency percentiles, throughput, error
+rates and cache hit rates per route. Prompts and images are drawn from
+small pools with a Zipf skew, so repeated requests exercise the caches.
+
+Against a running app:
+
+    python -m scripts.load_test --url http://127.0.0.1:8080 --concurrency 20 --duration 30
+
+Fully offline (starts scripts.mock_upstream and the ASGI app on free ports,
+with rate limiting off and throwaway cache files):
+
+    python -m scripts.load_test --spawn --concurrency 50 --duration 60 \\
+        --mock-args "--latency 1.5 --error-rate 0.02"
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+import httpx
+
+CHARACTERS = ['dragon', 'rabbit', 'owl', 'robot', 'pirate', 'unicorn', 'bear', 'fox', 'whale', 'knight']
+SETTINGS = ['forest', 'castle', 'ocean', 'moon', 'farm', 'city', 'jungle', 'desert']
+AGE_GROUPS = ['baby', 'preK', 'growing']
+# Talisman redirects plain-http requests unless they look proxied
+HEADERS = {'X-Forwarded-Proto': 'https'}
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of values (q in 0-100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class Workload:
+    """Pools of story requests and images, sampled with a Zipf skew."""
+    def __init__(self, prompts=50, images=10, skew=1.1, seed=1):
+        self.random = random.Random(seed)
+        self.prompts = [self._story_request(i) for i in range(prompts)]
+        self.images = [_make_image(i) for i in range(images)]
+        self.skew = skew
+
+    def story(self):
+        return json.loads(json.dumps(self._pick(self.prompts)))
+
+    def image(self):
+        return self._pick(self.images)
+
+    def _pick(self, pool):
+        weights = [1 / (rank + 1) ** self.skew for rank in range(len(pool))]
+        return self.random.choices(pool, weights=weights)[0]
+
+    def _story_request(self, index):
+        rng = random.Random(index)
+        character, setting = rng.choice(CHARACTERS), rng.choice(SETTINGS)
+        request = {'mainPrompt': f"a {character} in the {setting}", 'ageGroup': rng.choice(AGE_GROUPS)}
+        if index % 3 == 0:
+            request.update({
+                'mainPrompt': f"A story about a {character} in the {setting} who finds a secret",
+                'isArtworkFlow': True,
+                'context': {'character': character, 'setting': setting, 'theme': 'a secret'},
+            })
+        return request
+
+
+def _make_image(seed):
+    from PIL import Image, ImageDraw
+    rng = random.Random(seed)
+    img = Image.new('RGB', (640, 480), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rng.randrange(600), rng.randrange(440)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x, y, x + rng.randrange(20, 200), y + rng.randrange(20, 200)), fill=color)
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class Results:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.first_token = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.cache = defaultdict(Counter)
+
+    def record(self, route, status, elapsed, cached=None, first_token=None):
+        self.latencies[route].append(elapsed)
+        self.statuses[route][status] += 1
+        if cached is not None:
+            self.cache[route]['hit' if cached else 'miss'] += 1
+        if first_token is not None:
+            self.first_token[route].append(first_token)
+
+    def report(self, wall_time):
+        rows = []
+        for route in sorted(self.latencies):
+            latencies = self.latencies[route]
+            statuses = self.statuses[route]
+            errors = sum(count for status, count in statuses.items() if status != 200)
+            cache = self.cache[route]
+            lookups = cache['hit'] + cache['miss']
+            rows.append({
+                'route': route,
+                'requests': len(latencies),
+                'rps': len(latencies) / wall_time,
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p95_ms': percentile(latencies, 95) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+                'error_rate': errors / len(latencies),
+                'cache_hit_rate': cache['hit'] / lookups if lookups else None,
+                'first_token_p50_ms': percentile(self.first_token[route], 50) * 1000 if self.first_token[route] else None,
+                'statuses': dict(statuses),
+            })
+        return rows
+
+
+async def story_request(client, workload, results):
+    started = time.perf_counter()
+    try:
+        response = await client.post('/story/generate', json=workload.story())
+        body = response.json() if response.headers.get('content-type', '').startswith('application/json') else {}
+        results.record('generate', response.status_code, time.perf_counter() - started,
+                       cached=body.get('cached') if response.status_code == 200 else None)
+    except httpx.HTTPError as e:
+        results.record('generate', type(e).__name__, time.perf_counter() - started)
+
+
+async def stream_request(client, workload, results):
+    started = time.perf_counter()
+    first_token = None
+    cached = None
+    status = None
+    try:
+        async with client.stream('POST', '/story/generate/stream', json=workload.story()) as response:
+            status = response.status_code
+            event = None
+            async for line in response.aiter_lines():
+                if line.startswith('event:'):
+                    event = line[len('event:'):].strip()
+                elif line.startswith('data:'):
+                    if event == 'token' and first_token is None:
+                        first_token = time.perf_counter() - started
+                    elif event == 'done':
+                        cached = json.loads(line[len('data:'):]).get('cached')
+                    elif event == 'error':
+                        status = 'stream_error'
+        results.record('stream', status, time.perf_counter() - started, cached=cached, first_token=first_token)
+    except httpx.HTTPError as e:
+        results.record('stream', type(e).__name__, time.perf_counter() - started)
+
+
+async def artwork_request(client, workload, results):
+    started = time.perf_counter()
+    try:
+        response = await client.post(
+            '/story/artwork/analyze',
+            files={'artwork': ('drawing.png', workload.image(), 'image/png')},
+            data={'keywords': 'happy, colorful'},
+        )
+        results.record('artwork', response.status_code, time.perf_counter() - started)
+    except httpx.HTTPError as e:
+        results.record('artwork', type(e).__name__, time.perf_counter() - started)
+
+
+SCENARIOS = {'generate': story_request, 'stream': stream_request, 'artwork': artwork_request}
+
+
+async def run(url, concurrency, duration, total, mix, workload, timeout):
+    results = Results()
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    deadline = time.monotonic() + duration if duration else None
+    issued = 0
+    chooser = random.Random(2)
+
+    def next_scenario():
+        nonlocal issued
+        if total and issued >= total:
+            return None
+        if deadline and time.monotonic() >= deadline:
+            return None
+        issued += 1
+        return SCENARIOS[chooser.choices(names, weights=weights)[0]]
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, headers=HEADERS, timeout=timeout, limits=limits) as client:
+        async def worker():
+            while True:
+                scenario = next_scenario()
+                if scenario is None:
+                    return
+                await scenario(client, workload, results)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall_time = time.perf_counter() - started
+    return results, wall_time
+
+
+def print_report(rows, wall_time, concurrency):
+    print(f"\n{sum(row['requests'] for row in rows)} requests in {wall_time:.1f}s at concurrency {concurrency}")
+    print(f"{'route':<10} {'reqs':>6} {'rps':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'errors':>7} {'cache hit':>9} {'ttft p50':>9}")
+    for row in rows:
+        hit = f"{row['cache_hit_rate']:.1%}" if row['cache_hit_rate'] is not None else '-'
+        ttft = f"{row['first_token_p50_ms']:.0f}" if row['first_token_p50_ms'] is not None else '-'
+        print(f"{row['route']:<10} {row['requests']:>6} {row['rps']:>7.1f} {row['p50_ms']:>8.0f} "
+              f"{row['p95_ms']:>8.0f} {row['p99_ms']:>8.0f} {row['error_rate']:>7.1%} {hit:>9} {ttft:>9}")
+        failures = {status: count for status, count in row['statuses'].items() if status != 200}
+        if failures:
+            print(f"{'':<10} failures: {failures}")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def spawn(args, workdir):
+    """Start the mock upstream and the ASGI app; returns (app_url, mock_url, processes)."""
+    mock_port, app_port = free_port(), free_port()
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    log = open(os.path.join(workdir, 'servers.log'), 'w')
+    mock = subprocess.Popen(
+        [sys.executable, '-m', 'scripts.mock_upstream', '--port', str(mock_port), *shlex.split(args.mock_args)],
+        stdout=log, stderr=subprocess.STDOUT
+    )
+    env = dict(
+        os.environ,
+        PERPLEXITY_BASE_URL=mock_url,
+        OPENROUTER_BASE_URL=mock_url,
+        PERPLEXITY_API_KEY='mock-key',
+        OPENROUTER_API_KEY='sk-mock-key',
+        RATELIMIT_ENABLED='false',
+        UPSTREAM_WARM_CONNECTIONS='0',
+        STORY_WARMER_BUDGET='0',
+        CACHE_DISK_PATH=os.path.join(workdir, 'story_cache.sqlite3'),
+        ARTWORK_CACHE_DISK_PATH=os.path.join(workdir, 'artwork_cache.sqlite3'),
+        STORY_FALLBACK_PATH=os.path.join(workdir, 'fallback_stories.sqlite3'),
+    )
+    app = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(app_port),
+         '--workers', str(args.workers), '--log-level', 'warning'],
+        stdout=log, stderr=subprocess.STDOUT, env=env
+    )
+    app_url = f"http://127.0.0.1:{app_port}"
+    try:
+        wait_for(mock_url)
+        wait_for(app_url)
+    except RuntimeError:
+        for process in (app, mock):
+            process.terminate()
+        log.flush()
+        with open(log.name) as f:
+            print(''.join(f.readlines()[-20:]), file=sys.stderr)
+        raise
+    print(f"Mock upstream on {mock_url}, app on {app_url} ({args.workers} workers); logs in {log.name}")
+    return app_url, mock_url, [app, mock]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--spawn', action='store_true', help='start the mock upstream and app locally')
+    parser.add_argument('--workers', type=int, default=1, help='app worker processes with --spawn')
+    parser.add_argument('--mock-args', default='', help='extra scripts.mock_upstream options with --spawn')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run (0 to use --requests)')
+    parser.add_argument('--requests', type=int, default=0, help='stop after this many requests')
+    parser.add_argument('--mix', default='generate=6,stream=2,artwork=2')
+    parser.add_argument('--prompts', type=int, default=50, help='distinct story requests in the pool')
+    parser.add_argument('--images', type=int, default=10, help='distinct images in the pool')
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent; 0 for uniform')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    mix = {}
+    for part in args.mix.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in SCENARIOS:
+            parser.error(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        mix[name.strip()] = float(weight or 1)
+
+    workload = Workload(args.prompts, args.images, args.skew)
+    processes = []
+    mock_url = None
+    with tempfile.TemporaryDirectory(prefix='storytales-load-') as workdir:
+        try:
+            url = args.url
+            if args.spawn:
+                url, mock_url, processes = spawn(args, workdir)
+            results, wall_time = asyncio.run(
+                run(url, args.concurrency, args.duration, args.requests, mix, workload, args.timeout)
+            )
+            rows = results.report(wall_time)
+            print_report(rows, wall_time, args.concurrency)
+            if mock_url:
+                print(f"Mock upstream: {httpx.get(mock_url + '/__stats').json()}")
+            if args.json:
+                with open(args.json, 'w') as f:
+                    json.dump({'wall_time': wall_time, 'concurrency': args.concurrency, 'routes': rows}, f, indent=2)
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait(timeout=10)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""
+Stand-in for the Perplexity and OpenRouter chat-completions APIs.
+
+Serves POST /chat/completions (Perplexity) and POST /api/v1/chat/completions
+(OpenRouter) on one port, with or without "stream": true. Stories are
+deterministic filler text whose length varies around the prompt's "under
+N words" and is cut off (finish_reason "length") at max_tokens; vision
+requests get an analysis JSON in the shape ArtworkAnalyzer expects. Latency, 5xx errors
+and 429 bursts are configurable so load tests can run offline:
+
+    python -m scripts.mock_upstream --port 8900 --latency 1.5 --error-rate 0.02 \\
+        --burst-every 60 --burst-length 5
+
+    PERPLEXITY_BASE_URL=http://127.0.0.1:8900 OPENROUTER_BASE_URL=http://127.0.0.1:8900 ...
+
+GET /__stats returns request counters.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+
+WORDS = (
+    "once upon a time there was a little dragon who loved to paint the sky with bright colors "
+    "every morning she flew over the sleepy village and the children waved from their windows "
+    "one day a curious rabbit found a shiny key under the old oak tree and wondered what it opened "
+    "together they walked past the bubbling brook through the tall grass and up the gentle hill "
+    "where the friendly owl was waiting with a warm smile and a basket full of berries"
+).split()
+
+
+class MockUpstream:
+    """ASGI app simulating the chat-completions APIs with configurable latency and failures."""
+    def __init__(self, latency=1.0, latency_sigma=0.5, ttft=0.3, chunk_delay=0.02, error_rate=0.0,
+                 rate_limit_rate=0.0, burst_every=0, burst_length=5, retry_after=2, tokens_per_word=1.3, seed=None):
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.ttft = ttft
+        self.chunk_delay = chunk_delay
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.retry_after = retry_after
+        self.tokens_per_word = tokens_per_word
+        self.random = random.Random(seed)
+        self.started = time.monotonic()
+        self.stats = {'requests': 0, 'streams': 0, 'errors': 0, 'rate_limited': 0, 'in_flight': 0}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            return
+
+        path = scope['path']
+        if scope['method'] == 'GET' and path == '/__stats':
+            return await self._send_json(send, 200, self.stats)
+        if scope['method'] != 'POST' or not path.endswith('/chat/completions'):
+            # Connection warm-up (HEAD /) and anything else
+            return await self._send_json(send, 200, {'ok': True})
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        self.stats['requests'] += 1
+        self.stats['in_flight'] += 1
+        try:
+            await self._complete(path, body, send)
+        finally:
+            self.stats['in_flight'] -= 1
+
+    async def _complete(self, path, body, send):
+        if self._rate_limited():
+            self.stats['rate_limited'] += 1
+            await asyncio.sleep(0.01)
+            return await self._send_json(
+                send, 429, {'error': {'message': 'Rate limit exceeded'}},
+                headers=[(b'retry-after', str(self.retry_after).encode())]
+            )
+        if self.random.random() < self.error_rate:
+            self.stats['errors'] += 1
+            await asyncio.sleep(self._sample(self.latency) / 2)
+            return await self._send_json(send, 500, {'error': {'message': 'Internal server error'}})
+
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            return await self._send_json(send, 400, {'error': {'message': 'Invalid JSON'}})
+
+        vision = path.startswith('/api/v1/')
+        prompt = _prompt_text(payload.get('messages') or [])
+        finish_reason = 'stop'
+        if vision:
+            content = _analysis_text(prompt)
+        else:
+            content, finish_reason = _story_text(prompt, payload.get('max_tokens') or 650, self.tokens_per_word)
+        usage = {
+            'prompt_tokens': int(len(prompt.split()) * self.tokens_per_word),
+            'completion_tokens': int(len(content.split()) * self.tokens_per_word),
+        }
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        model = payload.get('model', 'mock')
+
+        if payload.get('stream'):
+            self.stats['streams'] += 1
+            return await self._stream(send, model, content, usage, finish_reason)
+
+        await asyncio.sleep(self._sample(self.latency))
+        await self._send_json(send, 200, {
+            'id': f'mock-{self.stats["requests"]}',
+            'object': 'chat.completion',
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': finish_reason}],
+            'usage': usage,
+        })
+
+    async def _stream(self, send, model, content, usage, finish_reason='stop'):
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache')],
+        })
+        await asyncio.sleep(self._sample(self.ttft))
+        words = content.split(' ')
+        for start in range(0, len(words), 3):
+            text = ' '.join(words[start:start + 3]) + (' ' if start + 3 < len(words) else '')
+            chunk = {'model': model, 'choices': [{'index': 0, 'delta': {'content': text}, 'finish_reason': None}]}
+            await send({'type': 'http.response.body', 'body': f'data: {json.dumps(chunk)}\n\n'.encode(), 'more_body': True})
+            await asyncio.sleep(self.chunk_delay)
+        final = {'model': model, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': finish_reason}]}
+        await send({'type': 'http.response.body', 'body': f'data: {json.dumps(final)}\n\n'.encode(), 'more_body': True})
+        # Usage comes last, in a chunk of its own, as with OpenAI's stream_options.include_usage
+        usage_chunk = {'model': model, 'choices': [], 'usage': usage}
+        await send({'type': 'http.response.body', 'body': f'data: {json.dumps(usage_chunk)}\n\n'.encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'data: [DONE]\n\n'})
+
+    def _rate_limited(self):
+        if self.burst_every:
+            elapsed = (time.monotonic() - self.started) % self.burst_every
+            if elapsed >= self.burst_every - self.burst_length:
+                return True
+        return self.random.random() < self.rate_limit_rate
+
+    def _sample(self, median):
+        """Log-normal delay around median seconds, which gives the long tail real APIs have."""
+        if median <= 0:
+            return 0
+        return self.random.lognormvariate(0, self.latency_sigma) * median
+
+    async def _send_json(self, send, status, payload, headers=()):
+        body = json.dumps(payload).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()), *headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+def _prompt_text(messages):
+    parts = []
+    for message in messages:
+        content = message.get('content')
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(item.get('text', '') for item in content if isinstance(item, dict))
+    return ' '.join(parts)
+
+
+def _story_text(prompt, max_tokens, tokens_per_word=1.3):
+    """
+    Deterministic filler story for a prompt, and its finish_reason.
+
+    Its natural length is log-normal around 80% of the prompt's word limit
+    (the whole budget if there is none), like a model that mostly keeps to
+    the brief; a story longer than max_tokens is cut off.
+    """
+    rng = random.Random(hashlib.md5(prompt.encode()).hexdigest())
+    cap = max(1, int(max_tokens / tokens_per_word))
+    limit = re.search(r'under (\d+) words', prompt)
+    natural = int(rng.lognormvariate(0, 0.25) * 0.8 * int(limit.group(1))) if limit else min(cap, 1540)
+    count = min(max(20, natural), cap)
+    words = [rng.choice(WORDS) for _ in range(count)]
+    sentences = [' '.join(words[i:i + 12]).capitalize() + '.' for i in range(0, count, 12)]
+    return ' '.join(sentences), 'length' if natural > cap else 'stop'
+
+
+def _analysis_text(prompt):
+    rng = random.Random(hashlib.md5(prompt.encode()).hexdigest())
+    analysis = {
+        'comments': ['I love the bright colors you used!', 'Your lines are so bold and confident!'],
+        'questions': ['Who lives in this picture?', 'What happens next?'],
+        'story_elements': {
+            'characters': [rng.choice(['a little dragon', 'a curious rabbit', 'a friendly owl'])],
+            'setting': [rng.choice(['a sleepy village', 'a tall hill', 'a bubbling brook'])],
+            'moral': 'Friends help each other',
+        },
+    }
+    return '```json\n' + json.dumps(analysis, indent=2) + '\n```'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=1.0, help='median seconds per completion')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='log-normal spread of latency')
+    parser.add_argument('--ttft', type=float, default=0.3, help='median seconds to the first streamed token')
+    parser.add_argument('--chunk-delay', type=float, default=0.02, help='seconds between streamed chunks')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='fraction of requests answered 429')
+    parser.add_argument('--burst-every', type=float, default=0, help='start a 429 burst every N seconds')
+    parser.add_argument('--burst-length', type=float, default=5, help='seconds each 429 burst lasts')
+    parser.add_argument('--retry-after', type=int, default=2)
+    parser.add_argument('--tokens-per-word', type=float, default=1.3, help='tokens reported per word in usage')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    import uvicorn
+    app = MockUpstream(
+        latency=args.latency, latency_sigma=args.latency_sigma, ttft=args.ttft,
+        chunk_delay=args.chunk_delay, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+        burst_every=args.burst_every, burst_length=args.burst_length, retry_after=args.retry_after,
+        tokens_per_word=args.tokens_per_word, seed=args.seed,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
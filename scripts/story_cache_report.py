@@ -0,0 +1,103 @@
+"""
+Story cache hit-rate report from recorded requests.
+
+Replays story requests through prepare_story_request and compares the
+legacy cache key (the whole request dict) with the canonical key used now.
+Requests are read from app logs ("... story generation request: {...}"
+debug lines) or from JSON-lines files with one request body per line.
+
+    python -m scripts.story_cache_report app.log [more.log ...] [--cache-size 100]
+"""
+import argparse
+import ast
+import hashlib
+import json
+import re
+
+from cachetools import LRUCache
+from flask import Flask
+
+from src.app.routes.story import prepare_story_request
+from src.app.utils.cache import get_cache_key
+
+LOG_MARKER = re.compile(r'story generation request: (\{.*\})\s*$')
+
+
+def read_requests(paths):
+    """Yield request dicts from log lines or JSON lines, skipping anything else."""
+    for path in paths:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                line = line.strip()
+                try:
+                    if line.startswith('{'):
+                        data = json.loads(line)
+                    else:
+                        match = LOG_MARKER.search(line)
+                        if not match:
+                            continue
+                        # The app logs the request dict's repr, not JSON
+                        data = ast.literal_eval(match.group(1))
+                except (ValueError, SyntaxError):
+                    continue
+                if isinstance(data, dict):
+                    yield data
+
+
+def legacy_key(data):
+    """The key the cache used before canonicalization: every field, verbatim."""
+    data = json.loads(json.dumps(data))
+    data['ageGroup'] = data.get('ageGroup', 'preK')
+    if data['ageGroup'] not in ['baby', 'preK', 'growing']:
+        data['ageGroup'] = 'preK'
+    data['isArtworkFlow'] = data.get('isArtworkFlow', False)
+    if data.get('context'):
+        data.update(data['context'])
+    return hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def simulate(keys, cache_size):
+    """Hit rate for an unbounded cache and for an LRU of cache_size entries."""
+    seen = set()
+    lru = LRUCache(cache_size)
+    unbounded_hits = lru_hits = 0
+    for key in keys:
+        if key in seen:
+            unbounded_hits += 1
+        seen.add(key)
+        if lru.get(key) is not None:
+            lru_hits += 1
+        lru[key] = True
+    total = len(keys) or 1
+    return len(seen), unbounded_hits / total, lru_hits / total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--cache-size', type=int, default=100,
+                        help='memory tier size to simulate (CACHE_MEMORY_SIZE)')
+    args = parser.parse_args()
+
+    legacy_keys = []
+    canonical_keys = []
+    rejected = 0
+    # prepare_story_request only needs an app context for logging
+    with Flask(__name__).app_context():
+        for data in read_requests(args.paths):
+            key = legacy_key(data)
+            if prepare_story_request(data):
+                rejected += 1
+                continue
+            legacy_keys.append(key)
+            canonical_keys.append(get_cache_key(data))
+
+    print(f"{len(legacy_keys)} story requests ({rejected} rejected as invalid)")
+    print(f"{'key':<10} {'distinct':>9} {'hit rate':>9} {'LRU ' + str(args.cache_size):>9}")
+    for name, keys in (('legacy', legacy_keys), ('canonical', canonical_keys)):
+        distinct, unbounded, lru = simulate(keys, args.cache_size)
+        print(f"{name:<10} {distinct:>9} {unbounded:>9.1%} {lru:>9.1%}")
+
+
+if __name__ == '__main__':
+    main()
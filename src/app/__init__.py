@@ -1,13 +1,24 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from config.settings import Config
+from src.app.models import db
 from src.app.utils.limiter import limiter
+from src.app.utils.http_client import upstream
+from src.app.utils.cache import story_cache, artwork_cache, story_fallbacks
+from src.app.utils.library import story_library
+from src.app.utils.similarity import story_index
+from src.app.utils.phash_index import artwork_index
+from src.app.utils.warmer import story_warmer
+from src.app.utils.jobs import story_jobs
+from src.app.utils.metrics import metrics
+from src.app.utils.deadline import request_deadlines
+from src.app.utils.hedging import artwork_hedger, artwork_stream_hedger
+from src.app.utils.token_budget import story_token_budget
+from src.app.utils.logs import app_logging
+from src.app.utils.assets import static_assets
 from flask_talisman import Talisman
 import os
 from dotenv import load_dotenv
 
-db = SQLAlchemy()
-
 def create_app(config_class=Config):
     # Load environment variables first
     load_dotenv()
@@ -22,12 +33,15 @@ def create_app(config_class=Config):
     app.config.from_object(config_class)
     app.config.update(config_class.FEATURES)  # Add features to config
 
+    # Before anything logs, so Flask doesn't attach its own stderr handler
+    app_logging.init_app(app)
+
     # Add API key to config
     app.config['OPENROUTER_API_KEY'] = os.getenv('OPENROUTER_API_KEY')
 
     # Verify API key is loaded
     OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
-    app.logger.debug(f"API Key loaded: {bool(OPENROUTER_API_KEY)}")
+    app.logger.debug("API Key loaded: %s", bool(OPENROUTER_API_KEY))
     if not OPENROUTER_API_KEY:
         app.logger.error("OPENROUTER_API_KEY environment variable is not set")
         # Don't raise error, just log it
@@ -44,7 +58,22 @@ def create_app(config_class=Config):
     })
 
     db.init_app(app)
+    story_index.init_app(app)
+    story_library.init_app(app)
     limiter.init_app(app)
+    upstream.init_app(app)
+    story_cache.init_app(app)
+    artwork_cache.init_app(app)
+    artwork_index.init_app(app)
+    story_fallbacks.init_app(app)
+    story_warmer.init_app(app)
+    story_jobs.init_app(app)
+    metrics.init_app(app)
+    request_deadlines.init_app(app)
+    artwork_hedger.init_app(app)
+    artwork_stream_hedger.init_app(app)
+    story_token_budget.init_app(app)
+    static_assets.init_app(app)
     csp = {
         'default-src': ['\'self\''],
         'script-src': [
@@ -104,7 +133,4 @@ def create_app(config_class=Config):
     if not os.path.exists(images_dir):
         os.makedirs(images_dir)
 
-    if app.debug:
-        app.logger.setLevel('DEBUG')
-
     return app 
\ No newline at end of file
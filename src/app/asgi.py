@@ -0,0 +1,328 @@
+import asyncio
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from flask import current_app
+
+from src.app.routes.story import (
+    artwork_failure_message,
+    artwork_response,
+    fallback_story_response,
+    job_wait_seconds,
+    prepare_story_request,
+    story_failure_response,
+    story_job_response,
+    validate_artwork_upload,
+    with_story_id,
+)
+from src.app.utils.cache import cache_story, get_cache_key, get_cached_story
+from src.app.utils.http_client import upstream
+from src.app.utils.jobs import ACTIVE, story_jobs
+from src.app.utils.limiter import hit_story_generation_limits, limiter
+from src.app.utils.logs import PAYLOAD
+from src.app.utils.metrics import bind, metrics, stage_timer
+from src.app.utils.singleflight import artwork_flights, story_flights
+from src.app.utils.warmer import story_warmer
+from src.llm_models.artwork_analyzer import ArtworkAnalyzer
+from src.llm_models.story_generator import StoryGenerator
+
+JOB_PATH_PREFIX = '/story/jobs/'
+
+# Largest request bodies accepted by the async routes
+MAX_JSON_BODY = 64 * 1024
+MAX_UPLOAD_BODY = 6 * 1024 * 1024  # 5MB image plus multipart overhead
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    """
+    WsgiToAsgi that runs each WSGI request on its own pool thread.
+
+    asgiref runs every request on a single shared thread by default, which
+    serializes all Flask-served routes (streams included) behind the slowest.
+    """
+    def __init__(self, wsgi_application, max_threads=64):
+        super().__init__(wsgi_application)
+        executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='wsgi')
+        run_wsgi_app = sync_to_async(
+            WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False, executor=executor
+        )
+        self._instance_class = type(
+            'ThreadedWsgiToAsgiInstance', (WsgiToAsgiInstance,), {'run_wsgi_app': run_wsgi_app}
+        )
+
+    async def __call__(self, scope, receive, send):
+        await self._instance_class(self.wsgi_application)(scope, receive, send)
+
+
+class AsyncStoryApp:
+    """
+    ASGI application that serves the upstream-bound routes on asyncio.
+
+    POST /story/generate and POST /story/artwork/analyze run as coroutines
+    using the shared httpx clients, so waiting on Perplexity or OpenRouter
+    doesn't hold a worker thread. At most ``max_inflight`` of them run at
+    once; a request whose client disconnects is cancelled, which aborts its
+    upstream call. Long-polls of GET /story/jobs/<id> wait here too. Every
+    other route is handed to the Flask app unchanged.
+
+    Each request runs in a Flask request context with the app's
+    before/after_request hooks (HTTPS redirect and security headers,
+    deadline, metrics), so responses match the WSGI routes. Cache,
+    limiter and job-store calls touch SQLite and run on threads.
+    """
+    def __init__(self, flask_app, max_inflight=None):
+        self.flask_app = flask_app
+        self.wsgi_app = ThreadedWsgiToAsgi(flask_app, flask_app.config.get('ASYNC_WSGI_THREADS', 64))
+        self.max_inflight = max_inflight or flask_app.config.get('ASYNC_MAX_INFLIGHT', 200)
+        self._semaphore = None
+        self.routes = {
+            ('POST', '/story/generate'): (self.generate_story, MAX_JSON_BODY),
+            ('POST', '/story/artwork/analyze'): (self.analyze_artwork, MAX_UPLOAD_BODY),
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+
+        if scope['type'] == 'http':
+            path = scope['path'].rstrip('/') or '/'
+            route = self.routes.get((scope['method'], path))
+            if route is None and scope['method'] == 'GET' and path.startswith(JOB_PATH_PREFIX):
+                route = (self.poll_story_job, MAX_JSON_BODY)
+            if route:
+                return await self._dispatch(*route, scope, receive, send)
+
+        await self.wsgi_app(scope, receive, send)
+
+    async def generate_story(self, request):
+        """Async twin of routes.story.generate_story with the same JSON contract."""
+        breached = await asyncio.to_thread(hit_story_generation_limits, request.remote_addr) if limiter.enabled else None
+        if breached:
+            metrics.rate_limited.inc(route='generate_story')
+            return {
+                'error': 'Too many requests. Please wait a moment before trying again.',
+                'retry_after': str(breached)
+            }, 429
+
+        try:
+            with stage_timer('request_parse'):
+                data = request.get_json(silent=True)
+            if not isinstance(data, dict):
+                return {'error': 'Please provide a story prompt'}, 400
+
+            current_app.logger.debug("Received async story generation request: %s", data, extra=PAYLOAD)
+
+            error = prepare_story_request(data)
+            if error:
+                return {'error': error}, 400
+            story_warmer.record(data)
+
+            cached_story = await asyncio.to_thread(get_cached_story, data)
+            if cached_story:
+                current_app.logger.info("Returning cached story")
+                return with_story_id({'story': cached_story, 'cached': True}, data), 200
+
+            try:
+                story, shared = await story_flights.ado(get_cache_key(data), self._generate_and_cache, data)
+            except Exception as e:
+                fallback = await asyncio.to_thread(fallback_story_response, data, e)
+                if fallback is None:
+                    raise
+                return fallback, 200
+            if shared:
+                current_app.logger.info("Shared in-flight story generation")
+
+            return with_story_id({'story': story, 'cached': False, 'success': True}, data), 200
+
+        except Exception as e:
+            current_app.logger.error(f"Story generation failed: {str(e)}")
+            return story_failure_response(e)
+
+    async def analyze_artwork(self, request):
+        """Async twin of routes.story.analyze_artwork with the same JSON contract."""
+        try:
+            bind(flow='artwork')
+            api_key = current_app.config.get('OPENROUTER_API_KEY')
+            with stage_timer('request_parse'):
+                files = request.files
+                keywords = request.form.get('keywords', '')
+            artwork_file, error = validate_artwork_upload(files, api_key)
+            if error:
+                return {'error': error[0]}, error[1]
+
+            analyzer = ArtworkAnalyzer()
+            cache_key = analyzer.request_key(artwork_file, keywords)
+            analysis_result, shared = await artwork_flights.ado(
+                cache_key, analyzer.aanalyze_artwork, artwork_file, keywords, cache_key
+            )
+            if shared:
+                current_app.logger.info("Shared in-flight artwork analysis")
+
+            if not analysis_result.get('success'):
+                current_app.logger.error(f"Analysis failed: {analysis_result.get('details', 'Unknown error')}")
+                return {'error': 'Failed to analyze artwork'}, 500
+
+            return artwork_response(analysis_result), 200
+
+        except Exception as e:
+            current_app.logger.error(f'Artwork analysis failed: {str(e)}')
+            return {'error': artwork_failure_message(e)}, 500
+
+    async def poll_story_job(self, request):
+        """Async twin of routes.story.get_story_job; a long-poll waits without holding a thread."""
+        if not story_jobs.enabled:
+            return {'error': 'Story jobs are not available'}, 404
+
+        job_id = request.path.rstrip('/')[len(JOB_PATH_PREFIX):]
+        deadline = time.monotonic() + job_wait_seconds(request.args)
+        job = await asyncio.to_thread(story_jobs.get, job_id)
+        while job is not None and job['status'] in ACTIVE and time.monotonic() < deadline:
+            await asyncio.sleep(story_jobs.poll_interval)
+            job = await asyncio.to_thread(story_jobs.get, job_id)
+        if job is None:
+            return {'error': 'Story job not found'}, 404
+        return story_job_response(job)
+
+    async def _generate_and_cache(self, data):
+        story = await StoryGenerator().agenerate_story(data)
+        await asyncio.to_thread(cache_story, data, story)
+        return story
+
+    async def _dispatch(self, handler, max_body, scope, receive, send):
+        body, too_large = await self._read_body(receive, max_body)
+        if too_large:
+            return await self._send_response(send, await self._run(_body_too_large, scope, b''))
+        if body is None:
+            # Client went away before the body arrived
+            return
+
+        handler_task = asyncio.ensure_future(self._run(handler, scope, body))
+        disconnect_task = asyncio.ensure_future(_wait_for_disconnect(receive))
+
+        done, _ = await asyncio.wait(
+            {handler_task, disconnect_task},
+            return_when=asyncio.FIRST_COMPLETED
+        )
+
+        if handler_task not in done:
+            # Client hung up; cancel so the upstream request is aborted too
+            handler_task.cancel()
+            try:
+                await handler_task
+            except asyncio.CancelledError:
+                pass
+            self.flask_app.logger.info("Client disconnected, cancelled %s", scope['path'])
+            return
+
+        disconnect_task.cancel()
+        await self._send_response(send, handler_task.result())
+
+    async def _run(self, handler, scope, body):
+        """Run handler like a Flask view: inside a request context, between the app's request hooks."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_inflight)
+        app = self.flask_app
+        async with self._semaphore:
+            with app.request_context(_build_environ(scope, body)) as ctx:
+                # Deadline, metrics labels, HTTPS redirect; a hook may answer the request itself
+                response = app.preprocess_request()
+                if response is None:
+                    response = await handler(ctx.request)
+                with stage_timer('response_serialize'):
+                    response = app.make_response(response)
+                return app.process_response(response)
+
+    async def _read_body(self, receive, max_body):
+        """Read the full request body. Returns (body, too_large); body is None on disconnect."""
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None, False
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > max_body:
+                return None, True
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                return b''.join(chunks), False
+
+    async def _send_response(self, send, response):
+        body = response.get_data()
+        response.content_length = len(body)
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in response.headers.to_wsgi_list()
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await upstream.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+async def _body_too_large(request):
+    return {'error': 'Request body too large'}, 413
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+def _build_environ(scope, body):
+    """Build the WSGI environ Flask would get for this request, with body as its input."""
+    headers = {}
+    for name, value in scope.get('headers', []):
+        headers[name.decode('latin-1').lower()] = value.decode('latin-1')
+
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': (scope.get('server') or ('localhost', 80))[0],
+        'SERVER_PORT': str((scope.get('server') or ('localhost', 80))[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'CONTENT_TYPE': headers.get('content-type', ''),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'wsgi.version': (1, 0),
+    }
+    # Proxy and security hooks read X-Forwarded-* and friends
+    for name, value in headers.items():
+        if name not in ('content-type', 'content-length'):
+            environ[f"HTTP_{name.upper().replace('-', '_')}"] = value
+    return environ
+
+
+def create_asgi_app(flask_app=None):
+    """Wrap a Flask app (or a fresh one from create_app) in AsyncStoryApp."""
+    if flask_app is None:
+        from src.app import create_app
+        flask_app = create_app()
+    return AsyncStoryApp(flask_app)
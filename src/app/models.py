@@ -0,0 +1,31 @@
+import hashlib
+
+from flask_sqlalchemy import SQLAlchemy
+
+db = SQLAlchemy()
+
+
+class Story(db.Model):
+    """A generated story kept in the library, one per canonical request (see get_cache_key)."""
+    __tablename__ = 'stories'
+
+    id = db.Column(db.String(16), primary_key=True)  # Public id, derived from request_key
+    request_key = db.Column(db.String(32), nullable=False, unique=True)
+    age_group = db.Column(db.String(16), nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+    text = db.Column(db.Text, nullable=False)
+    request = db.Column(db.Text, nullable=False)  # Canonical request as JSON
+    created_at = db.Column(db.Float, nullable=False, index=True)
+
+    @property
+    def etag(self):
+        return hashlib.sha256(f'{self.title}\n{self.text}'.encode()).hexdigest()[:20]
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'story': self.text,
+            'ageGroup': self.age_group,
+            'created_at': self.created_at,
+        }
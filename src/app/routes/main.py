@@ -1,8 +1,22 @@
-from flask import Blueprint, render_template
+import hmac
+
+from flask import Blueprint, Response, abort, current_app, render_template, request
+from src.app.utils.metrics import metrics
 
 bp = Blueprint('main', __name__)
 
 @bp.route('/')
 def index():
     """Homepage with story creation options"""
-    return render_template('index.html') 
\ No newline at end of file
+    return render_template('index.html') 
+
+@bp.route('/metrics')
+def metrics_view():
+    """Prometheus metrics for this worker process, for scrapers sending Authorization: Bearer <METRICS_TOKEN>."""
+    token = current_app.config.get('METRICS_TOKEN')
+    # Route names, cache sizes and breaker state aren't for everyone; no token, no endpoint
+    if not metrics.enabled or not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain', headers={'WWW-Authenticate': 'Bearer'})
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
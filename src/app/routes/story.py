@@ -1,17 +1,37 @@
-from flask import Blueprint, request, jsonify, current_app, render_template
+from flask import Blueprint, request, jsonify, current_app, render_template, Response, stream_with_context
 from werkzeug.exceptions import HTTPException
-from src.llm_models.story_generator import StoryGenerator
-from src.app.utils.cache import get_cached_story, cache_story
-from src.app.utils.limiter import limiter
+from src.llm_models.story_generator import StoryGenerator, pick_story_template
+from src.app.utils.cache import get_cached_story, cache_story, get_cache_key, get_fallback_story, get_story_id
+from src.app.utils.library import story_library
+from src.app.utils.warmer import story_warmer
+from src.app.utils.jobs import ACTIVE, DONE, story_jobs
+from src.app.utils.singleflight import story_flights, artwork_flights
+from src.app.utils.breaker import UpstreamUnavailable
+from src.app.utils.deadline import DeadlineExceeded, time_left
+from src.app.utils.limiter import story_generation_limit
+from src.app.utils.metrics import bind, metrics, stage_timer
+from src.app.utils.logs import PAYLOAD
 from config.settings import Config
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import contextvars
 import re
 import json
+import math
 from src.llm_models.artwork_analyzer import ArtworkAnalyzer
 import os
 import tempfile
 
 bp = Blueprint('story', __name__, url_prefix='/story')
 
+# How long a streaming follower waits on the leader's generation (seconds)
+FOLLOWER_TIMEOUT = 180
+
+AGE_GROUPS = ('baby', 'preK', 'growing')
+# Most variants of one story a batch may ask for per age group
+MAX_VARIANTS = 3
+
+_batch_pool = None
+
 def clean_input(text):
     """Clean and normalize user input"""
     # Remove extra whitespace and normalize punctuation
@@ -23,139 +43,582 @@ def clean_input(text):
     # Split by comma, clean each keyword, and rejoin with commas
     return ', '.join(word.strip() for word in text.split(','))
 
+def prepare_story_request(data):
+    """Validate and normalize a story request in place. Returns an error message or None."""
+    # Extract context if available
+    context = data.get('context', {})
+    if context:
+        current_app.logger.debug("Story context: %s", context, extra=PAYLOAD)
+    
+    # Validate required fields
+    if not data.get('mainPrompt', '').strip():
+        return 'Please provide a story prompt'
+
+    # Set and validate age group
+    data['ageGroup'] = data.get('ageGroup', 'preK')
+    if data['ageGroup'] not in AGE_GROUPS:
+        data['ageGroup'] = 'preK'
+
+    # Batches number extra variants of a story; each is cached under its own key
+    variant = data.pop('variant', 0)
+    if isinstance(variant, int) and not isinstance(variant, bool) and 0 < variant < MAX_VARIANTS:
+        data['variant'] = variant
+
+    # Ensure isArtworkFlow is passed through
+    data['isArtworkFlow'] = data.get('isArtworkFlow', False)
+    bind(age_group=data['ageGroup'], flow='artwork' if data['isArtworkFlow'] else 'direct')
+    
+    # Add context to data if available
+    if context:
+        data.update(context)
+
+    for field in ('mainPrompt', 'moral', 'creature', 'magic', 'vibe'):
+        if isinstance(data.get(field), str):
+            data[field] = clean_input(data[field])
+
+    # Fix the artwork template up front so the cached story matches its key
+    data.pop('template', None)
+    if data['isArtworkFlow']:
+        data['template'] = pick_story_template(data, seed=get_cache_key(data))['name']
+    
+    current_app.logger.debug("Story flow type: %s", 'Artwork' if data['isArtworkFlow'] else 'Direct')
+    return None
+
+def generate_and_cache_story(data):
+    """Generate a story upstream and cache it before any waiting followers are released."""
+    story = StoryGenerator().generate_story(data)
+    cache_story(data, story)
+    return story
+
+def with_story_id(body, data):
+    """Add the id the request's story is shared under (GET /story/<id>), if there is a library."""
+    story_id = get_story_id(data)
+    if story_id:
+        body['id'] = story_id
+    return body
+
+def fallback_story_response(data, e):
+    """Build a response serving a stored story after generation failed, or None if there is none."""
+    fallback = get_fallback_story(data)
+    if not fallback:
+        return None
+    current_app.logger.warning(f"Serving fallback story after generation failed: {str(e)}")
+    return {'story': fallback, 'cached': True, 'fallback': True, 'success': True}
+
+def story_failure_response(e):
+    """Map a story generation exception to (body, status); refused or out-of-time upstream calls are 503/504."""
+    if isinstance(e, DeadlineExceeded):
+        return {'error': 'The story is taking longer than usual to generate. Please try again in a moment.'}, 504
+    if isinstance(e, UpstreamUnavailable):
+        body = {'error': 'Our storytellers are very busy right now. Please try again in a moment.'}
+        if e.retry_after:
+            body['retry_after'] = math.ceil(e.retry_after)
+        return body, 503
+    return {'error': str(e)}, 500
+
+def sse_event(event, payload):
+    """Format a single Server-Sent Event frame."""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def sse_response(events):
+    """Wrap an event iterator in an unbuffered text/event-stream response."""
+    response = Response(events, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx-style proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @bp.route('/generate', methods=['POST'])
-@limiter.limit("5 per minute")
+@story_generation_limit
 def generate_story():
     """Generate a story based on user input."""
     try:
-        data = request.get_json()
-        
-        current_app.logger.debug(f"Received request at /story/generate")
-        current_app.logger.debug(f"Received story generation request: {data}")
+        with stage_timer('request_parse'):
+            data = request.get_json()
         
-        # Extract context if available
-        context = data.get('context', {})
-        if context:
-            current_app.logger.debug(f"Story context: {context}")
+        current_app.logger.debug("Received story generation request: %s", data, extra=PAYLOAD)
         
-        # Validate required fields
-        if not data.get('mainPrompt', '').strip():
-            return jsonify({'error': 'Please provide a story prompt'}), 400
-
-        # Set and validate age group
-        data['ageGroup'] = data.get('ageGroup', 'preK')
-        if data['ageGroup'] not in ['baby', 'preK', 'growing']:
-            data['ageGroup'] = 'preK'
-
-        # Ensure isArtworkFlow is passed through
-        data['isArtworkFlow'] = data.get('isArtworkFlow', False)
-        
-        # Add context to data if available
-        if context:
-            data.update(context)
-        
-        current_app.logger.debug(f"Story flow type: {'Artwork' if data['isArtworkFlow'] else 'Direct'}")
+        error = prepare_story_request(data)
+        if error:
+            return jsonify({'error': error}), 400
+        story_warmer.record(data)
 
         # Check cache first
         cached_story = get_cached_story(data)
         if cached_story:
             current_app.logger.info("Returning cached story")
-            return jsonify({
-                'story': cached_story,
-                'cached': True
-            })
+            with stage_timer('response_serialize'):
+                return jsonify(with_story_id({
+                    'story': cached_story,
+                    'cached': True
+                }, data))
 
-        # Generate story
-        story_generator = StoryGenerator()
-        story = story_generator.generate_story(data)
-        
-        current_app.logger.debug(f"Generated story: {story[:100]}...")  # Log first 100 chars
+        # Generate story; identical requests already in flight share one upstream call
+        try:
+            story, shared = story_flights.do(get_cache_key(data), generate_and_cache_story, data)
+        except Exception as e:
+            fallback = fallback_story_response(data, e)
+            if fallback is None:
+                raise
+            return jsonify(fallback)
+        if shared:
+            current_app.logger.info("Shared in-flight story generation")
         
-        # Cache the new story
-        cache_story(data, story)
+        current_app.logger.debug("Generated story: %.100s...", story, extra=PAYLOAD)
         
-        return jsonify({
-            'story': story,
-            'cached': False,
-            'success': True
-        })
+        with stage_timer('response_serialize'):
+            return jsonify(with_story_id({
+                'story': story,
+                'cached': False,
+                'success': True
+            }, data))
 
     except Exception as e:
+        current_app.logger.error(f"Story generation failed: {str(e)}")
+        body, status = story_failure_response(e)
+        return jsonify(body), status
+
+@bp.route('/generate/stream', methods=['POST'])
+@story_generation_limit
+def generate_story_stream():
+    """Generate a story and stream it to the browser as Server-Sent Events.
+
+    Emits "token" events carrying {"text": ...} deltas, then a single "done"
+    event ({"cached": bool}) or an "error" event ({"error": ...}).
+    """
+    with stage_timer('request_parse'):
+        data = request.get_json(silent=True) or {}
+    current_app.logger.debug("Received streaming story generation request: %s", data, extra=PAYLOAD)
+
+    error = prepare_story_request(data)
+    if error:
+        return jsonify({'error': error}), 400
+    story_warmer.record(data)
+
+    cached_story = get_cached_story(data)
+    if cached_story:
+        current_app.logger.info("Replaying cached story over stream")
+
+        def replay():
+            yield sse_event('token', {'text': cached_story})
+            yield sse_event('done', with_story_id({'cached': True, 'success': True}, data))
+
+        return sse_response(replay())
+
+    def fallback_events(e):
+        fallback = fallback_story_response(data, e)
+        if fallback is None:
+            yield sse_event('error', story_failure_response(e)[0])
+            return
+        yield sse_event('token', {'text': fallback['story']})
+        yield sse_event('done', {'cached': True, 'fallback': True, 'success': True})
+
+    cache_key = get_cache_key(data)
+    call, is_leader = story_flights.begin(cache_key)
+    if not is_leader:
+        current_app.logger.info("Following in-flight story generation")
+
+        def follow():
+            try:
+                story = story_flights.wait(call, timeout=time_left(FOLLOWER_TIMEOUT))
+            except Exception as e:
+                yield from fallback_events(e)
+                return
+            yield sse_event('token', {'text': story})
+            yield sse_event('done', with_story_id({'cached': False, 'success': True}, data))
+
+        return sse_response(stream_with_context(follow()))
+
+    try:
+        story_generator = StoryGenerator()
+    except Exception as e:
+        story_flights.finish(cache_key, call, error=e)
         current_app.logger.error(f"Story generation failed: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+    def generate():
+        parts = []
+        story = None
+        error = None
+        try:
+            for text in story_generator.stream_story(data):
+                parts.append(text)
+                yield sse_event('token', {'text': text})
+
+            story = ''.join(parts).strip()
+            if not story:
+                error = Exception('No story generated')
+                yield sse_event('error', {'error': str(error)})
+                return
+
+            # Only complete stories are cached so replays never serve a fragment
+            cache_story(data, story)
+            current_app.logger.debug("Streamed story length: %d", len(story))
+            yield sse_event('done', with_story_id({'cached': False, 'success': True}, data))
+        except Exception as e:
+            error = e
+            current_app.logger.error(f"Story streaming failed: {str(e)}")
+            if parts:
+                yield sse_event('error', {'error': str(e)})
+            else:
+                # Nothing shown yet, so a stored story can stand in
+                yield from fallback_events(e)
+        finally:
+            if story is None and error is None:
+                # The client disconnected mid-stream
+                error = Exception('Story generation was interrupted. Please try again.')
+            story_flights.finish(cache_key, call, result=story if not error else None, error=error)
+
+    return sse_response(stream_with_context(generate()))
+
+def batch_pool():
+    """Threads that run batch items concurrently; created per process on first use."""
+    global _batch_pool
+    if _batch_pool is None or _batch_pool[0] != os.getpid():
+        _batch_pool = (os.getpid(), ThreadPoolExecutor(
+            max_workers=current_app.config.get('STORY_BATCH_THREADS', 16), thread_name_prefix='story-batch'
+        ))
+    return _batch_pool[1]
+
+def generate_batch_item(app, item):
+    """Generate one batch item on a pool thread. Returns the item's event payload."""
+    data = item['data']
+    event = {'index': item['index'], 'ageGroup': data['ageGroup'], 'variant': data.get('variant', 0)}
+    with app.app_context():
+        bind(age_group=data['ageGroup'])
+        try:
+            story, _ = story_flights.do(get_cache_key(data), generate_and_cache_story, data)
+            event.update(with_story_id({'story': story, 'cached': False, 'success': True}, data))
+        except Exception as e:
+            current_app.logger.error(f"Batch story generation failed: {str(e)}")
+            fallback = fallback_story_response(data, e)
+            event.update(fallback or story_failure_response(e)[0])
+    return event
+
+@bp.route('/generate/batch', methods=['POST'])
+@story_generation_limit
+def generate_story_batch():
+    """Generate one story for several age groups (and/or variants) concurrently, streamed as SSE.
+
+    Takes a story request plus "ageGroups" (default: the request's
+    ageGroup) and "variants" per age group (default 1). Emits a "batch"
+    event listing the items, an "item" event per story as soon as it is
+    ready (cached items first), then "done". Counts as one request
+    against the rate limits.
+    """
+    with stage_timer('request_parse'):
+        data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Please provide a story prompt'}), 400
+    current_app.logger.debug("Received batch story generation request: %s", data, extra=PAYLOAD)
+
+    age_groups = data.pop('ageGroups', None) or [data.get('ageGroup', 'preK')]
+    variants = data.pop('variants', 1)
+    if not isinstance(age_groups, list) or any(group not in AGE_GROUPS for group in age_groups):
+        return jsonify({'error': f"ageGroups must be a list of {', '.join(AGE_GROUPS)}"}), 400
+    if not isinstance(variants, int) or isinstance(variants, bool) or not 1 <= variants <= MAX_VARIANTS:
+        return jsonify({'error': f'variants must be between 1 and {MAX_VARIANTS}'}), 400
+
+    items = []
+    for age_group in dict.fromkeys(age_groups):
+        for variant in range(variants):
+            item = json.loads(json.dumps(data))  # Items are prepared (mutated) independently
+            item.update(ageGroup=age_group, variant=variant)
+            error = prepare_story_request(item)
+            if error:
+                return jsonify({'error': error}), 400
+            story_warmer.record(item)
+            items.append({'index': len(items), 'data': item})
+
+    app = current_app._get_current_object()
+    ready = []
+    pending = []
+    for item in items:
+        cached_story = get_cached_story(item['data'])
+        if cached_story:
+            ready.append(with_story_id({
+                'index': item['index'], 'ageGroup': item['data']['ageGroup'],
+                'variant': item['data'].get('variant', 0), 'story': cached_story, 'cached': True, 'success': True
+            }, item['data']))
+        else:
+            # copy_context carries the request deadline and metric labels onto the pool thread
+            pending.append(batch_pool().submit(contextvars.copy_context().run, generate_batch_item, app, item))
+
+    def events():
+        yield sse_event('batch', {'items': [
+            {'index': item['index'], 'ageGroup': item['data']['ageGroup'], 'variant': item['data'].get('variant', 0)}
+            for item in items
+        ]})
+        failed = 0
+        for event in ready:
+            yield sse_event('item', event)
+        for future in as_completed(pending):
+            event = future.result()
+            failed += 0 if event.get('success') else 1
+            yield sse_event('item', event)
+        yield sse_event('done', {'count': len(items), 'failed': failed})
+
+    return sse_response(stream_with_context(events()))
+
+def job_wait_seconds(args):
+    """The ?wait= long-poll time requested, capped below typical proxy idle timeouts."""
+    try:
+        wait = float(args.get('wait', 0) or 0)
+    except ValueError:
+        return 0.0
+    return max(0.0, min(wait, current_app.config.get('STORY_JOB_MAX_WAIT', 25)))
+
+def story_job_response(job):
+    """Build (body, status) for a job: 202 while it is pending, 200 once it has finished."""
+    body = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'status_url': f"{bp.url_prefix}/jobs/{job['id']}",
+    }
+    if job['status'] == DONE:
+        body.update(job['result'], success=True)
+    elif job['error']:
+        body['error'] = job['error']
+    return body, 202 if job['status'] in ACTIVE else 200
+
+@bp.route('/jobs', methods=['POST'])
+@story_generation_limit
+def create_story_job():
+    """Queue a story generation and return its job id without waiting for the story.
+
+    Poll GET /story/jobs/<job_id> (optionally with ?wait=<seconds> to
+    long-poll) for the result. Identical pending requests share one job.
+    """
+    if not story_jobs.enabled:
+        return jsonify({'error': 'Story jobs are not available'}), 404
+
+    with stage_timer('request_parse'):
+        data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Please provide a story prompt'}), 400
+    current_app.logger.debug("Received story job request: %s", data, extra=PAYLOAD)
+
+    error = prepare_story_request(data)
+    if error:
+        return jsonify({'error': error}), 400
+    story_warmer.record(data)
+
+    try:
+        cached_story = get_cached_story(data)
+        if cached_story:
+            job = story_jobs.submit_finished(data, with_story_id({'story': cached_story, 'cached': True}, data))
+        else:
+            job = story_jobs.submit(data)
+    except Exception as e:
+        current_app.logger.error(f"Queueing story job failed: {str(e)}")
+        return jsonify({'error': 'Could not queue the story. Please try again.'}), 500
+
+    body, status = story_job_response(job)
+    response = jsonify(body)
+    response.headers['Location'] = body['status_url']
+    return response, status
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def get_story_job(job_id):
+    """Return a story job's status and, once done, its story."""
+    if not story_jobs.enabled:
+        return jsonify({'error': 'Story jobs are not available'}), 404
+
+    wait = job_wait_seconds(request.args)
+    job = story_jobs.wait(job_id, wait) if wait else story_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Story job not found'}), 404
+
+    body, status = story_job_response(job)
+    return jsonify(body), status
+
+@bp.route('/search', methods=['GET'])
+def search_stories():
+    """Search the story library's titles and text: GET /story/search?q=<words>[&limit=<n>]."""
+    if not story_library.enabled:
+        return jsonify({'error': 'The story library is not available'}), 404
+    query = request.args.get('q', '').strip()
+    limit = request.args.get('limit', 20, type=int)
+    if not query:
+        return jsonify({'error': 'Please provide something to search for'}), 400
+    with stage_timer('library_search'):
+        results = story_library.search(query, max(1, min(limit, 50)))
+    return jsonify({'results': results})
+
+@bp.route('/<story_id>', methods=['GET'])
+def get_story(story_id):
+    """A stored story by id. Stories never change once stored, so shared links cache well."""
+    story = story_library.get(story_id)
+    if story is None:
+        return jsonify({'error': 'Story not found'}), 404
+    response = jsonify(story.to_dict())
+    response.set_etag(story.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config.get('STORY_LIBRARY_MAX_AGE', 86400)
+    # Answers If-None-Match revalidations with 304 and no body
+    return response.make_conditional(request)
+
 @bp.errorhandler(429)
 def ratelimit_handler(e):
     """Handle rate limit errors with a proper JSON response"""
+    metrics.rate_limited.inc(route=(request.endpoint or 'unknown').rsplit('.', 1)[-1])
     return jsonify({
         'error': 'Too many requests. Please wait a moment before trying again.',
         'retry_after': e.description
     }), 429
 
+def validate_artwork_upload(files, api_key):
+    """Check an artwork upload. Returns (file, None) or (None, (message, status))."""
+    if 'artwork' not in files:
+        return None, ('No artwork file provided', 400)
+        
+    artwork_file = files['artwork']
+    if not artwork_file.filename:
+        return None, ('No selected file', 400)
+        
+    # Verify API key before making request
+    if not api_key:
+        current_app.logger.error('OpenRouter API key not configured')
+        return None, ('Service configuration error', 500)
+        
+    # Validate file type
+    if not artwork_file.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
+        return None, ('Please upload a valid image file (PNG, JPG, JPEG, GIF)', 400)
+    
+    return artwork_file, None
+
+def artwork_failure_message(e):
+    """Map an artwork analysis exception to a user-facing error message."""
+    if '401' in str(e) or 'credentials' in str(e).lower():
+        # Check environment variable
+        api_key = os.getenv('OPENROUTER_API_KEY', '')
+        if not api_key:
+            return 'API key not found in environment'
+        elif not api_key.strip().startswith('sk-'):
+            return 'Invalid API key format'
+        else:
+            return 'API authentication failed. Please check API key.'
+    return 'Failed to analyze artwork'
+
+def artwork_response(analysis_result):
+    """The response body for a successful analysis (the analysis data is nested under 'analysis')."""
+    analysis = analysis_result['analysis']
+    return {
+        'success': True,
+        'analysis': {
+            'story_elements': analysis['story_elements'],
+            'comments': analysis['comments'],
+            'questions': analysis['questions']
+        }
+    }
+
 @bp.route('/artwork/analyze', methods=['POST'])
 def analyze_artwork():
     try:
-        # Debug environment variables
         api_key = os.getenv('OPENROUTER_API_KEY')
-        current_app.logger.debug(f"Environment variables:")
-        current_app.logger.debug(f"OPENROUTER_API_KEY present: {bool(api_key)}")
-        current_app.logger.debug(f"All env vars: {list(os.environ.keys())}")
         
-        current_app.logger.debug(f"Files in request: {request.files}")
-        current_app.logger.debug(f"Form data: {request.form}")
+        bind(flow='artwork')
+        with stage_timer('request_parse'):
+            files = request.files
+            keywords = request.form.get('keywords', '')
+        current_app.logger.debug("Files in request: %s, form data: %s", files, request.form, extra=PAYLOAD)
         
-        if 'artwork' not in request.files:
-            return jsonify({'error': 'No artwork file provided'}), 400
-            
-        artwork_file = request.files['artwork']
-        if not artwork_file.filename:
-            return jsonify({'error': 'No selected file'}), 400
-            
-        # Verify API key before making request
-        if not api_key:
-            current_app.logger.error('OpenRouter API key not configured')
-            return jsonify({'error': 'Service configuration error'}), 500
-            
-        # Validate file type
-        if not artwork_file.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
-            return jsonify({'error': 'Please upload a valid image file (PNG, JPG, JPEG, GIF)'}), 400
-            
-        keywords = request.form.get('keywords', '')
+        artwork_file, error = validate_artwork_upload(files, api_key)
+        if error:
+            return jsonify({'error': error[0]}), error[1]
         
         analyzer = ArtworkAnalyzer()
-        analysis_result = analyzer.analyze_artwork(artwork_file, keywords)
+        cache_key = analyzer.request_key(artwork_file, keywords)
+        analysis_result, shared = artwork_flights.do(
+            cache_key, analyzer.analyze_artwork, artwork_file, keywords, cache_key
+        )
+        if shared:
+            current_app.logger.info("Shared in-flight artwork analysis")
         
         # Check if analysis was successful
         if not analysis_result.get('success'):
             current_app.logger.error(f"Analysis failed: {analysis_result.get('details', 'Unknown error')}")
             return jsonify({'error': 'Failed to analyze artwork'}), 500
-            
-        # The analysis data is now nested under 'analysis' key
-        analysis = analysis_result['analysis']
-        
-        response = {
-            'success': True,
-            'analysis': {
-                'story_elements': analysis['story_elements'],
-                'comments': analysis['comments'],
-                'questions': analysis['questions']
-            }
-        }
         
-        return jsonify(response)
+        with stage_timer('response_serialize'):
+            return jsonify(artwork_response(analysis_result))
         
     except Exception as e:
         current_app.logger.error(f'Artwork analysis failed: {str(e)}')
-        if '401' in str(e) or 'credentials' in str(e).lower():
-            # Check environment variable
-            api_key = os.getenv('OPENROUTER_API_KEY', '')
-            if not api_key:
-                return jsonify({'error': 'API key not found in environment'}), 500
-            elif not api_key.strip().startswith('sk-'):
-                return jsonify({'error': 'Invalid API key format'}), 500
-            else:
-                return jsonify({'error': 'API authentication failed. Please check API key.'}), 500
-        return jsonify({'error': 'Failed to analyze artwork'}), 500
+        return jsonify({'error': artwork_failure_message(e)}), 500
+
+@bp.route('/artwork/analyze/stream', methods=['POST'])
+def analyze_artwork_stream():
+    """Analyze artwork and stream the results to the browser as Server-Sent Events.
+
+    Emits "comment", "question" and "story_element" events ({"text",
+    "index", plus "field" for story elements}) as each item arrives from
+    the model, then a "done" event carrying the body /artwork/analyze
+    returns, or an "error" event ({"error": ...}). The items are for
+    display; "done" holds the validated analysis.
+    """
+    api_key = os.getenv('OPENROUTER_API_KEY')
+    bind(flow='artwork')
+    with stage_timer('request_parse'):
+        files = request.files
+        keywords = request.form.get('keywords', '')
+
+    artwork_file, error = validate_artwork_upload(files, api_key)
+    if error:
+        return jsonify({'error': error[0]}), error[1]
+
+    try:
+        analyzer = ArtworkAnalyzer()
+        cache_key = analyzer.request_key(artwork_file, keywords)
+    except Exception as e:
+        current_app.logger.error(f'Artwork analysis failed: {str(e)}')
+        return jsonify({'error': artwork_failure_message(e)}), 500
+
+    def result_events(analysis_result):
+        if not analysis_result.get('success'):
+            current_app.logger.error(f"Analysis failed: {analysis_result.get('details', 'Unknown error')}")
+            yield sse_event('error', {'error': 'Failed to analyze artwork'})
+            return
+        yield sse_event('done', artwork_response(analysis_result))
+
+    call, is_leader = artwork_flights.begin(cache_key)
+    if not is_leader:
+        current_app.logger.info("Following in-flight artwork analysis")
+
+        def follow():
+            try:
+                analysis_result = artwork_flights.wait(call, timeout=time_left(FOLLOWER_TIMEOUT))
+            except Exception as e:
+                yield sse_event('error', {'error': artwork_failure_message(e)})
+                return
+            if analysis_result.get('success'):
+                for event, item in analyzer.analysis_items(analysis_result):
+                    yield sse_event(event, item)
+            yield from result_events(analysis_result)
+
+        return sse_response(stream_with_context(follow()))
+
+    def generate():
+        analysis_result = None
+        error = None
+        try:
+            for event, item in analyzer.stream_analysis(artwork_file, keywords, cache_key):
+                if event == 'analysis':
+                    analysis_result = item
+                else:
+                    yield sse_event(event, item)
+            yield from result_events(analysis_result)
+        except Exception as e:
+            error = e
+            current_app.logger.error(f'Artwork analysis failed: {str(e)}')
+            yield sse_event('error', {'error': artwork_failure_message(e)})
+        finally:
+            if analysis_result is None and error is None:
+                # The client disconnected mid-stream
+                error = Exception('Artwork analysis was interrupted. Please try again.')
+            artwork_flights.finish(cache_key, call, result=analysis_result if not error else None, error=error)
+
+    return sse_response(stream_with_context(generate()))
 
 @bp.errorhandler(HTTPException)
 def handle_exception(e):
@@ -228,21 +228,16 @@ document.addEventListener('DOMContentLoaded', function() {
                     formData.append('artwork', uploadedFile);
                     formData.append('keywords', document.querySelector('.keywords-input input')?.value || '');
 
-                    const response = await fetch('/story/artwork/analyze', {
-                        method: 'POST',
-                        body: formData
-                    });
-
-                    const data = await response.json();
-                    if (!response.ok) {
-                        throw new Error(data.error || 'Failed to analyze artwork');
-                    }
+                    // Comments appear under the button while the rest of the analysis arrives
+                    const data = await streamArtworkAnalysis(formData, renderAnalysisItem);
 
                     // Store the result for caching
                     lastAnalysisResult = data;
+                    clearAnalysisProgress();
                     showAnalysisResults(data);
                 } catch (error) {
                     console.error('Error:', error);
+                    clearAnalysisProgress();
                     alert(error.message);
                 } finally {
                     if (analyzeBtn) {
@@ -356,25 +351,12 @@ function setupCreateFormHandlers() {
             const keywords = document.querySelector('.keywords-input')?.value?.trim() || '';
             const age = document.querySelector('.age-select')?.value || '';
 
-            // Make API call with correct key names
-            fetch('/story/generate', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    mainPrompt: mainPrompt,  // Changed from prompt to mainPrompt
-                    keywords: keywords,
-                    ageGroup: age,  // Changed from age to ageGroup
-                    isArtworkFlow: false  // Add this flag for server-side context
-                })
-            })
-            .then(async response => {
-                const data = await response.json();
-                if (!response.ok) {
-                    throw new Error(data.error || 'Failed to generate story');
-                }
-                return data;
+            // Stream the story so words appear as soon as they are written
+            streamStory({
+                mainPrompt: mainPrompt,  // Changed from prompt to mainPrompt
+                keywords: keywords,
+                ageGroup: age,  // Changed from age to ageGroup
+                isArtworkFlow: false  // Add this flag for server-side context
             })
             .then(data => {
                 showGeneratedStory(data);
@@ -784,22 +766,13 @@ function setupSimplifiedFlowHandlers(analysisData) {
                     throw new Error('Please fill in all story elements before creating the story');
                 }
                 
-                // Call story generation API
-                const response = await fetch('/story/generate', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify({
-                        mainPrompt: `A story about ${character} in ${setting} who ${theme}`,
-                        ageGroup: 'preK',
-                        isArtworkFlow: true,
-                        context: { character, setting, theme }
-                    })
+                // Call story generation API, rendering the story as it streams in
+                const data = await streamStory({
+                    mainPrompt: `A story about ${character} in ${setting} who ${theme}`,
+                    ageGroup: 'preK',
+                    isArtworkFlow: true,
+                    context: { character, setting, theme }
                 });
-                
-                console.log('Story generation response status:', response.status);
-                const data = await response.json();
                 console.log('Story generation response:', data);
                 
                 if (!data.success && !data.story) {
@@ -1248,22 +1221,13 @@ function setupCreateButton() {
             
             console.log('Sending story generation request with:', { character, setting, theme });
             
-            // Call story generation API
-            const response = await fetch('/story/generate', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    mainPrompt: `A story about ${character} in ${setting} who ${theme}`,
-                    ageGroup: 'preK',
-                    isArtworkFlow: true,
-                    context: { character, setting, theme }
-                })
+            // Call story generation API, rendering the story as it streams in
+            const data = await streamStory({
+                mainPrompt: `A story about ${character} in ${setting} who ${theme}`,
+                ageGroup: 'preK',
+                isArtworkFlow: true,
+                context: { character, setting, theme }
             });
-            
-            console.log('Story generation response status:', response.status);
-            const data = await response.json();
             console.log('Story generation response:', data);
             console.log('Story generated successfully');
             
@@ -1333,6 +1297,161 @@ function resetStoryForm() {
     goToScreen(0);
 }
 
+// Request a story from the streaming endpoint and render it as it arrives.
+// Resolves with the same shape /story/generate returns: { story, cached, success }.
+async function streamStory(payload) {
+    const response = await fetch('/story/generate/stream', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream'
+        },
+        body: JSON.stringify(payload)
+    });
+
+    if (!response.ok || !response.body) {
+        const data = await response.json().catch(() => ({}));
+        throw new Error(data.error || 'Failed to generate story');
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let storyText = '';
+    let result = null;
+
+    while (!result) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const event = parseStreamEvent(buffer.slice(0, boundary));
+            buffer = buffer.slice(boundary + 2);
+            if (!event) continue;
+
+            if (event.type === 'token') {
+                storyText += event.data.text || '';
+                renderStreamingStory(storyText);
+            } else if (event.type === 'done') {
+                result = { story: storyText.trim(), cached: !!event.data.cached, success: true };
+            } else if (event.type === 'error') {
+                throw new Error(event.data.error || 'Failed to generate story');
+            }
+        }
+    }
+
+    if (!result) {
+        throw new Error('The story stopped before it was finished. Please try again.');
+    }
+    return result;
+}
+
+// Analyze artwork over the streaming endpoint, passing each comment, question and
+// story element to onItem as it arrives. Resolves with the same body /story/artwork/analyze returns.
+async function streamArtworkAnalysis(formData, onItem) {
+    const response = await fetch('/story/artwork/analyze/stream', {
+        method: 'POST',
+        headers: { 'Accept': 'text/event-stream' },
+        body: formData
+    });
+
+    if (!response.ok || !response.body) {
+        const data = await response.json().catch(() => ({}));
+        throw new Error(data.error || 'Failed to analyze artwork');
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let result = null;
+
+    while (!result) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const event = parseStreamEvent(buffer.slice(0, boundary));
+            buffer = buffer.slice(boundary + 2);
+            if (!event) continue;
+
+            if (event.type === 'done') {
+                result = event.data;
+            } else if (event.type === 'error') {
+                throw new Error(event.data.error || 'Failed to analyze artwork');
+            } else {
+                onItem(event.type, event.data);
+            }
+        }
+    }
+
+    if (!result) {
+        throw new Error('The analysis stopped before it was finished. Please try again.');
+    }
+    return result;
+}
+
+// Show streamed comments under the analyze button; questions and story elements wait for the results screen
+function renderAnalysisItem(type, item) {
+    if (type !== 'comment' || !item.text) return;
+    let list = document.querySelector('.analysis-progress');
+    if (!list) {
+        const analyzeBtn = document.getElementById('analyze-btn');
+        if (!analyzeBtn) return;
+        list = document.createElement('ul');
+        list.className = 'analysis-progress';
+        analyzeBtn.insertAdjacentElement('afterend', list);
+    }
+    const entry = document.createElement('li');
+    entry.textContent = item.text;
+    list.appendChild(entry);
+}
+
+function clearAnalysisProgress() {
+    document.querySelector('.analysis-progress')?.remove();
+}
+
+// Parse one "event: x\ndata: {...}" block into { type, data }
+function parseStreamEvent(rawEvent) {
+    let type = 'message';
+    const dataLines = [];
+    rawEvent.split('\n').forEach(line => {
+        if (line.startsWith('event:')) {
+            type = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+            dataLines.push(line.slice(5).trim());
+        }
+    });
+    if (!dataLines.length) return null;
+    try {
+        return { type, data: JSON.parse(dataLines.join('\n')) };
+    } catch (error) {
+        console.error('Malformed story stream event:', rawEvent);
+        return null;
+    }
+}
+
+// Show the story view on the first chunk, then update its paragraphs in place
+function renderStreamingStory(storyText) {
+    let content = document.querySelector('.generated-story .story-content');
+    if (!content) {
+        showGeneratedStory({ story: storyText || ' ' });
+        content = document.querySelector('.generated-story .story-content');
+        if (!content) return;
+    }
+    content.replaceChildren(...storyText.split('\n')
+        .filter(para => para.trim())
+        .map(para => {
+            const p = document.createElement('p');
+            p.textContent = para.trim();
+            return p;
+        }));
+}
+
 function showGeneratedStory(data) {
     console.log('Displaying generated story');
     console.log('Story data received:', data);  // Debug log
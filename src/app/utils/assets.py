@@ -0,0 +1,103 @@
+import json
+import mimetypes
+import os
+
+from flask import abort, request, send_from_directory, url_for
+
+# Accept-Encoding token -> suffix of the precompressed copy, best first
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+# <picture> sources, smallest first; browsers take the first type they support
+IMAGE_TYPES = ('image/avif', 'image/webp', 'image/jpeg')
+
+
+class StaticAssets:
+    """
+    Templates' view of the build from scripts/build_assets.py.
+
+    asset_url(name) gives the fingerprinted URL of a static file and
+    asset_image(name) its responsive variants for <picture>. Built files
+    never change under a name, so they are served with an immutable
+    Cache-Control, as a precompressed copy when the client accepts one.
+    Without a manifest (e.g. in development) the plain static files are
+    used instead.
+    """
+    def __init__(self):
+        self.folder = None
+        self.max_age = 31536000
+        self.files = {}
+        self.images = {}
+        self.encodings = {}
+        self._built = frozenset()
+
+    def init_app(self, app):
+        self.folder = os.path.join(app.static_folder, 'dist')
+        self.max_age = app.config.get('ASSETS_MAX_AGE', self.max_age)
+        path = app.config.get('ASSETS_MANIFEST') or os.path.join(self.folder, 'manifest.json')
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+            self.files = manifest['files']
+            self.images = manifest.get('images', {})
+            self.encodings = manifest.get('encodings', {})
+        except FileNotFoundError:
+            app.logger.info("No asset manifest at %s, serving static files unversioned", path)
+        except (OSError, ValueError, KeyError) as e:
+            app.logger.warning(f"Asset manifest {path} unusable, serving static files unversioned: {str(e)}")
+        self._built = frozenset(self.files.values()) | frozenset(
+            source[0] for image in self.images.values() for variants in image['sources'].values()
+            for source in variants
+        )
+
+        app.add_url_rule(f'{app.static_url_path}/dist/<path:filename>', endpoint='assets', view_func=self.send)
+        app.jinja_env.globals.update(asset_url=self.url, asset_image=self.image)
+        app.extensions['static_assets'] = self
+
+    def url(self, name):
+        """URL of static file name, fingerprinted when it has been built."""
+        built = self.files.get(name)
+        if built is None:
+            return url_for('static', filename=name)
+        return url_for('assets', filename=built)
+
+    def image(self, name):
+        """
+        src, width, height and (type, srcset) sources for a responsive
+        image, smallest format first; just src without a build.
+        """
+        image = self.images.get(name)
+        if image is None:
+            return {'src': self.url(name), 'width': None, 'height': None, 'sources': []}
+        return {
+            'src': self.url(name),
+            'width': image['width'],
+            'height': image['height'],
+            'sources': [
+                (mime, ', '.join(f"{url_for('assets', filename=built)} {width}w" for built, width in variants))
+                for mime, variants in sorted(image['sources'].items(), key=lambda item: _type_order(item[0]))
+            ],
+        }
+
+    def send(self, filename):
+        if filename not in self._built:
+            abort(404)
+        mimetype = mimetypes.guess_type(filename)[0]
+        accepted = request.accept_encodings
+        for encoding, suffix in PRECOMPRESSED:
+            if encoding in self.encodings.get(filename, ()) and accepted[encoding]:
+                response = send_from_directory(
+                    self.folder, filename + suffix, mimetype=mimetype, max_age=self.max_age
+                )
+                response.content_encoding = encoding
+                break
+        else:
+            response = send_from_directory(self.folder, filename, mimetype=mimetype, max_age=self.max_age)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.immutable = True
+        return response
+
+
+def _type_order(mime):
+    return IMAGE_TYPES.index(mime) if mime in IMAGE_TYPES else len(IMAGE_TYPES)
+
+
+static_assets = StaticAssets()
@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from src.app.utils.deadline import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+
+class UpstreamUnavailable(Exception):
+    """Raised without calling the provider because its breaker is open or its bulkhead is full."""
+    def __init__(self, provider, reason, retry_after=None):
+        self.provider = provider
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f"Upstream {provider} unavailable ({reason})")
+
+
+class CircuitBreaker:
+    """
+    Closed, open and half-open breaker for one upstream provider.
+
+    Closed: calls go through and their outcomes fill a window of the last
+    ``window`` calls. Once at least ``min_calls`` are in it and the share
+    that failed, or took longer than ``slow_seconds``, reaches
+    ``failure_rate``, the breaker opens. Open: calls are refused for
+    ``cooldown`` seconds. Half-open: ``probes`` calls at a time are let
+    through; a success closes the breaker, a failure opens it again.
+
+    State is per process; each worker trips on what it sees itself.
+    """
+    def __init__(self, name, window=20, min_calls=10, failure_rate=0.5, slow_seconds=20.0,
+                 cooldown=30.0, probes=1):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.cooldown = cooldown
+        self.probes = probes
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = 0
+        self._stats = {'successes': 0, 'failures': 0, 'slow': 0, 'rejected': 0, 'opened': 0}
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def allow(self):
+        """Claim permission for one call. Raises UpstreamUnavailable if the breaker refuses it."""
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._probing < self.probes:
+                self._probing += 1
+                return
+            self._stats['rejected'] += 1
+            retry_after = max(0.0, self._opened_at + self.cooldown - now)
+        raise UpstreamUnavailable(self.name, 'circuit open', retry_after=retry_after)
+
+    def record(self, seconds, failed):
+        """Report the outcome of a call that allow() let through."""
+        slow = seconds >= self.slow_seconds
+        with self._lock:
+            self._stats['failures' if failed else 'successes'] += 1
+            if slow:
+                self._stats['slow'] += 1
+
+            if self._state != CLOSED:
+                self._probing = max(0, self._probing - 1)
+                if failed or slow:
+                    self._trip(f"probe {'failed' if failed else 'was slow'}")
+                else:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                    logger.warning(f"Circuit for {self.name} closed")
+                return
+
+            self._outcomes.append(failed or slow)
+            if len(self._outcomes) >= self.min_calls:
+                rate = sum(self._outcomes) / len(self._outcomes)
+                if rate >= self.failure_rate:
+                    self._trip(f"{rate:.0%} of the last {len(self._outcomes)} calls failed or were slow")
+
+    def release(self):
+        """Give back a half-open probe slot for a call that ended without an outcome (e.g. cancelled)."""
+        with self._lock:
+            if self._state != CLOSED:
+                self._probing = max(0, self._probing - 1)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['state'] = self._current_state(time.monotonic())
+        return stats
+
+    def _current_state(self, now):
+        if self._state == OPEN and now - self._opened_at >= self.cooldown:
+            self._state = HALF_OPEN
+            self._probing = 0
+        return self._state
+
+    def _trip(self, reason):
+        # Caller holds the lock
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self._stats['opened'] += 1
+        logger.warning(f"Circuit for {self.name} opened for {self.cooldown:.0f}s: {reason}")
+
+
+class Bulkhead:
+    """
+    Caps concurrent calls to one provider so a slow upstream can only tie up
+    ``size`` threads (or tasks). A caller waits up to ``wait`` seconds for a
+    slot and is refused after that.
+    """
+    def __init__(self, name, size=32, wait=2.0):
+        self.name = name
+        self.size = size
+        self.wait = wait
+        self._cond = threading.Condition()
+        self._active = 0
+        self._stats = {'rejected': 0}
+
+    def acquire(self, timeout=None):
+        timeout = self.wait if timeout is None else timeout
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._active < self.size, timeout):
+                self._stats['rejected'] += 1
+                raise UpstreamUnavailable(self.name, 'too many concurrent calls')
+            self._active += 1
+
+    async def aacquire(self, timeout=None):
+        """acquire() for the event loop: polls rather than blocking the loop's thread."""
+        deadline = time.monotonic() + (self.wait if timeout is None else timeout)
+        while True:
+            with self._cond:
+                if self._active < self.size:
+                    self._active += 1
+                    return
+                if time.monotonic() >= deadline:
+                    self._stats['rejected'] += 1
+                    raise UpstreamUnavailable(self.name, 'too many concurrent calls')
+            await asyncio.sleep(0.05)
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {'active': self._active, 'size': self.size, 'rejected': self._stats['rejected']}
+
+
+class ProviderGuard:
+    """Circuit breaker plus bulkhead for one provider; wrap each upstream call in call() or acall()."""
+    def __init__(self, breaker, bulkhead):
+        self.breaker = breaker
+        self.bulkhead = bulkhead
+
+    @contextmanager
+    def call(self):
+        self.breaker.allow()
+        try:
+            self.bulkhead.acquire()
+        except UpstreamUnavailable:
+            self.breaker.release()
+            raise
+        started = time.monotonic()
+        try:
+            yield
+        except DeadlineExceeded:
+            # Our own budget ran out; says nothing about the provider
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record(time.monotonic() - started, failed=True)
+            raise
+        except BaseException:
+            # Cancelled or abandoned by our side, likewise
+            self.breaker.release()
+            raise
+        else:
+            self.breaker.record(time.monotonic() - started, failed=False)
+        finally:
+            self.bulkhead.release()
+
+    @asynccontextmanager
+    async def acall(self):
+        self.breaker.allow()
+        try:
+            await self.bulkhead.aacquire()
+        except BaseException:
+            self.breaker.release()
+            raise
+        started = time.monotonic()
+        try:
+            yield
+        except DeadlineExceeded:
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record(time.monotonic() - started, failed=True)
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        else:
+            self.breaker.record(time.monotonic() - started, failed=False)
+        finally:
+            self.bulkhead.release()
+
+    def stats(self):
+        stats = self.breaker.stats()
+        stats['bulkhead'] = self.bulkhead.stats()
+        return stats
@@ -1,22 +1,500 @@
-from cachetools import TTLCache
+from cachetools import TLRUCache
 import hashlib
 import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
 
-# Cache that expires after 1 hour (3600 seconds)
-story_cache = TTLCache(maxsize=100, ttl=3600)
+from src.app.utils.library import story_id, story_library
+from src.app.utils.metrics import stage_timer
+from src.app.utils.similarity import story_features, story_index
+
+logger = logging.getLogger(__name__)
+
+
+class _MemoryTier(TLRUCache):
+    """LRU cache whose entries expire at their own deadline; counts evictions."""
+    def __init__(self, maxsize):
+        super().__init__(maxsize, ttu=lambda key, value, now: value[1], timer=time.time)
+        self.evictions = 0
+
+    def popitem(self):
+        self.evictions += 1
+        return super().popitem()
+
+
+class SQLiteDatabase:
+    """
+    A WAL-mode SQLite file shared by every worker on the node.
+
+    Readers never block the writer. Each thread gets its own connection;
+    connections are reopened after fork. Subclasses create their tables
+    in _create_schema.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        with conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._create_schema(conn)
+        conn.close()
+
+    def _create_schema(self, conn):
+        pass
+
+    def _connection(self):
+        if self._pid != os.getpid():
+            # Never reuse a connection inherited across fork
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level='DEFERRED')
+        conn.execute("PRAGMA busy_timeout = 5000")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+
+class SQLiteStore(SQLiteDatabase):
+    """On-disk cache tier: JSON values with an expiry, trimmed least recently used first."""
+    def __init__(self, path, max_entries=5000):
+        self.max_entries = max_entries
+        super().__init__(path)
+
+    def _create_schema(self, conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache_entries (expires_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache_entries (accessed_at)")
+
+    def get(self, key, now=None):
+        """Return (value, expires_at) for a live entry, or None."""
+        now = now or time.time()
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT value, expires_at FROM cache_entries WHERE key = ? AND expires_at > ?",
+            (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        # Refresh recency at most once a minute to keep hits read-mostly
+        conn.execute(
+            "UPDATE cache_entries SET accessed_at = ? WHERE key = ? AND accessed_at < ?",
+            (now, key, now - 60)
+        )
+        conn.commit()
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, expires_at, now=None):
+        now = now or time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), expires_at, now)
+        )
+        conn.commit()
+
+    def delete(self, key):
+        conn = self._connection()
+        conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+        conn.commit()
+
+    def sweep(self, now=None):
+        """Delete expired rows and trim to max_entries (least recently used first)."""
+        now = now or time.time()
+        conn = self._connection()
+        expired = conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (now,)).rowcount
+        overflow = conn.execute(
+            "DELETE FROM cache_entries WHERE key IN ("
+            " SELECT key FROM cache_entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        ).rowcount
+        conn.commit()
+        return expired, overflow
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+
+
+class TieredCache:
+    """
+    Two-tier cache: a per-process LRU in front of an optional SQLiteStore.
+
+    Reads check memory first, then disk (promoting disk hits into memory
+    with their remaining TTL). Writes go to both tiers. Disk errors are
+    counted and otherwise ignored, so a broken cache file degrades to a
+    memory-only cache rather than failing requests. A background thread
+    sweeps expired and overflow rows from disk.
+    """
+    def __init__(self, name, maxsize=100, ttl=3600, config_prefix='CACHE'):
+        self.name = name
+        self.config_prefix = config_prefix
+        self.ttl = ttl
+        self._memory = _MemoryTier(maxsize)
+        self._disk = None
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._sweep_interval = 0
+        self._stats = {
+            'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'sets': 0,
+            'disk_expired': 0, 'disk_evictions': 0, 'disk_errors': 0,
+        }
+
+    def init_app(self, app):
+        """Size the tiers from <config_prefix>_* settings and attach the shared disk store."""
+        prefix = self.config_prefix
+        self.ttl = app.config.get(f'{prefix}_TTL', self.ttl)
+        with self._lock:
+            self._memory = _MemoryTier(app.config.get(f'{prefix}_MEMORY_SIZE', self._memory.maxsize))
+
+        disk_path = app.config.get(f'{prefix}_DISK_PATH')
+        if disk_path:
+            try:
+                self._disk = SQLiteStore(disk_path, app.config.get(f'{prefix}_DISK_MAX_ENTRIES', 5000))
+            except sqlite3.Error as e:
+                app.logger.error(f"Disk cache for {self.name} unavailable, using memory only: {str(e)}")
+                self._disk = None
+
+        if self._disk is not None:
+            self.start_sweeper(app.config.get('CACHE_SWEEP_INTERVAL', 300))
+
+        app.extensions[self.name] = self
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._stats['memory_hits'] += 1
+                return entry[0]
+
+        entry = self._disk_call('get', key, now)
+        with self._lock:
+            if entry is None:
+                self._stats['misses'] += 1
+                return default
+            self._stats['disk_hits'] += 1
+            self._memory[key] = entry
+        return entry[0]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (ttl or self.ttl)
+        with self._lock:
+            self._memory[key] = (value, expires_at)
+            self._stats['sets'] += 1
+        self._disk_call('set', key, value, expires_at)
+        self._ensure_sweeper()
+
+    def expires_at(self, key):
+        """Return when the live entry for key expires, or None if there isn't one."""
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is None:
+            entry = self._disk_call('get', key)
+        return entry[1] if entry is not None else None
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def delete(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+        self._disk_call('delete', key)
+
+    def sweep(self):
+        """Expire and trim the disk tier once."""
+        result = self._disk_call('sweep')
+        if result:
+            expired, overflow = result
+            with self._lock:
+                self._stats['disk_expired'] += expired
+                self._stats['disk_evictions'] += overflow
+
+    def start_sweeper(self, interval):
+        """Run sweep() every interval seconds on a daemon thread."""
+        self._sweep_interval = interval
+        self._ensure_sweeper()
+
+    def _ensure_sweeper(self):
+        # Threads don't survive fork, so each worker starts its own sweeper
+        if not self._sweep_interval or self._disk is None:
+            return
+        if self._sweeper is not None and self._sweeper[0] == os.getpid():
+            return
+        interval = self._sweep_interval
+
+        def run():
+            while True:
+                time.sleep(interval)
+                self.sweep()
+
+        thread = threading.Thread(target=run, name=f'{self.name}-sweeper', daemon=True)
+        self._sweeper = (os.getpid(), thread)
+        thread.start()
+
+    def stats(self):
+        """Return hit/miss/eviction counters and tier sizes."""
+        with self._lock:
+            self._memory.expire()
+            stats = dict(self._stats)
+            stats['memory_evictions'] = self._memory.evictions
+            stats['memory_size'] = len(self._memory)
+            stats['memory_maxsize'] = self._memory.maxsize
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        stats['disk_size'] = self._disk_call('__len__') or 0
+        return stats
+
+    def _disk_call(self, method, *args):
+        if self._disk is None:
+            return None
+        try:
+            return getattr(self._disk, method)(*args)
+        except (sqlite3.Error, ValueError):
+            with self._lock:
+                self._stats['disk_errors'] += 1
+            return None
+
+
+class StoryCorpus(SQLiteDatabase):
+    """
+    Long-lived copies of generated stories, served when the upstream fails.
+
+    Unlike the cache, entries don't expire. Only the story for the same
+    canonical request is served (see FallbackStories for similar ones).
+    The oldest entries are trimmed beyond max_entries.
+    """
+    def __init__(self, path, max_entries=1000):
+        self.max_entries = max_entries
+        super().__init__(path)
+
+    def _create_schema(self, conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS stories ("
+            " key TEXT PRIMARY KEY,"
+            " age_group TEXT NOT NULL,"
+            " story TEXT NOT NULL,"
+            " hits INTEGER NOT NULL DEFAULT 1,"
+            " updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_stories_age_hits ON stories (age_group, hits)")
+
+    def add(self, key, age_group, story):
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO stories (key, age_group, story, updated_at) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(key) DO UPDATE SET story = excluded.story, hits = hits + 1,"
+            " updated_at = excluded.updated_at",
+            (key, age_group, story, time.time())
+        )
+        conn.commit()
+
+    def lookup(self, key):
+        """Return the story stored for key, or None."""
+        row = self._connection().execute("SELECT story FROM stories WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def trim(self):
+        conn = self._connection()
+        removed = conn.execute(
+            "DELETE FROM stories WHERE key IN ("
+            " SELECT key FROM stories ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        ).rowcount
+        conn.commit()
+        return removed
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM stories").fetchone()[0]
+
+
+class FallbackStories:
+    """Keeps the StoryCorpus configured by STORY_FALLBACK_*; a no-op when disabled."""
+    def __init__(self):
+        self._corpus = None
+        self._added = 0
+        self._stats = {'served': 0, 'missing': 0, 'errors': 0}
+
+    def init_app(self, app):
+        path = app.config.get('STORY_FALLBACK_PATH')
+        self._corpus = None
+        if path:
+            try:
+                self._corpus = StoryCorpus(path, app.config.get('STORY_FALLBACK_MAX_ENTRIES', 1000))
+            except sqlite3.Error as e:
+                app.logger.error(f"Fallback story corpus unavailable: {str(e)}")
+        app.extensions['story_fallbacks'] = self
+
+    def add(self, data, story):
+        if self._corpus is None:
+            return
+        try:
+            self._corpus.add(get_cache_key(data), data.get('ageGroup') or 'preK', story)
+            self._added += 1
+            if self._added % 100 == 0:
+                self._corpus.trim()
+        except sqlite3.Error:
+            self._stats['errors'] += 1
+
+    def get(self, data):
+        """
+        Return the stored story for the request, or for a similar one (see
+        story_index), or None. Never a story written for something else.
+        """
+        if self._corpus is None:
+            return None
+        try:
+            story = self._corpus.lookup(get_cache_key(data))
+            if story is None and story_index.enabled:
+                match = story_index.search(*story_features(canonical_story_request(data)))
+                if match is not None:
+                    story = self._corpus.lookup(match[0])
+        except sqlite3.Error:
+            self._stats['errors'] += 1
+            return None
+        self._stats['served' if story else 'missing'] += 1
+        return story
+
+    def stats(self):
+        stats = dict(self._stats)
+        try:
+            stats['size'] = len(self._corpus) if self._corpus is not None else 0
+        except sqlite3.Error:
+            stats['size'] = 0
+        return stats
+
+
+# Both caches are shared by every worker on the node once init_app attaches the disk tier
+story_cache = TieredCache('story_cache', maxsize=100, ttl=3600, config_prefix='CACHE')
+artwork_cache = TieredCache('artwork_cache', maxsize=100, ttl=3600, config_prefix='ARTWORK_CACHE')
+story_fallbacks = FallbackStories()
+
+# Request fields that shape the prompt (see StoryGenerator._format_prompt)
+STORY_KEY_FIELDS = ('mainPrompt', 'moral', 'creature', 'magic', 'vibe')
+# Set on a request served a similar request's story: that request's cache key
+SIMILAR_STORY_KEY = '_similarStoryKey'
+
+def canonical_text(text):
+    """Normalize free text for keying: case, whitespace, trailing periods and keyword order."""
+    text = re.sub(r'\s+', ' ', str(text)).strip().lower()
+    if re.search(r'[.!?]', text.rstrip('.')):
+        # Sentences keep their word order; _format_prompt strips the final period anyway
+        return text.rstrip('.').strip()
+    keywords = {word.strip() for word in text.rstrip('.').split(',')}
+    return ', '.join(sorted(word for word in keywords if word))
+
+def canonical_story_request(data):
+    """
+    Reduce a story request to the normalized fields that change the story.
+    
+    Context keys copied in from the artwork flow (character, setting, theme)
+    are already part of mainPrompt and are left out, as are empty optional
+    fields. Artwork-flow requests include their pinned template, and extra
+    batch variants their variant number.
+    """
+    canonical = {'ageGroup': data.get('ageGroup') or 'preK'}
+    for field in STORY_KEY_FIELDS:
+        value = canonical_text(data.get(field) or '')
+        if value:
+            canonical[field] = value
+    if data.get('isArtworkFlow'):
+        canonical['isArtworkFlow'] = True
+        canonical['template'] = data.get('template')
+    if data.get('variant'):
+        canonical['variant'] = data['variant']
+    return canonical
 
 def get_cache_key(data):
     """Generate a unique cache key from the input data"""
     # Sort the dictionary to ensure consistent keys for same data
-    sorted_data = json.dumps(data, sort_keys=True)
+    sorted_data = json.dumps(canonical_story_request(data), sort_keys=True)
     return hashlib.md5(sorted_data.encode()).hexdigest()
 
 def get_cached_story(data):
-    """Get story from cache if it exists"""
-    cache_key = get_cache_key(data)
-    return story_cache.get(cache_key)
+    """
+    Get story from cache if it exists, else from the story library, else a similar request's story.
+
+    When the story is a similar request's, data[SIMILAR_STORY_KEY] is set to that request's key,
+    so get_story_id gives the id the story is stored under.
+    """
+    with stage_timer('cache_lookup'):
+        cache_key = get_cache_key(data)
+        story = _served_story(data, story_cache.get(cache_key))
+    if story is None and story_library.enabled:
+        with stage_timer('library_lookup'):
+            story = story_library.lookup(cache_key)
+        if story is not None:
+            story_cache[cache_key] = story
+    if story is None and story_index.enabled:
+        with stage_timer('similarity_lookup'):
+            match = get_similar_story(data)
+        if match is not None:
+            similar_key, story = match
+            data[SIMILAR_STORY_KEY] = similar_key
+            # Only in the cache, for its TTL: the library, fallbacks and index keep the stories that were asked for
+            story_cache[cache_key] = {'story': story, 'similar_to': similar_key}
+    return story
+
+def get_similar_story(data):
+    """(key, story) of a similar earlier request for the same age group, flow and variant, or None"""
+    features, group = story_features(canonical_story_request(data))
+    match = story_index.search(features, group)
+    if match is None:
+        return None
+    similar_key, similarity = match
+    story = _served_story({}, story_cache.get(similar_key))
+    if story is None and story_library.enabled:
+        story = story_library.lookup(similar_key)
+    if story is None:
+        # Expired from the cache and never reached the library
+        story_index.discard(similar_key)
+        return None
+    logger.info("Serving similar story %s (similarity %.2f)", similar_key, similarity)
+    return similar_key, story
+
+def _served_story(data, entry):
+    # Similarity matches are cached as {'story', 'similar_to'}
+    if isinstance(entry, dict):
+        data[SIMILAR_STORY_KEY] = entry['similar_to']
+        return entry['story']
+    return entry
 
 def cache_story(data, story):
-    """Cache the generated story"""
+    """Cache the generated story, index it for similar requests and queue it for the story library"""
     cache_key = get_cache_key(data)
-    story_cache[cache_key] = story 
\ No newline at end of file
+    canonical = canonical_story_request(data)
+    story_cache[cache_key] = story
+    story_fallbacks.add(data, story)
+    story_library.save(cache_key, canonical, story, data.get('mainPrompt'))
+    features, group = story_features(canonical)
+    story_index.add(features, cache_key, group)
+
+def get_story_id(data):
+    """The library id the request's story is (or will be) stored under, or None without a library"""
+    if not story_library.enabled:
+        return None
+    return story_id(data.get(SIMILAR_STORY_KEY) or get_cache_key(data))
+
+def get_fallback_story(data):
+    """Get a stored story to serve when generation fails"""
+    return story_fallbacks.get(data)
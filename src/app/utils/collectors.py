@@ -0,0 +1,224 @@
+from src.app.utils.cache import artwork_cache, story_cache, story_fallbacks
+from src.app.utils.hedging import artwork_hedger, artwork_stream_hedger
+from src.app.utils.http_client import upstream
+from src.app.utils.jobs import story_jobs
+from src.app.utils.library import story_library
+from src.app.utils.logs import app_logging
+from src.app.utils.limiter import SQLiteStorage, limiter
+from src.app.utils.phash_index import artwork_index
+from src.app.utils.similarity import story_index
+from src.app.utils.singleflight import artwork_flights, story_flights
+from src.app.utils.token_budget import story_token_budget
+from src.app.utils.warmer import story_warmer
+
+
+def register_collectors(metrics):
+    """Expose cache, limiter, connection pool, circuit breaker and coalescing state as scrape-time gauges."""
+    caches = (story_cache, artwork_cache)
+    flights = (story_flights, artwork_flights)
+
+    def cache_lookups():
+        for cache in caches:
+            stats = cache.stats()
+            for result in ('memory_hits', 'disk_hits', 'misses'):
+                yield {'cache': cache.name, 'result': result}, stats[result]
+
+    def cache_evictions():
+        for cache in caches:
+            stats = cache.stats()
+            yield {'cache': cache.name, 'tier': 'memory'}, stats['memory_evictions']
+            yield {'cache': cache.name, 'tier': 'disk'}, stats['disk_evictions'] + stats['disk_expired']
+
+    def cache_entries():
+        for cache in caches:
+            stats = cache.stats()
+            yield {'cache': cache.name, 'tier': 'memory'}, stats['memory_size']
+            yield {'cache': cache.name, 'tier': 'disk'}, stats['disk_size']
+
+    def cache_hit_ratio():
+        for cache in caches:
+            yield {'cache': cache.name}, cache.stats()['hit_rate']
+
+    def upstream_requests():
+        for provider, stats in upstream.stats().items():
+            yield {'provider': provider, 'outcome': 'ok'}, stats['requests'] - stats['errors']
+            yield {'provider': provider, 'outcome': 'error'}, stats['errors']
+
+    def upstream_retries():
+        for provider, stats in upstream.stats().items():
+            yield {'provider': provider, 'reason': 'retried'}, stats['retries']
+            yield {'provider': provider, 'reason': 'deadline_exceeded'}, stats['deadline_exceeded']
+
+    def upstream_connections():
+        for provider, stats in upstream.stats().items():
+            yield {'provider': provider, 'state': 'open'}, stats['connections_opened']
+            yield {'provider': provider, 'state': 'idle'}, stats['idle_connections']
+            yield {'provider': provider, 'state': 'max'}, stats['pool_maxsize']
+
+    def breaker_state():
+        for provider, stats in upstream.stats().items():
+            guard = stats.get('guard')
+            if guard:
+                for state in ('closed', 'half_open', 'open'):
+                    yield {'provider': provider, 'state': state}, guard['state'] == state
+
+    def breaker_calls():
+        for provider, stats in upstream.stats().items():
+            guard = stats.get('guard')
+            if guard:
+                for outcome in ('successes', 'failures', 'slow'):
+                    yield {'provider': provider, 'outcome': outcome}, guard[outcome]
+                yield {'provider': provider, 'outcome': 'rejected_open'}, guard['rejected']
+                yield {'provider': provider, 'outcome': 'rejected_bulkhead'}, guard['bulkhead']['rejected']
+
+    def breaker_trips():
+        for provider, stats in upstream.stats().items():
+            if stats.get('guard'):
+                yield {'provider': provider}, stats['guard']['opened']
+
+    def bulkhead_slots():
+        for provider, stats in upstream.stats().items():
+            guard = stats.get('guard')
+            if guard:
+                yield {'provider': provider, 'state': 'active'}, guard['bulkhead']['active']
+                yield {'provider': provider, 'state': 'max'}, guard['bulkhead']['size']
+
+    def limiter_state():
+        yield {'state': 'enabled'}, bool(limiter.enabled)
+        storage = getattr(limiter.limiter, 'storage', None) if limiter.enabled else None
+        if isinstance(storage, SQLiteStorage):
+            yield {'state': 'tracked_keys'}, len(storage)
+        else:
+            # Memory storage keeps one counter per client and limit
+            yield {'state': 'tracked_keys'}, len(getattr(storage, 'storage', ()) or ())
+
+    def flight_calls():
+        for flight in flights:
+            stats = flight.stats()
+            yield {'flight': flight.name, 'role': 'leader'}, stats['leaders']
+            yield {'flight': flight.name, 'role': 'follower'}, stats['followers']
+
+    def flights_in_progress():
+        for flight in flights:
+            yield {'flight': flight.name}, flight.stats()['in_flight']
+
+    def warmer_rounds():
+        stats = story_warmer.stats()
+        for result in ('warmed', 'refilled', 'failures', 'skipped_budget'):
+            yield {'result': result}, stats[result]
+
+    def fallbacks():
+        stats = story_fallbacks.stats()
+        yield {'result': 'served'}, stats['served']
+        yield {'result': 'missing'}, stats['missing']
+
+    def job_outcomes():
+        stats = story_jobs.stats()
+        for result in ('submitted', 'deduplicated', 'cached', 'completed', 'fallbacks', 'failed'):
+            yield {'result': result}, stats[result]
+
+    def jobs_by_status():
+        by_status = story_jobs.stats()['by_status']
+        for status in ('queued', 'running', 'done', 'failed'):
+            yield {'status': status}, by_status.get(status, 0)
+
+    def near_duplicates():
+        stats = artwork_index.stats()
+        yield {'result': 'lookup'}, stats['lookups']
+        yield {'result': 'hit'}, stats['hits']
+
+    def similar_stories():
+        stats = story_index.stats()
+        yield {'result': 'lookup'}, stats['lookups']
+        yield {'result': 'hit'}, stats['hits']
+
+    def log_drops():
+        stats = app_logging.stats()
+        for category, count in sorted(stats['sampled_out'].items()):
+            yield {'reason': 'sampled', 'category': category}, count
+        yield {'reason': 'queue_full', 'category': '-'}, stats['queue_full']
+
+    # Whole replies and streams (hedged on time to first token) are hedged separately
+    hedgers = (('request', artwork_hedger), ('stream', artwork_stream_hedger))
+
+    def hedge_calls():
+        for mode, hedger in hedgers:
+            stats = hedger.stats()
+            for result in ('requests', 'hedged', 'fallbacks', 'cancelled'):
+                yield {'mode': mode, 'result': result}, stats[result]
+
+    def hedge_wins():
+        for mode, hedger in hedgers:
+            stats = hedger.stats()
+            for winner in ('primary', 'hedge', 'fallback'):
+                yield {'mode': mode, 'winner': winner}, stats[f'won_{winner}']
+            yield {'mode': mode, 'winner': 'none'}, stats['failed']
+
+    def hedge_ratio():
+        for mode, hedger in hedgers:
+            stats = hedger.stats()
+            requests = stats['requests'] or 1
+            yield {'mode': mode, 'ratio': 'hedged'}, stats['hedged'] / requests
+            yield {'mode': mode, 'ratio': 'hedge_won'}, stats['won_hedge'] / (stats['hedged'] or 1)
+
+    def hedge_delay():
+        for mode, hedger in hedgers:
+            for model in hedger.models:
+                yield {'mode': mode, 'model': model}, hedger.delay(model)
+
+    def story_completions():
+        for (age_group, length), stats in sorted(story_token_budget.stats().items()):
+            yield {'age_group': age_group, 'length': length, 'finish': 'stop'}, stats['completed']
+            yield {'age_group': age_group, 'length': length, 'finish': 'length'}, stats['truncated']
+
+    def story_budgets():
+        for (age_group, length), stats in sorted(story_token_budget.stats().items()):
+            if stats['budget'] is not None:
+                yield {'age_group': age_group, 'length': length}, stats['budget']
+
+    def story_tokens_per_word():
+        for (age_group, length), stats in sorted(story_token_budget.stats().items()):
+            yield {'age_group': age_group, 'length': length}, stats['tokens_per_word']
+
+    def library_calls():
+        stats = story_library.stats()
+        for result in ('lookups', 'hits', 'saved', 'duplicates', 'dropped', 'errors'):
+            yield {'result': result}, stats[result]
+
+    def library_writes():
+        yield {}, story_library.stats()['batches']
+
+    def library_queue():
+        yield {}, story_library.stats()['queued']
+
+    metrics.counter_callback('storytales_cache_lookups_total', 'Cache lookups by outcome', cache_lookups)
+    metrics.counter_callback('storytales_cache_evictions_total', 'Entries evicted or expired per tier', cache_evictions)
+    metrics.gauge_callback('storytales_cache_entries', 'Entries held per cache tier', cache_entries)
+    metrics.gauge_callback('storytales_cache_hit_ratio', 'Share of lookups served from cache', cache_hit_ratio)
+    metrics.counter_callback('storytales_upstream_requests_total', 'Upstream responses by provider', upstream_requests)
+    metrics.counter_callback('storytales_upstream_retries_total', 'Upstream retries and calls given up for lack of time', upstream_retries)
+    metrics.gauge_callback('storytales_upstream_connections', 'Pooled upstream connections', upstream_connections)
+    metrics.gauge_callback('storytales_upstream_circuit_state', 'Circuit breaker state per provider (1 = current)', breaker_state)
+    metrics.counter_callback('storytales_upstream_guarded_calls_total', 'Guarded upstream calls by outcome', breaker_calls)
+    metrics.counter_callback('storytales_upstream_circuit_opened_total', 'Times each circuit breaker opened', breaker_trips)
+    metrics.gauge_callback('storytales_upstream_bulkhead_slots', 'Concurrent upstream calls per provider', bulkhead_slots)
+    metrics.gauge_callback('storytales_ratelimit', 'Rate limiter state', limiter_state)
+    metrics.counter_callback('storytales_singleflight_calls_total', 'Coalesced calls by role', flight_calls)
+    metrics.gauge_callback('storytales_singleflight_in_flight', 'Keys currently being generated', flights_in_progress)
+    metrics.counter_callback('storytales_warmer_total', 'Background pre-generation outcomes', warmer_rounds)
+    metrics.counter_callback('storytales_fallback_stories_total', 'Fallback story lookups', fallbacks)
+    metrics.counter_callback('storytales_story_jobs_total', 'Story jobs by outcome (this process)', job_outcomes)
+    metrics.gauge_callback('storytales_story_jobs', 'Story jobs in the shared queue by status', jobs_by_status)
+    metrics.counter_callback('storytales_artwork_near_duplicate_total', 'Perceptual-hash index lookups', near_duplicates)
+    metrics.counter_callback('storytales_log_records_dropped_total', 'Log records sampled out or dropped on a full queue', log_drops)
+    metrics.counter_callback('storytales_artwork_hedge_total', 'Artwork analysis requests, hedges, fallbacks and cancelled calls', hedge_calls)
+    metrics.counter_callback('storytales_artwork_hedge_wins_total', 'Which call answered each artwork analysis', hedge_wins)
+    metrics.gauge_callback('storytales_artwork_hedge_ratio', 'Share of requests hedged, and of hedges that won', hedge_ratio)
+    metrics.gauge_callback('storytales_artwork_hedge_delay_seconds', 'Current wait before hedging each model', hedge_delay)
+    metrics.counter_callback('storytales_story_completions_total', 'Stories by finish reason (length = cut off at max_tokens)', story_completions)
+    metrics.gauge_callback('storytales_story_max_tokens', 'Current story max_tokens before the context cap', story_budgets)
+    metrics.gauge_callback('storytales_story_tokens_per_word', 'Learned completion tokens per story word', story_tokens_per_word)
+    metrics.counter_callback('storytales_story_similar_total', 'Similar-request story index lookups', similar_stories)
+    metrics.counter_callback('storytales_story_library_total', 'Story library lookups, hits and writes by outcome', library_calls)
+    metrics.counter_callback('storytales_story_library_batches_total', 'Story library write transactions', library_writes)
+    metrics.gauge_callback('storytales_story_library_queued', 'Stories waiting to be written to the library', library_queue)
@@ -0,0 +1,55 @@
+from contextvars import ContextVar
+import time
+
+# Monotonic time by which the current request must be answered; None outside a request
+_deadline = ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out before another upstream attempt could be made."""
+
+
+class RequestDeadlines:
+    """
+    Starts a time budget for every request as it arrives.
+
+    Upstream calls take their timeouts from what is left of it (see
+    time_left), and retries and backoff are only attempted while enough
+    remains, so a request's worst case is bounded by REQUEST_DEADLINE
+    rather than by timeouts times retries.
+    """
+    def __init__(self):
+        self.budget = 45.0
+
+    def init_app(self, app):
+        self.budget = app.config.get('REQUEST_DEADLINE', 45)
+
+        @app.before_request
+        def start_request_deadline():
+            start_deadline(self.budget)
+
+        app.extensions['deadlines'] = self
+
+
+def start_deadline(seconds):
+    """Give the current request (or background job) seconds from now; None or 0 removes the limit."""
+    _deadline.set(time.monotonic() + seconds if seconds else None)
+
+
+def remaining():
+    """Seconds left in the current budget, or None when there is no deadline."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def time_left(cap):
+    """A timeout of at most cap seconds that also ends at the deadline (never negative)."""
+    left = remaining()
+    if left is None:
+        return cap
+    return max(0.0, min(cap, left))
+
+
+request_deadlines = RequestDeadlines()
@@ -0,0 +1,278 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class LatencyTracker:
+    """
+    Recent latencies of successful calls per model, for quantile estimates.
+    A call cancelled before it finished counts with the time it had taken
+    so far, a lower bound.
+    """
+    def __init__(self, window=200, min_samples=20):
+        self.window = window
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def record(self, key, seconds):
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def quantile(self, key, q):
+        """The q-quantile of key's recent latencies, or None until min_samples are in."""
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class Hedger:
+    """
+    Runs a call against an ordered list of models, hedging the first.
+
+    The first model is called at once. If it hasn't answered after its
+    learned ``quantile`` latency (``default_delay`` until enough calls
+    have been seen), the next model is called too and the first
+    acceptable result wins. The others are cancelled: asyncio tasks
+    outright. A thread that has already sent its request can't be
+    interrupted, so its late result is just dropped. If every call so
+    far has failed, the next model is tried as a plain fallback.
+
+    Every call that answers is timed under its model, losers included,
+    so a slow primary's latency isn't lost whenever the hedge wins (which
+    would leave only fast calls in the quantile and hedge ever earlier).
+    A late thread is timed when it finishes, a cancelled task by how
+    long it had run. An acceptable result that lost is handed to
+    ``discard``, if given, for callers whose results hold resources (an
+    open stream, say).
+
+    Hedges draw on a budget that grows by ``max_rate`` per request, so a
+    slow primary can't make more than that share of requests cost two
+    calls.
+    """
+    # Most hedge credit that can be banked while the primary is fast
+    MAX_CREDIT = 10.0
+
+    def __init__(self, name, config_prefix, quantile=0.95, default_delay=8.0, min_delay=1.0, max_rate=0.1,
+                 window=200, min_samples=20, threads=32):
+        self.name = name
+        self.config_prefix = config_prefix
+        self.models = []
+        self.quantile = quantile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_rate = max_rate
+        self.threads = threads
+        self.latencies = LatencyTracker(window, min_samples)
+        self._lock = threading.Lock()
+        self._credit = 1.0
+        self._pool = None
+        self._stats = {'requests': 0, 'hedged': 0, 'fallbacks': 0, 'cancelled': 0, 'failed': 0,
+                       'won_primary': 0, 'won_hedge': 0, 'won_fallback': 0}
+
+    def init_app(self, app):
+        config = app.config
+        prefix = self.config_prefix
+        self.models = list(config.get(f'{prefix}_MODELS') or self.models)
+        self.quantile = config.get(f'{prefix}_HEDGE_QUANTILE', self.quantile)
+        self.default_delay = config.get(f'{prefix}_HEDGE_DEFAULT_DELAY', self.default_delay)
+        self.min_delay = config.get(f'{prefix}_HEDGE_MIN_DELAY', self.min_delay)
+        self.max_rate = config.get(f'{prefix}_HEDGE_MAX_RATE', self.max_rate)
+        self.threads = config.get(f'{prefix}_HEDGE_THREADS', self.threads)
+        app.extensions[f'hedger.{self.name}'] = self
+
+    def delay(self, key):
+        """Seconds to wait on key before hedging."""
+        learned = self.latencies.quantile(key, self.quantile)
+        return max(self.min_delay, learned if learned is not None else self.default_delay)
+
+    def run(self, models, call, accept, discard=None):
+        """
+        call(model) on a worker thread per model (see class docstring).
+        Returns (result, model) for the winner, or the last result with model None if none was accepted.
+        """
+        pool = self._executor()
+        self._start()
+        queue = list(models)
+        running = {}
+        last = None
+        can_hedge = len(queue) > 1
+
+        def launch(role):
+            model = queue.pop(0)
+            # Each call gets a copy of the request's context (deadline, app, metric labels)
+            future = pool.submit(contextvars.copy_context().run, _timed, call, model)
+            running[future] = (model, role)
+            self._launched(role)
+
+        def record_late(future, model):
+            if not future.cancelled() and future.exception() is None:
+                result, seconds = future.result()
+                if accept(result):
+                    self.latencies.record(model, seconds)
+                    if discard is not None:
+                        discard(result)
+
+        launch('primary')
+        primary = models[0]
+        try:
+            while running:
+                timeout = self.delay(primary) if can_hedge and queue else None
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    can_hedge = False
+                    if self._take_credit():
+                        launch('hedge')
+                    continue
+                winner = None
+                for future in done:
+                    model, role = running.pop(future)
+                    if future.exception() is not None:
+                        continue
+                    result, seconds = future.result()
+                    if accept(result):
+                        self.latencies.record(model, seconds)
+                        if winner is None:
+                            winner = (result, model, role)
+                        elif discard is not None:
+                            discard(result)
+                    else:
+                        last = result
+                if winner is not None:
+                    self._won(winner[2])
+                    return winner[:2]
+                if not running and queue:
+                    launch('fallback')
+        finally:
+            for future, (model, _) in running.items():
+                if not future.cancel():
+                    # Already sending its request; time it when it's done
+                    future.add_done_callback(lambda future, model=model: record_late(future, model))
+            self._cancelled(len(running))
+        self._won(None)
+        return last, None
+
+    async def arun(self, models, call, accept, discard=None):
+        """run() for the event loop: call(model) is a coroutine function and losers are cancelled."""
+        self._start()
+        queue = list(models)
+        running = {}
+        last = None
+        can_hedge = len(queue) > 1
+
+        def launch(role):
+            model = queue.pop(0)
+            task = asyncio.ensure_future(_atimed(call, model))
+            running[task] = (model, role, time.monotonic())
+            self._launched(role)
+
+        launch('primary')
+        primary = models[0]
+        try:
+            while running:
+                timeout = self.delay(primary) if can_hedge and queue else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    can_hedge = False
+                    if self._take_credit():
+                        launch('hedge')
+                    continue
+                winner = None
+                for task in done:
+                    model, role, _ = running.pop(task)
+                    if task.exception() is not None:
+                        continue
+                    result, seconds = task.result()
+                    if accept(result):
+                        self.latencies.record(model, seconds)
+                        if winner is None:
+                            winner = (result, model, role)
+                        elif discard is not None:
+                            discard(result)
+                    else:
+                        last = result
+                if winner is not None:
+                    self._won(winner[2])
+                    return winner[:2]
+                if not running and queue:
+                    launch('fallback')
+        finally:
+            now = time.monotonic()
+            for task, (model, _, started) in running.items():
+                task.cancel()
+                # It would have taken at least this long
+                self.latencies.record(model, now - started)
+            self._cancelled(len(running))
+        self._won(None)
+        return last, None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['credit'] = self._credit
+        return stats
+
+    def _start(self):
+        with self._lock:
+            self._stats['requests'] += 1
+            self._credit = min(self.MAX_CREDIT, self._credit + self.max_rate)
+
+    def _take_credit(self):
+        with self._lock:
+            if self._credit < 1.0:
+                return False
+            self._credit -= 1.0
+            return True
+
+    def _launched(self, role):
+        if role != 'primary':
+            with self._lock:
+                self._stats['hedged' if role == 'hedge' else 'fallbacks'] += 1
+
+    def _won(self, role):
+        with self._lock:
+            self._stats[f'won_{role}' if role is not None else 'failed'] += 1
+
+    def _cancelled(self, count):
+        if count:
+            with self._lock:
+                self._stats['cancelled'] += count
+
+    def _executor(self):
+        # Threads don't survive fork; each worker process makes its own pool
+        pool = self._pool
+        if pool is None or pool[0] != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pool[0] != os.getpid():
+                    self._pool = (os.getpid(), ThreadPoolExecutor(
+                        max_workers=self.threads, thread_name_prefix=f'hedge-{self.name}'
+                    ))
+                pool = self._pool
+        return pool[1]
+
+
+def _timed(call, model):
+    started = time.monotonic()
+    result = call(model)
+    return result, time.monotonic() - started
+
+
+async def _atimed(call, model):
+    started = time.monotonic()
+    result = await call(model)
+    return result, time.monotonic() - started
+
+
+# Vision models for artwork analysis (ARTWORK_MODELS)
+artwork_hedger = Hedger('artwork', 'ARTWORK')
+# The same models streamed, hedged on time to first token, which their own latencies are kept for
+artwork_stream_hedger = Hedger('artwork_stream', 'ARTWORK')
@@ -0,0 +1,505 @@
+import asyncio
+from email.utils import parsedate_to_datetime
+import json
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from src.app.utils.breaker import Bulkhead, CircuitBreaker, ProviderGuard
+from src.app.utils.deadline import DeadlineExceeded, remaining, time_left
+from src.app.utils.metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+# Provider names used to look up sessions
+PERPLEXITY = 'perplexity'
+OPENROUTER = 'openrouter'
+
+
+class RetryPolicy:
+    """
+    When and how long to wait before retrying an upstream call.
+
+    Statuses in ``retry_statuses`` and failures to connect are retried, up
+    to ``max_attempts`` in all. Read timeouts are not: the provider may
+    still be generating, and asking again would pay for the story twice.
+    Backoff is exponential with full jitter; a 429's Retry-After is
+    honoured (plus a little jitter so workers don't retry in lockstep).
+    A retry only happens if, after the wait, at least ``min_attempt``
+    seconds of the request's deadline would be left for it.
+    """
+    def __init__(self, max_attempts=3, backoff_base=0.5, backoff_max=8.0, min_attempt=5.0,
+                 retry_statuses=(408, 429, 500, 502, 503, 504)):
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.min_attempt = min_attempt
+        self.retry_statuses = frozenset(retry_statuses)
+
+    def delay(self, attempt, retry_after=None):
+        """Seconds to wait after the given (1-based) failed attempt."""
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.backoff_base)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def can_retry(self, attempt, delay):
+        if attempt >= self.max_attempts:
+            return False
+        left = remaining()
+        return left is None or left - delay >= self.min_attempt
+
+
+class UpstreamClient:
+    """
+    Long-lived, per-process HTTP sessions for the upstream LLM providers.
+
+    Each provider gets its own requests.Session with a dedicated keep-alive
+    pool, so TLS connections are reused across requests instead of being
+    thrown away with a per-request session. Sessions are rebuilt after a
+    fork so gunicorn workers never share sockets with their parent.
+
+    Each provider also has a ProviderGuard (circuit breaker plus bulkhead);
+    callers wrap every upstream request in guard(name).call() or acall().
+    """
+    def __init__(self):
+        self._providers = {}
+        self._guards = {}
+        self._guard_options = {}
+        self.retry_policy = RetryPolicy()
+        self._sessions = {}
+        self._async_clients = {}
+        self._counters = {}
+        self._pid = None
+        self.async_pool_maxsize = 200
+        self._lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+
+    def init_app(self, app):
+        """Register the Perplexity and OpenRouter providers from app config."""
+        pool_maxsize = app.config.get('UPSTREAM_POOL_MAXSIZE', 20)
+        self.async_pool_maxsize = app.config.get('ASYNC_MAX_INFLIGHT', 200)
+        self._guard_options = {
+            'breaker': {
+                'window': app.config.get('UPSTREAM_BREAKER_WINDOW', 20),
+                'min_calls': app.config.get('UPSTREAM_BREAKER_MIN_CALLS', 10),
+                'failure_rate': app.config.get('UPSTREAM_BREAKER_FAILURE_RATE', 0.5),
+                'slow_seconds': app.config.get('UPSTREAM_BREAKER_SLOW_SECONDS', 20),
+                'cooldown': app.config.get('UPSTREAM_BREAKER_COOLDOWN', 30),
+            },
+            'bulkhead': {
+                'size': app.config.get('UPSTREAM_BULKHEAD_SIZE', 32),
+                'wait': app.config.get('UPSTREAM_BULKHEAD_WAIT', 2),
+            },
+        }
+        self.retry_policy = RetryPolicy(
+            max_attempts=app.config.get('UPSTREAM_MAX_ATTEMPTS', 3),
+            backoff_base=app.config.get('UPSTREAM_BACKOFF_BASE', 0.5),
+            backoff_max=app.config.get('UPSTREAM_BACKOFF_MAX', 8),
+            min_attempt=app.config.get('UPSTREAM_MIN_ATTEMPT_SECONDS', 5),
+        )
+
+        self.register(
+            PERPLEXITY,
+            base_url=app.config.get('PERPLEXITY_BASE_URL', 'https://api.perplexity.ai'),
+            headers={
+                "Authorization": f"Bearer {app.config.get('PERPLEXITY_API_KEY')}",
+                "Content-Type": "application/json",
+                "Accept": "application/json",
+            },
+            pool_maxsize=pool_maxsize,
+        )
+        self.register(
+            OPENROUTER,
+            base_url=app.config.get('OPENROUTER_BASE_URL', 'https://openrouter.ai'),
+            headers={
+                "Authorization": f"Bearer {app.config.get('OPENROUTER_API_KEY')}",
+                "Content-Type": "application/json",
+                "HTTP-Referer": "https://storytales.kids",
+                "X-Title": "StoryTales",
+            },
+            pool_maxsize=pool_maxsize,
+        )
+
+        app.extensions['upstream'] = self
+
+        warm_connections = app.config.get('UPSTREAM_WARM_CONNECTIONS', 0)
+        if warm_connections:
+            self.warm(connections=warm_connections)
+
+    def register(self, name, base_url, headers=None, pool_maxsize=20):
+        """
+        Register (or replace) a provider. Existing sessions for it are closed.
+
+        Sessions don't retry by themselves; send() and asend() retry within
+        the request deadline.
+        """
+        with self._lock:
+            self._providers[name] = {
+                'base_url': base_url,
+                'host': urlparse(base_url).netloc,
+                'origin': '{0.scheme}://{0.netloc}'.format(urlparse(base_url)),
+                'headers': dict(headers or {}),
+                'pool_maxsize': pool_maxsize,
+            }
+            self._counters[name] = {'requests': 0, 'errors': 0, 'retries': 0, 'deadline_exceeded': 0}
+            self._guards[name] = ProviderGuard(
+                CircuitBreaker(name, **self._guard_options.get('breaker', {})),
+                Bulkhead(name, **self._guard_options.get('bulkhead', {})),
+            )
+            session = self._sessions.pop(name, None)
+        if session:
+            session.close()
+
+    def session(self, name):
+        """Return the shared session for a provider, creating it on first use."""
+        self._check_pid()
+        session = self._sessions.get(name)
+        if session is not None:
+            return session
+
+        with self._lock:
+            session = self._sessions.get(name)
+            if session is None:
+                if name not in self._providers:
+                    raise KeyError(f"Unknown upstream provider: {name}")
+                session = self._build_session(name, self._providers[name])
+                self._sessions[name] = session
+        return session
+
+    def guard(self, name):
+        """Return the circuit breaker and bulkhead guarding calls to a provider."""
+        guard = self._guards.get(name)
+        if guard is None:
+            raise KeyError(f"Unknown upstream provider: {name}")
+        return guard
+
+    def send(self, name, request, read_timeout=60):
+        """
+        Call request(timeout) with retries, bounded by the request deadline.
+
+        request performs one HTTP call with the given read timeout and
+        returns the response. The response is returned as soon as its status
+        isn't retryable or no retry fits in the remaining budget; the caller
+        checks it as before. Connection errors are re-raised the same way.
+        """
+        policy = self.retry_policy
+        attempt = 0
+        while True:
+            attempt += 1
+            timeout = self._attempt_timeout(name, read_timeout)
+            try:
+                response = request(timeout)
+            except requests.ConnectionError:
+                # Includes ConnectTimeout; a ReadTimeout propagates without a retry
+                delay = policy.delay(attempt)
+                if not policy.can_retry(attempt, delay):
+                    raise
+            else:
+                if response.status_code not in policy.retry_statuses:
+                    return response
+                delay = policy.delay(attempt, _retry_after(response))
+                if not policy.can_retry(attempt, delay):
+                    return response
+                response.close()
+            self._count_retry(name)
+            time.sleep(delay)
+
+    async def asend(self, name, request, read_timeout=60):
+        """send() for the ASGI path: request(timeout) returns an awaitable httpx response."""
+        policy = self.retry_policy
+        attempt = 0
+        while True:
+            attempt += 1
+            timeout = self._attempt_timeout(name, read_timeout)
+            try:
+                response = await request(timeout)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                delay = policy.delay(attempt)
+                if not policy.can_retry(attempt, delay):
+                    raise
+            else:
+                if response.status_code not in policy.retry_statuses:
+                    return response
+                delay = policy.delay(attempt, _retry_after(response))
+                if not policy.can_retry(attempt, delay):
+                    return response
+                await response.aclose()
+            self._count_retry(name)
+            await asyncio.sleep(delay)
+
+    def async_client(self, name):
+        """
+        Return the shared httpx.AsyncClient for a provider.
+
+        Used by the ASGI serving path. Clients are created on first use inside
+        the running event loop and closed by aclose() at shutdown.
+        """
+        self._check_pid()
+        client = self._async_clients.get(name)
+        if client is None or client.is_closed:
+            if name not in self._providers:
+                raise KeyError(f"Unknown upstream provider: {name}")
+            provider = self._providers[name]
+            client = httpx.AsyncClient(
+                base_url=provider['base_url'],
+                headers=provider['headers'],
+                timeout=httpx.Timeout(60.0, connect=5.0, pool=None),
+                limits=httpx.Limits(
+                    max_connections=self.async_pool_maxsize,
+                    max_keepalive_connections=provider['pool_maxsize'],
+                ),
+                event_hooks={
+                    'request': [_trace_async_request],
+                    'response': [self._count_async_response(name)],
+                },
+            )
+            self._async_clients[name] = client
+        return client
+
+    async def aclose(self):
+        """Close the async clients opened by async_client()."""
+        clients, self._async_clients = self._async_clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+    def warm(self, names=None, connections=1, timeout=5):
+        """
+        Open keep-alive connections to each provider in the background.
+
+        Each warm-up is a HEAD request to the provider's base URL; the
+        response status does not matter, only the pooled TLS connection.
+        """
+        names = list(names or self._providers)
+
+        def _warm_one(name):
+            provider = self._providers[name]
+            try:
+                self.session(name).head(provider['base_url'], timeout=timeout)
+            except requests.RequestException:
+                # Warming is best effort; the first real request will connect
+                pass
+
+        threads = []
+        for name in names:
+            for _ in range(connections):
+                thread = threading.Thread(target=_warm_one, args=(name,), daemon=True)
+                thread.start()
+                threads.append(thread)
+        return threads
+
+    def stats(self):
+        """Return per-provider request counters, connection pool usage and breaker state."""
+        stats = {}
+        for name, provider in list(self._providers.items()):
+            counters = self._counters.get(name, {})
+            pool_stats = {
+                'host': provider['host'],
+                'requests': counters.get('requests', 0),
+                'errors': counters.get('errors', 0),
+                'retries': counters.get('retries', 0),
+                'deadline_exceeded': counters.get('deadline_exceeded', 0),
+                'pool_maxsize': provider['pool_maxsize'],
+                'connections_opened': 0,
+                'idle_connections': 0,
+            }
+            guard = self._guards.get(name)
+            if guard is not None:
+                pool_stats['guard'] = guard.stats()
+
+            session = self._sessions.get(name)
+            if session is not None:
+                adapter = session.get_adapter(provider['base_url'])
+                for pool in _connection_pools(adapter):
+                    pool_stats['connections_opened'] += pool.num_connections
+                    if pool.pool is not None:
+                        pool_stats['idle_connections'] += sum(
+                            1 for conn in list(pool.pool.queue) if conn is not None
+                        )
+            stats[name] = pool_stats
+        return stats
+
+    def close(self):
+        """Close all sessions and their pooled connections."""
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
+
+    def _build_session(self, name, provider):
+        session = requests.Session()
+        adapter = _TimedAdapter(
+            pool_connections=1,  # One host per provider
+            pool_maxsize=provider['pool_maxsize'],
+            max_retries=0,
+        )
+        session.mount(provider['origin'], adapter)
+        session.headers.update(provider['headers'])
+        session.hooks['response'].append(self._count_response(name))
+        return session
+
+    def _attempt_timeout(self, name, read_timeout):
+        timeout = time_left(read_timeout)
+        if timeout < min(self.retry_policy.min_attempt, read_timeout):
+            with self._counter_lock:
+                self._counters[name]['deadline_exceeded'] += 1
+            raise DeadlineExceeded(f"No time left in the request deadline to call {name}")
+        return timeout
+
+    def _count_retry(self, name):
+        with self._counter_lock:
+            self._counters[name]['retries'] += 1
+
+    def _count_response(self, name):
+        counters = self._counters[name]
+
+        def hook(response, *args, **kwargs):
+            if isinstance(response, requests.Response):
+                # Time from sending the request until the response headers were parsed
+                observe_stage('upstream_ttfb', response.elapsed.total_seconds())
+            with self._counter_lock:
+                counters['requests'] += 1
+                if response.status_code >= 400:
+                    counters['errors'] += 1
+        return hook
+
+    def _count_async_response(self, name):
+        hook = self._count_response(name)
+
+        async def async_hook(response):
+            hook(response)
+        return async_hook
+
+    def _check_pid(self):
+        """Drop sessions inherited from a parent process after fork."""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid != pid:
+                # Don't close inherited sockets; the parent still owns them
+                self._sessions = {}
+                self._async_clients = {}
+                self._pid = pid
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        observe_stage('upstream_connect', time.perf_counter() - started)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()  # TCP and TLS handshake
+        observe_stage('upstream_connect', time.perf_counter() - started)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedAdapter(HTTPAdapter):
+    """HTTPAdapter whose new connections report how long connecting took."""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
+
+
+async def _trace_async_request(request):
+    """httpx request hook: report connect time (new connections only) and time to first byte."""
+    started = time.perf_counter()
+    connecting = {}
+
+    async def trace(event_name, info):
+        if event_name == 'connection.connect_tcp.started':
+            connecting['at'] = time.perf_counter()
+        elif event_name.endswith('send_request_headers.started') and 'at' in connecting:
+            observe_stage('upstream_connect', time.perf_counter() - connecting.pop('at'))
+        elif event_name.endswith('receive_response_headers.complete'):
+            observe_stage('upstream_ttfb', time.perf_counter() - started)
+
+    request.extensions['trace'] = trace
+
+
+def iter_completion_text(response, summary=None):
+    """
+    Yield the content deltas of a streamed (stream=True) chat-completions response.
+    
+    If summary (a dict) is given, it receives the stream's finish_reason and usage,
+    and done=True if the stream ended with [DONE]. The stream is read to [DONE] (or
+    its end) past the finish_reason chunk, since providers may send usage after it
+    in a chunk with no choices.
+    """
+    for line in response.iter_lines(decode_unicode=True):
+        # SSE frames look like "data: {...}"; skip keep-alives and comments
+        if not line or not line.startswith("data:"):
+            continue
+        chunk = line[len("data:"):].strip()
+        if chunk == "[DONE]":
+            if summary is not None:
+                summary["done"] = True
+            return
+
+        try:
+            event = json.loads(chunk)
+        except json.JSONDecodeError:
+            logger.warning("Skipping malformed stream chunk: %.200s", chunk)
+            continue
+
+        if summary is not None and event.get("usage"):
+            summary["usage"] = event["usage"]
+        choices = event.get("choices") or []
+        if not choices:
+            continue
+        text = (choices[0].get("delta") or {}).get("content")
+        if text:
+            yield text
+        if summary is not None and choices[0].get("finish_reason"):
+            summary["finish_reason"] = choices[0]["finish_reason"]
+
+
+def _retry_after(response):
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _connection_pools(adapter):
+    """Yield the urllib3 connection pools currently held by an adapter."""
+    poolmanager = getattr(adapter, 'poolmanager', None)
+    if poolmanager is None:
+        return
+    for key in list(poolmanager.pools.keys()):
+        pool = poolmanager.pools.get(key)
+        if pool is not None:
+            yield pool
+
+
+upstream = UpstreamClient()
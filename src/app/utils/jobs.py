@@ -0,0 +1,301 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from src.app.utils.cache import SQLiteDatabase, get_cache_key
+from src.app.utils.deadline import start_deadline
+from src.app.utils.metrics import bind, start_request
+from src.app.utils.singleflight import story_flights
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+ACTIVE = (QUEUED, RUNNING)
+
+
+class JobQueue(SQLiteDatabase):
+    """
+    Story generation jobs in a SQLite file shared by every worker on the node.
+
+    At most one queued or running job exists per cache key (a partial
+    unique index), so identical requests share a job. Workers claim the
+    oldest queued job under a lease; a job whose worker died is claimed
+    again once its lease runs out.
+    """
+    def _create_schema(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                key TEXT NOT NULL,
+                status TEXT NOT NULL,
+                request TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                lease_until REAL
+            )
+        """)
+        conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_key ON jobs (key) "
+            "WHERE status IN ('queued', 'running')"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created_at)")
+
+    def enqueue(self, key, request):
+        """Queue a job for key unless one is already queued or running. Returns (job_id, created)."""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            row = conn.execute("""
+                INSERT INTO jobs (id, key, status, request, created_at, updated_at)
+                VALUES (?, ?, 'queued', ?, ?, ?)
+                ON CONFLICT (key) WHERE status IN ('queued', 'running') DO NOTHING
+                RETURNING id
+            """, (uuid.uuid4().hex, key, json.dumps(request), now, now)).fetchone()
+            if row is not None:
+                return row[0], True
+            # Still inside the write transaction, so the active job can't finish in between
+            existing = conn.execute(
+                "SELECT id FROM jobs WHERE key = ? AND status IN ('queued', 'running')", (key,)
+            ).fetchone()
+        return existing[0], False
+
+    def add_finished(self, key, request, result):
+        """Record a job that was answered without generating (e.g. from the cache)."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute("""
+                INSERT INTO jobs (id, key, status, request, result, created_at, updated_at)
+                VALUES (?, ?, 'done', ?, ?, ?, ?)
+            """, (job_id, key, json.dumps(request), json.dumps(result), now, now))
+        return job_id
+
+    def claim(self, lease):
+        """Take the oldest runnable job for lease seconds. Returns a job dict or None."""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            row = conn.execute("""
+                UPDATE jobs SET status = 'running', attempts = attempts + 1,
+                                lease_until = :lease_until, updated_at = :now
+                WHERE id = (
+                    SELECT id FROM jobs
+                    WHERE status = 'queued' OR (status = 'running' AND lease_until < :now)
+                    ORDER BY created_at LIMIT 1
+                )
+                RETURNING id, key, request, attempts
+            """, {'now': now, 'lease_until': now + lease}).fetchone()
+        if row is None:
+            return None
+        return {'id': row[0], 'key': row[1], 'request': json.loads(row[2]), 'attempts': row[3]}
+
+    def finish(self, job_id, status, result=None, error=None):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, lease_until = NULL, updated_at = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+            )
+
+    def get(self, job_id):
+        row = self._connection().execute(
+            "SELECT id, status, result, error, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row[0],
+            'status': row[1],
+            'result': json.loads(row[2]) if row[2] else None,
+            'error': row[3],
+            'created_at': row[4],
+            'updated_at': row[5],
+        }
+
+    def trim(self, older_than):
+        """Delete finished jobs last updated before older_than (epoch seconds)."""
+        conn = self._connection()
+        with conn:
+            return conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (older_than,)
+            ).rowcount
+
+    def counts(self):
+        rows = self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+
+class StoryJobs:
+    """
+    Generates stories as background jobs, so clients don't hold a
+    connection open for the whole generation.
+
+    submit() queues a prepared request in the shared JobQueue and returns
+    at once. Each process runs ``workers`` threads that claim jobs and
+    generate them with the job deadline, which also caps how many
+    upstream calls jobs make at a time. wait() long-polls a job: it wakes
+    on completions in this process and rechecks the queue every
+    ``poll_interval`` for jobs finished elsewhere. A no-op when
+    STORY_JOBS_PATH is empty.
+    """
+    # A job whose worker died this many times is failed instead of retried
+    MAX_ATTEMPTS = 2
+
+    def __init__(self, workers=2, deadline=120, retention=86400, poll_interval=0.5):
+        self.workers = workers
+        self.deadline = deadline
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self.app = None
+        self._queue = None
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._wake = threading.Event()
+        self._threads = None
+        self._finished = 0
+        self._stats = {'submitted': 0, 'deduplicated': 0, 'cached': 0, 'completed': 0,
+                       'fallbacks': 0, 'failed': 0}
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('STORY_JOB_WORKERS', self.workers)
+        self.deadline = app.config.get('STORY_JOB_DEADLINE', self.deadline)
+        self.retention = app.config.get('STORY_JOB_RETENTION', self.retention)
+        path = app.config.get('STORY_JOBS_PATH')
+        self._queue = None
+        if path:
+            try:
+                self._queue = JobQueue(path)
+            except sqlite3.Error as e:
+                app.logger.error(f"Story job queue unavailable: {str(e)}")
+        app.extensions['story_jobs'] = self
+
+    @property
+    def enabled(self):
+        return self._queue is not None and self.workers > 0
+
+    def submit(self, data):
+        """Queue a prepared story request, joining an identical job if one is pending. Returns the job."""
+        job_id, created = self._queue.enqueue(get_cache_key(data), data)
+        with self._lock:
+            self._stats['submitted' if created else 'deduplicated'] += 1
+        self._ensure_workers()
+        self._wake.set()
+        return self._queue.get(job_id)
+
+    def submit_finished(self, data, result):
+        """Record a request that was answered straight away (a cache hit) as a finished job."""
+        job_id = self._queue.add_finished(get_cache_key(data), data, result)
+        with self._lock:
+            self._stats['cached'] += 1
+        return self._queue.get(job_id)
+
+    def get(self, job_id):
+        self._ensure_workers()
+        return self._queue.get(job_id)
+
+    def wait(self, job_id, timeout):
+        """Return the job once it has finished or timeout seconds have passed; None if unknown."""
+        deadline = time.monotonic() + timeout
+        job = self.get(job_id)
+        while job is not None and job['status'] in ACTIVE:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            with self._changed:
+                self._changed.wait(min(self.poll_interval, left))
+            job = self._queue.get(job_id)
+        return job
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        try:
+            stats['by_status'] = self._queue.counts() if self._queue is not None else {}
+        except sqlite3.Error:
+            stats['by_status'] = {}
+        return stats
+
+    def _ensure_workers(self):
+        # Threads don't survive fork, so each worker process starts its own pool
+        if not self.enabled or (self._threads is not None and self._threads[0] == os.getpid()):
+            return
+        with self._lock:
+            if self._threads is not None and self._threads[0] == os.getpid():
+                return
+            threads = [
+                threading.Thread(target=self._work, name=f'story-job-{index}', daemon=True)
+                for index in range(self.workers)
+            ]
+            self._threads = (os.getpid(), threads)
+        for thread in threads:
+            thread.start()
+
+    def _work(self):
+        while True:
+            try:
+                # Leave a margin past the deadline before another worker may take the job over
+                job = self._queue.claim(lease=self.deadline + 30)
+            except sqlite3.Error as e:
+                self.app.logger.error(f"Story job queue error: {str(e)}")
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            try:
+                with self.app.app_context():
+                    self._run(job)
+            except Exception as e:
+                self.app.logger.error(f"Story job {job['id']} crashed: {str(e)}")
+                self._finish(job, FAILED, error='Story generation failed. Please try again.')
+
+    def _run(self, job):
+        # Routes import this module, so their helpers are imported late
+        from src.app.routes.story import (
+            fallback_story_response, generate_and_cache_story, story_failure_response, with_story_id
+        )
+
+        data = job['request']
+        if job['attempts'] > self.MAX_ATTEMPTS:
+            self._finish(job, FAILED, error='Story generation was interrupted. Please try again.')
+            return
+
+        start_request('story_job')
+        bind(age_group=data.get('ageGroup'), flow='artwork' if data.get('isArtworkFlow') else 'direct')
+        start_deadline(self.deadline)
+        try:
+            story, _ = story_flights.do(job['key'], generate_and_cache_story, data)
+        except Exception as e:
+            fallback = fallback_story_response(data, e)
+            if fallback is not None:
+                self._finish(job, DONE, result={'story': fallback['story'], 'cached': True, 'fallback': True})
+            else:
+                self._finish(job, FAILED, error=story_failure_response(e)[0]['error'])
+            return
+        self._finish(job, DONE, result=with_story_id({'story': story, 'cached': False}, data))
+
+    def _finish(self, job, status, result=None, error=None):
+        self._queue.finish(job['id'], status, result=result, error=error)
+        with self._lock:
+            if status == FAILED:
+                self._stats['failed'] += 1
+            else:
+                self._stats['fallbacks' if result.get('fallback') else 'completed'] += 1
+            self._finished += 1
+            trim = self._finished % 100 == 0
+        with self._changed:
+            self._changed.notify_all()
+        if trim:
+            self._queue.trim(time.time() - self.retention)
+
+
+story_jobs = StoryJobs()
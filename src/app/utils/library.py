@@ -0,0 +1,265 @@
+import atexit
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+import time
+
+from sqlalchemy import or_, select, text
+from sqlalchemy.exc import IntegrityError, OperationalError, SQLAlchemyError
+
+from src.app.models import Story, db
+from src.app.utils.similarity import story_features, story_index
+
+# Full-text index over titles and text, kept in step with the stories table by triggers (SQLite only)
+FTS_SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS stories_fts USING fts5("
+    " title, text, content='stories', content_rowid='rowid', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS stories_fts_insert AFTER INSERT ON stories BEGIN"
+    " INSERT INTO stories_fts (rowid, title, text) VALUES (new.rowid, new.title, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS stories_fts_delete AFTER DELETE ON stories BEGIN"
+    " INSERT INTO stories_fts (stories_fts, rowid, title, text) VALUES ('delete', old.rowid, old.title, old.text); END",
+    "CREATE TRIGGER IF NOT EXISTS stories_fts_update AFTER UPDATE ON stories BEGIN"
+    " INSERT INTO stories_fts (stories_fts, rowid, title, text) VALUES ('delete', old.rowid, old.title, old.text);"
+    " INSERT INTO stories_fts (rowid, title, text) VALUES (new.rowid, new.title, new.text); END",
+)
+
+STORY_ID = re.compile(r'[0-9a-f]{16}')
+# "# Title", "**Title**" or "Title: ..." on a story's first line
+_TITLE_LINE = re.compile(r'(?:#+\s*|\*\*|title:\s*)(.+?)\**$', re.IGNORECASE)
+
+
+def story_id(request_key):
+    """The public id of the story for a request key; the same in every worker and after restarts."""
+    return hashlib.sha256(f'story:{request_key}'.encode()).hexdigest()[:16]
+
+
+def story_title(story, prompt):
+    """The title the model put on the story's first line, else the prompt it was written for."""
+    first_line = story.strip().split('\n', 1)[0].strip()
+    match = _TITLE_LINE.fullmatch(first_line)
+    if match and len(match.group(1)) <= 120:
+        return match.group(1).strip(' *#"')
+    prompt = re.sub(r'\s+', ' ', str(prompt or '')).strip().rstrip('.')
+    return (prompt[:1].upper() + prompt[1:])[:120] or 'A story'
+
+
+class StoryLibrary:
+    """
+    Every generated story, kept in the app's SQLAlchemy database.
+
+    Stories are stored once per canonical request under a stable id, so
+    repeat requests are served from here after the cache has expired and
+    shared stories can be fetched at /story/<id>. Writes are queued and
+    a per-process thread inserts them in batches, so requests never wait
+    on the database; a full queue drops the write. On SQLite an FTS5
+    index makes titles and text searchable.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.fts = False
+        self.app = None
+        self.batch_size = 50
+        self.flush_interval = 1.0
+        self.max_queue = 1000
+        self._lock = threading.Lock()
+        self._queue = None
+        self._pid = None
+        self._stats = {'lookups': 0, 'hits': 0, 'saved': 0, 'duplicates': 0, 'dropped': 0, 'batches': 0, 'errors': 0}
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('STORY_LIBRARY_ENABLED', True)
+        self.batch_size = app.config.get('STORY_LIBRARY_BATCH_SIZE', self.batch_size)
+        self.flush_interval = app.config.get('STORY_LIBRARY_FLUSH_INTERVAL', self.flush_interval)
+        self.max_queue = app.config.get('STORY_LIBRARY_QUEUE_SIZE', self.max_queue)
+        app.extensions['story_library'] = self
+        if not self.enabled:
+            return
+        try:
+            with app.app_context():
+                self.fts = self._create_schema()
+                self._index_stories()
+        except SQLAlchemyError as e:
+            app.logger.error(f"Story library unavailable: {str(e)}")
+            self.enabled = False
+
+    def lookup(self, request_key):
+        """The stored story text for a request key, or None. Needs an app context."""
+        if not self.enabled:
+            return None
+        try:
+            story = db.session.scalar(select(Story.text).where(Story.request_key == request_key))
+        except SQLAlchemyError:
+            db.session.rollback()
+            self._count('errors')
+            return None
+        with self._lock:
+            self._stats['lookups'] += 1
+            self._stats['hits'] += story is not None
+        return story
+
+    def get(self, public_id):
+        """The Story with this public id, or None."""
+        if not self.enabled or not STORY_ID.fullmatch(public_id):
+            return None
+        return db.session.get(Story, public_id)
+
+    def search(self, query, limit=20):
+        """Stories matching every word of query (the last may be a prefix), best matches first."""
+        words = re.findall(r'\w+', query.lower())[:8]
+        if not self.enabled or not words:
+            return []
+        if self.fts:
+            match = ' '.join(f'"{word}"' for word in words[:-1]) + f' "{words[-1]}"*'
+            rows = db.session.execute(text(
+                "SELECT stories.id, stories.title, stories.age_group,"
+                " snippet(stories_fts, 1, '', '', '...', 16)"
+                " FROM stories_fts JOIN stories ON stories.rowid = stories_fts.rowid"
+                " WHERE stories_fts MATCH :match"
+                " ORDER BY bm25(stories_fts, 5.0, 1.0) LIMIT :limit"
+            ), {'match': match.strip(), 'limit': limit})
+        else:
+            conditions = [or_(Story.title.ilike(f'%{word}%'), Story.text.ilike(f'%{word}%')) for word in words]
+            rows = db.session.execute(
+                select(Story.id, Story.title, Story.age_group, Story.text)
+                .where(*conditions).order_by(Story.created_at.desc()).limit(limit)
+            )
+        return [
+            {'id': row[0], 'title': row[1], 'ageGroup': row[2], 'snippet': row[3] if self.fts else row[3][:200]}
+            for row in rows
+        ]
+
+    def save(self, request_key, canonical, story, prompt):
+        """Queue a story for the library. The first story stored for a request is the one kept."""
+        if not self.enabled or not story:
+            return
+        entry = {
+            'id': story_id(request_key),
+            'request_key': request_key,
+            'age_group': canonical.get('ageGroup') or 'preK',
+            'title': story_title(story, prompt),
+            'text': story,
+            'request': json.dumps(canonical, sort_keys=True),
+            'created_at': time.time(),
+        }
+        try:
+            self._pending().put_nowait(entry)
+        except queue.Full:
+            self._count('dropped')
+
+    def flush(self, timeout=5.0):
+        """Wait up to timeout seconds for queued stories to be written. Returns True if they all were."""
+        pending = self._queue if self._pid == os.getpid() else None
+        deadline = time.monotonic() + timeout
+        while pending is not None and pending.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queued'] = self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0
+        return stats
+
+    def _create_schema(self):
+        db.create_all()
+        fts = False
+        if db.engine.dialect.name == 'sqlite':
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                # Searches and lookups from other workers shouldn't wait on the writer
+                conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+                try:
+                    for statement in FTS_SCHEMA:
+                        conn.exec_driver_sql(statement)
+                    fts = True
+                except OperationalError as e:
+                    self.app.logger.warning(f"Story search falls back to LIKE, no FTS5: {str(e)}")
+        # Connections opened here must not be shared with forked workers
+        db.engine.dispose()
+        return fts
+
+    def _index_stories(self):
+        # Similar requests can be served from the start, not only once the cache has refilled
+        if not story_index.enabled:
+            return
+        rows = db.session.execute(
+            select(Story.request_key, Story.request)
+            .order_by(Story.created_at.desc()).limit(story_index.max_entries)
+        ).all()
+        # Oldest first, so the most recent stay indexed longest
+        for request_key, request in reversed(rows):
+            features, group = story_features(json.loads(request))
+            story_index.add(features, request_key, group)
+        db.session.remove()
+        db.engine.dispose()
+
+    def _pending(self):
+        # Threads don't survive fork; each process starts its own writer
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(self.max_queue)
+                    thread = threading.Thread(
+                        target=self._write_loop, args=(self._queue,), name='story-library-writer', daemon=True
+                    )
+                    thread.start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def _write_loop(self, pending):
+        while True:
+            batch = [pending.get()]
+            # Gather what arrives within flush_interval into one transaction
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(pending.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                with self.app.app_context():
+                    self._write(batch)
+            except Exception as e:
+                self._count('errors', len(batch))
+                self.app.logger.error(f"Story library write failed: {str(e)}")
+            finally:
+                for _ in batch:
+                    pending.task_done()
+
+    def _write(self, batch):
+        entries = {}
+        for entry in batch:
+            entries.setdefault(entry['request_key'], entry)
+        existing = set(db.session.scalars(select(Story.request_key).where(Story.request_key.in_(entries))))
+        new = [entry for key, entry in entries.items() if key not in existing]
+        duplicates = len(batch) - len(new)
+        try:
+            db.session.add_all(Story(**entry) for entry in new)
+            db.session.commit()
+        except IntegrityError:
+            # Another worker stored one of these in between; insert them one by one
+            db.session.rollback()
+            for entry in new:
+                try:
+                    db.session.add(Story(**entry))
+                    db.session.commit()
+                except IntegrityError:
+                    db.session.rollback()
+                    duplicates += 1
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['saved'] += len(batch) - duplicates
+            self._stats['duplicates'] += duplicates
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+
+story_library = StoryLibrary()
+atexit.register(story_library.flush)
@@ -1,7 +1,216 @@
+import math
+import sqlite3
+import time
+
+from flask import current_app
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from limits import parse_many
+from limits.errors import ConfigurationError
+from limits.storage import Storage
+from limits.strategies import STRATEGIES, RateLimiter
+from limits.util import WindowStats
+
+from src.app.utils.cache import SQLiteDatabase
+
+# Scope shared by every route that generates a story, so the limits are per client, not per route
+STORY_GENERATION_SCOPE = 'story-generation'
+
+
+class SQLiteStorage(SQLiteDatabase, Storage):
+    """
+    limits storage in a WAL-mode SQLite file shared by every worker on the node.
+
+    Selected with RATELIMIT_STORAGE_URI=sqlite:///path/to/file. Token
+    buckets are updated with a single UPSERT, so a check is one atomic
+    statement whichever worker runs it. Fixed-window counters are kept too
+    so the stock limits strategies also work on this storage.
+    """
+    STORAGE_SCHEME = ['sqlite']
+
+    # Expired rows are swept after this many writes per process
+    SWEEP_EVERY = 1000
+
+    def __init__(self, uri, wrap_exceptions=False, **options):
+        if not uri.startswith('sqlite:///'):
+            raise ConfigurationError(f"Expected a sqlite:///path storage uri, got {uri}")
+        Storage.__init__(self, uri, wrap_exceptions=wrap_exceptions)
+        SQLiteDatabase.__init__(self, uri[len('sqlite:///'):])
+        self._writes = 0
+
+    def _create_schema(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                granted INTEGER NOT NULL
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS counters (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL,
+                expires_at REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def acquire(self, key, capacity, period, cost=1):
+        """Take cost tokens from a bucket of capacity refilled over period seconds. True if granted."""
+        now = time.time()
+        params = {'key': key, 'capacity': capacity, 'rate': capacity / period, 'cost': cost,
+                  'now': now, 'expires_at': now + period}
+        conn = self._connection()
+        with conn:
+            # SET expressions all see the row as it was before the update
+            granted, = conn.execute("""
+                INSERT INTO buckets (key, tokens, updated_at, expires_at, granted)
+                VALUES (:key, CASE WHEN :cost <= :capacity THEN :capacity - :cost ELSE :capacity END,
+                        :now, :expires_at, :cost <= :capacity)
+                ON CONFLICT (key) DO UPDATE SET
+                    tokens = min(:capacity, tokens + (:now - updated_at) * :rate)
+                             - CASE WHEN min(:capacity, tokens + (:now - updated_at) * :rate) >= :cost
+                                    THEN :cost ELSE 0 END,
+                    granted = min(:capacity, tokens + (:now - updated_at) * :rate) >= :cost,
+                    updated_at = :now,
+                    expires_at = :expires_at
+                RETURNING granted
+            """, params).fetchone()
+        self._after_write()
+        return bool(granted)
+
+    def available(self, key, capacity, period):
+        """Tokens currently in a bucket, without taking any."""
+        row = self._connection().execute(
+            "SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return float(capacity)
+        tokens, updated_at = row
+        return min(capacity, tokens + (time.time() - updated_at) * capacity / period)
+
+    def incr(self, key, expiry, amount=1):
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            value, = conn.execute("""
+                INSERT INTO counters (key, value, expires_at) VALUES (:key, :amount, :expires_at)
+                ON CONFLICT (key) DO UPDATE SET
+                    value = CASE WHEN expires_at <= :now THEN :amount ELSE value + :amount END,
+                    expires_at = CASE WHEN expires_at <= :now THEN :expires_at ELSE expires_at END
+                RETURNING value
+            """, {'key': key, 'amount': amount, 'now': now, 'expires_at': now + expiry}).fetchone()
+        self._after_write()
+        return value
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value FROM counters WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        row = self._connection().execute(
+            "SELECT expires_at FROM counters WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self):
+        try:
+            self._connection().execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        conn = self._connection()
+        with conn:
+            cleared = conn.execute("DELETE FROM buckets").rowcount
+            cleared += conn.execute("DELETE FROM counters").rowcount
+        return cleared
+
+    def clear(self, key):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM buckets WHERE key = ?", (key,))
+            conn.execute("DELETE FROM counters WHERE key = ?", (key,))
+
+    def __len__(self):
+        conn = self._connection()
+        return sum(
+            conn.execute(f"SELECT COUNT(*) FROM {table} WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+            for table in ('buckets', 'counters')
+        )
+
+    def _after_write(self):
+        self._writes += 1
+        if self._writes % self.SWEEP_EVERY:
+            return
+        # A bucket past its expiry has refilled completely, so dropping it changes nothing
+        conn = self._connection()
+        with conn:
+            now = time.time()
+            conn.execute("DELETE FROM buckets WHERE expires_at <= ?", (now,))
+            conn.execute("DELETE FROM counters WHERE expires_at <= ?", (now,))
+
+
+class TokenBucketRateLimiter(RateLimiter):
+    """
+    Reads "N per period" as a token bucket: up to N tokens, refilled at N
+    per period, one taken per request. A client can burst N requests, and
+    after that is spaced out rather than locked out until a window resets.
+    """
+    def __init__(self, storage):
+        if not isinstance(storage, SQLiteStorage):
+            raise ConfigurationError("The token-bucket strategy needs a sqlite:/// storage uri")
+        super().__init__(storage)
+
+    def hit(self, item, *identifiers, cost=1):
+        return self.storage.acquire(item.key_for(*identifiers), item.amount, item.get_expiry(), cost)
+
+    def test(self, item, *identifiers, cost=1):
+        return self.storage.available(item.key_for(*identifiers), item.amount, item.get_expiry()) >= cost
+
+    def get_window_stats(self, item, *identifiers):
+        tokens = self.storage.available(item.key_for(*identifiers), item.amount, item.get_expiry())
+        # "Reset" is when the bucket is full again
+        refill_time = (item.amount - tokens) * item.get_expiry() / item.amount
+        return WindowStats(time.time() + refill_time, math.floor(tokens))
+
+
+STRATEGIES['token-bucket'] = TokenBucketRateLimiter
+
+
+def story_generation_limits():
+    """Per-client limits on story generation, from the app config."""
+    config = current_app.config
+    return ';'.join([
+        f"{config['MINUTE_RATE_LIMIT']} per minute",
+        f"{config['HOURLY_RATE_LIMIT']} per hour",
+        f"{config['DAILY_RATE_LIMIT']} per day",
+    ])
+
+
+def hit_story_generation_limits(remote_addr):
+    """
+    Charge one story generation to remote_addr for callers outside Flask's
+    request hooks (the ASGI routes). Uses the same keys as
+    story_generation_limit. Returns the breached limit, or None.
+    """
+    for item in sorted(parse_many(story_generation_limits())):
+        if not limiter.limiter.hit(item, remote_addr or '127.0.0.1', STORY_GENERATION_SCOPE):
+            return item
+    return None
+
 
 limiter = Limiter(
-    key_func=get_remote_address,
-    storage_uri="memory://"
-) 
\ No newline at end of file
+    key_func=get_remote_address
+)
+
+# Apply to each story generation route; the limits are charged once per request
+story_generation_limit = limiter.shared_limit(story_generation_limits, scope=STORY_GENERATION_SCOPE)
@@ -0,0 +1,225 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+from src.app.utils.metrics import request_labels
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s [%(route)s] %(message)s'
+
+# extra= for the verbose DEBUG categories that LOG_SAMPLE_RATES thins out
+PAYLOAD = {'sample': 'payload'}  # Request bodies and upstream responses
+PROMPT = {'sample': 'prompt'}
+
+# Libraries that log every request at INFO/DEBUG
+QUIET_LOGGERS = ('urllib3', 'httpx', 'httpcore')
+
+
+class Lazy:
+    """
+    A log argument built only if the record is emitted:
+    ``logger.debug("Response: %s", Lazy(json.dumps, result, indent=2))``
+    costs nothing when DEBUG is off or the record is sampled out.
+    """
+    __slots__ = ('func', 'args', 'kwargs')
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.func(*self.args, **self.kwargs))
+
+
+def lazy_json(obj, limit=2000):
+    """obj as indented JSON, cut at limit characters, built only if the record is emitted."""
+    return Lazy(_truncated_json, obj, limit)
+
+
+def _truncated_json(obj, limit):
+    text = json.dumps(obj, indent=2, default=str)
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+def parse_sample_rates(value):
+    """"payload=0.01,prompt=0.1" -> {'payload': 0.01, 'prompt': 0.1}"""
+    rates = {}
+    for part in (value or '').split(','):
+        if '=' not in part:
+            continue
+        category, rate = part.split('=', 1)
+        rates[category.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a share of the records logged with ``extra={'sample': category}``
+    (request bodies, API responses, prompts) at the category's rate.
+    Records without a category, and categories without a rate, all pass.
+    """
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self._lock = threading.Lock()
+        self._dropped = {}
+
+    def filter(self, record):
+        category = getattr(record, 'sample', None)
+        rate = self.rates.get(category, 1.0) if category is not None else 1.0
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        with self._lock:
+            self._dropped[category] = self._dropped.get(category, 0) + 1
+        return False
+
+    def dropped(self):
+        with self._lock:
+            return dict(self._dropped)
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamps records with the request's metric labels while still on the request's thread."""
+    def filter(self, record):
+        labels = request_labels()
+        record.route = labels['route']
+        record.age_group = labels['age_group']
+        record.flow = labels['flow']
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers."""
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'route': getattr(record, 'route', None),
+            'age_group': getattr(record, 'age_group', None),
+            'flow': getattr(record, 'flow', None),
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        if getattr(record, 'sample', None) is not None:
+            entry['sample'] = record.sample
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Hands records to a listener thread that formats and writes them, so
+    request threads never wait on the stream or file.
+
+    Only the message is merged on the calling thread (its arguments may
+    change once the call returns); tracebacks, formatting and I/O happen
+    on the listener. The queue is bounded and records past its size are
+    dropped rather than blocking. Threads don't survive fork, so each
+    process starts its own listener on first use.
+    """
+    def __init__(self, handlers, maxsize=10000):
+        super().__init__(None)
+        self.handlers = handlers
+        self.maxsize = maxsize
+        self._pid = None
+        self._listener = None
+        self._start_lock = threading.Lock()
+        self._dropped = 0
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        super().emit(record)
+
+    def prepare(self, record):
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._dropped += 1
+
+    def dropped(self):
+        return self._dropped
+
+    def stop(self):
+        """Write out what is queued and stop the listener (at exit, or before reconfiguring)."""
+        with self._start_lock:
+            listener, self._listener = self._listener, None
+            if listener is not None and self._pid == os.getpid():
+                listener.stop()
+            self._pid = None
+
+    def _start(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.maxsize)
+            self._listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+
+class AppLogging:
+    """
+    Production logging: LOG_LEVEL gates records before any formatting
+    happens, LOG_SAMPLE_RATES thins out the verbose payload categories,
+    and a BackgroundHandler on the root logger does the writing off the
+    request thread, as text or (LOG_FORMAT=json) one JSON object per line.
+    """
+    def __init__(self):
+        self.handler = None
+        self.sampler = SamplingFilter({})
+
+    def init_app(self, app):
+        level = logging.DEBUG if app.debug else app.config.get('LOG_LEVEL', 'INFO').upper()
+        if self.handler is not None:
+            # Reconfigured (another create_app), replace our handler rather than add a second
+            self.handler.stop()
+            logging.getLogger().removeHandler(self.handler)
+
+        log_file = app.config.get('LOG_FILE')
+        output = logging.FileHandler(log_file) if log_file else logging.StreamHandler()
+        if app.config.get('LOG_FORMAT', 'text') == 'json':
+            output.setFormatter(JSONFormatter())
+        else:
+            output.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+        self.sampler = SamplingFilter(parse_sample_rates(app.config.get('LOG_SAMPLE_RATES')))
+        self.handler = BackgroundHandler([output], maxsize=app.config.get('LOG_QUEUE_SIZE', 10000))
+        self.handler.addFilter(self.sampler)
+        self.handler.addFilter(RequestContextFilter())
+
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(self.handler)
+        for name in QUIET_LOGGERS:
+            logging.getLogger(name).setLevel(logging.WARNING)
+        app.logger.setLevel(level)
+        app.extensions['logging'] = self
+
+    def stats(self):
+        return {
+            'sampled_out': self.sampler.dropped(),
+            'queue_full': self.handler.dropped() if self.handler is not None else 0,
+        }
+
+    def shutdown(self):
+        if self.handler is not None:
+            self.handler.stop()
+
+
+app_logging = AppLogging()
+atexit.register(app_logging.shutdown)
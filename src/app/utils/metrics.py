@@ -0,0 +1,230 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+import time
+
+# Upper bounds (seconds) shared by every latency histogram
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# route/age_group/flow for the request being handled; set per request, read by every stage timer
+_request_labels = ContextVar('request_labels', default=None)
+DEFAULT_LABELS = {'route': 'background', 'age_group': '-', 'flow': '-'}
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values (Prometheus semantics)."""
+    def __init__(self, name, documentation, labelnames, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '-')) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for key, (counts, total, count) in sorted(series.items()):
+            labels = list(zip(self.labelnames, key))
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Counter:
+    """Monotonic count keyed by label values."""
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '-')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {value}")
+        return lines
+
+
+class CallbackFamily:
+    """Gauge or counter whose samples are read from a callback at scrape time."""
+    def __init__(self, name, documentation, metric_type, callback):
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self.callback = callback
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for labels, value in self.callback():
+            lines.append(f"{self.name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+        return lines
+
+
+class Metrics:
+    """
+    Per-process metrics registry rendered in the Prometheus text format.
+
+    Stage timings are histograms labelled with the current request's route,
+    age group and flow type (see bind). Cache, limiter, pool and similar
+    gauges are read from their owners' stats() when /metrics is scraped.
+    Each worker process keeps its own numbers, so scrape every worker (the
+    sum across workers is the node total).
+    """
+    def __init__(self):
+        self._families = {}
+        self._lock = threading.Lock()
+        self.enabled = True
+        self.stages = self.histogram(
+            'storytales_stage_seconds', 'Time spent in each stage of request handling',
+            ['stage', 'route', 'age_group', 'flow']
+        )
+        self.requests = self.histogram(
+            'storytales_request_seconds', 'Time to produce a response, by route and status',
+            ['route', 'status']
+        )
+        self.rate_limited = self.counter(
+            'storytales_ratelimit_rejections_total', 'Requests rejected by the rate limiter', ['route']
+        )
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+
+        @app.before_request
+        def start_request_timer():
+            from flask import g, request
+            g.request_started = time.perf_counter()
+            start_request(_route_label(request.endpoint))
+
+        @app.after_request
+        def observe_request(response):
+            from flask import g, request
+            started = g.pop('request_started', None)
+            if started is not None and request.endpoint != 'main.metrics_view':
+                self.requests.observe(
+                    time.perf_counter() - started,
+                    route=_route_label(request.endpoint), status=response.status_code
+                )
+            return response
+
+        from src.app.utils.collectors import register_collectors
+        register_collectors(self)
+        app.extensions['metrics'] = self
+
+    def histogram(self, name, documentation, labelnames, buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge_callback(self, name, documentation, callback):
+        """Register a gauge read at scrape time; callback returns [(labels, value)]."""
+        self._register(CallbackFamily(name, documentation, 'gauge', callback), replace=True)
+
+    def counter_callback(self, name, documentation, callback):
+        """Like gauge_callback, for totals kept by another component."""
+        self._register(CallbackFamily(name, documentation, 'counter', callback), replace=True)
+
+    def _register(self, family, replace=False):
+        # Registering by name keeps repeated create_app() calls from duplicating series
+        with self._lock:
+            existing = self._families.get(family.name)
+            if existing is not None and not replace:
+                return existing
+            self._families[family.name] = family
+            return family
+
+    def render(self):
+        lines = []
+        with self._lock:
+            families = list(self._families.values())
+        for family in families:
+            try:
+                lines.extend(family.collect())
+            except Exception as e:
+                # One broken collector shouldn't take down the whole scrape
+                lines.append(f"# {family.name} unavailable: {str(e)}")
+        return '\n'.join(lines) + '\n'
+
+
+def start_request(route):
+    """Reset stage labels for a new request (threads and tasks are reused across requests)."""
+    _request_labels.set(dict(DEFAULT_LABELS, route=route))
+
+
+def bind(**labels):
+    """Set route/age_group/flow labels for the stages of the current request."""
+    current = dict(_request_labels.get() or DEFAULT_LABELS)
+    current.update({name: value for name, value in labels.items() if value is not None})
+    _request_labels.set(current)
+
+
+def request_labels():
+    """The current request's route/age_group/flow labels."""
+    return _request_labels.get() or DEFAULT_LABELS
+
+
+def observe_stage(stage, seconds):
+    """Record seconds spent in stage under the current request's labels."""
+    if not metrics.enabled:
+        return
+    metrics.stages.observe(seconds, stage=stage, **(_request_labels.get() or DEFAULT_LABELS))
+
+
+@contextmanager
+def stage_timer(stage):
+    """Time the enclosed block as stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def _route_label(endpoint):
+    return (endpoint or 'unknown').rsplit('.', 1)[-1]
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+metrics = Metrics()
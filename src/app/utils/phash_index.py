@@ -0,0 +1,136 @@
+from collections import OrderedDict, defaultdict
+import threading
+
+
+class PerceptualIndex:
+    """
+    Near-duplicate lookup for 64-bit perceptual hashes by Hamming distance.
+
+    Hashes are split into max_distance + 1 bands. Two hashes within
+    max_distance bits must agree exactly on at least one band (pigeonhole),
+    so a search only verifies entries sharing a band bucket instead of
+    scanning the whole index. Entries are grouped (e.g. by normalized
+    keywords) and a search only matches within its group. The oldest
+    entries are evicted once max_entries is reached.
+    """
+    def __init__(self, max_distance=6, max_entries=10000, bits=64):
+        self.bits = bits
+        self._lock = threading.Lock()
+        self.configure(max_distance, max_entries)
+
+    def init_app(self, app):
+        self.configure(
+            app.config.get('ARTWORK_PHASH_MAX_DISTANCE', self.max_distance),
+            app.config.get('ARTWORK_PHASH_INDEX_SIZE', self.max_entries)
+        )
+        app.extensions['artwork_index'] = self
+
+    def configure(self, max_distance, max_entries):
+        """Set the match threshold and capacity. Clears the index."""
+        with self._lock:
+            self.max_distance = max_distance
+            self.max_entries = max_entries
+            self._bands = _band_layout(self.bits, max_distance + 1)
+            self._entries = OrderedDict()
+            self._buckets = defaultdict(set)
+            self._by_value = defaultdict(set)
+            self._next_id = 0
+            self._stats = {'lookups': 0, 'hits': 0, 'candidates': 0, 'evictions': 0}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.max_distance >= 0
+
+    def add(self, phash, value, group=''):
+        """Index value under phash within group."""
+        if not self.enabled or phash is None:
+            return
+        with self._lock:
+            while len(self._entries) >= self.max_entries:
+                self._evict_oldest()
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (phash, group, value)
+            self._by_value[value].add(entry_id)
+            for band in self._band_keys(phash, group):
+                self._buckets[band].add(entry_id)
+
+    def search(self, phash, group=''):
+        """Return (value, distance) for the closest entry within max_distance, or None."""
+        if not self.enabled or phash is None:
+            return None
+        with self._lock:
+            self._stats['lookups'] += 1
+            candidates = set()
+            for band in self._band_keys(phash, group):
+                bucket = self._buckets.get(band)
+                if bucket:
+                    candidates.update(bucket)
+            self._stats['candidates'] += len(candidates)
+
+            best = None
+            for entry_id in candidates:
+                entry_hash, _, value = self._entries[entry_id]
+                distance = bin(phash ^ entry_hash).count('1')
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (value, distance)
+            if best is not None:
+                self._stats['hits'] += 1
+            return best
+
+    def discard(self, value):
+        """Remove every entry pointing at value (e.g. once its cache entry expired)."""
+        with self._lock:
+            for entry_id in list(self._by_value.get(value, ())):
+                self._remove(entry_id)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['max_distance'] = self.max_distance
+        stats['avg_candidates'] = stats['candidates'] / stats['lookups'] if stats['lookups'] else 0.0
+        return stats
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _band_keys(self, phash, group):
+        for index, (shift, mask) in enumerate(self._bands):
+            yield (group, index, (phash >> shift) & mask)
+
+    def _evict_oldest(self):
+        entry_id = next(iter(self._entries))
+        self._remove(entry_id)
+        self._stats['evictions'] += 1
+
+    def _remove(self, entry_id):
+        phash, group, value = self._entries.pop(entry_id)
+        ids = self._by_value.get(value)
+        if ids is not None:
+            ids.discard(entry_id)
+            if not ids:
+                del self._by_value[value]
+        for band in self._band_keys(phash, group):
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[band]
+
+
+def _band_layout(bits, band_count):
+    """Split bits into band_count contiguous (shift, mask) bands of near-equal width."""
+    band_count = max(1, min(band_count, bits))
+    base, extra = divmod(bits, band_count)
+    layout = []
+    shift = 0
+    for index in range(band_count):
+        width = base + (1 if index < extra else 0)
+        layout.append((shift, (1 << width) - 1))
+        shift += width
+    return layout
+
+
+# Near-duplicate artwork uploads -> artwork_cache keys
+artwork_index = PerceptualIndex()
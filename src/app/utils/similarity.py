@@ -0,0 +1,176 @@
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
+import hashlib
+import re
+import struct
+import threading
+
+# Words that don't change what a story is about
+STOPWORDS = frozenset(
+    'a an the and or but of in on at to into onto with without who whom that which where when '
+    'is are was were be been being has have had for from by about over under his her their its it '
+    'this these those there some very'.split()
+)
+# Optional request fields; prefixed so a moral doesn't match the same word in the prompt
+STORY_FEATURE_FIELDS = ('moral', 'creature', 'magic', 'vibe')
+
+
+def text_features(text, prefix=''):
+    """
+    Shingles for similarity: each content word (plural s dropped) and its
+    character trigrams, so word order, filler words and small typos matter
+    little.
+    """
+    features = set()
+    for word in re.findall(r'[a-z0-9]+', str(text).lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        features.add(f'{prefix}w:{word}')
+        padded = f' {word} '
+        features.update(f'{prefix}c:{padded[i:i + 3]}' for i in range(len(padded) - 2))
+    return features
+
+
+def story_features(canonical):
+    """(features, group) for a canonical story request (see canonical_story_request)."""
+    features = text_features(canonical.get('mainPrompt', ''))
+    for field in STORY_FEATURE_FIELDS:
+        if canonical.get(field):
+            features |= text_features(canonical[field], prefix=f'{field}.')
+    # Only stories for the same age group, flow and variant may stand in for each other
+    group = (canonical.get('ageGroup') or 'preK', bool(canonical.get('isArtworkFlow')), canonical.get('variant') or 0)
+    return frozenset(features), group
+
+
+class MinHashIndex:
+    """
+    Lookup of sets by Jaccard similarity, with MinHash signatures and LSH.
+
+    Each entry's signature is split into bands; sets at least as similar
+    as the threshold share a band with high probability (16 bands of 4
+    rows miss fewer than 1 in 1000 pairs at 0.8), so a search only checks
+    entries sharing a band bucket and then compares the sets exactly.
+    Entries are grouped and a search only matches within its group. The
+    oldest entries are evicted once max_entries is reached.
+    """
+    def __init__(self, threshold=0.8, max_entries=10000, num_perm=64, bands=16):
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._lock = threading.Lock()
+        self.configure(threshold, max_entries)
+
+    def init_app(self, app):
+        self.configure(
+            app.config.get('STORY_SIMILARITY_THRESHOLD', self.threshold),
+            app.config.get('STORY_SIMILARITY_INDEX_SIZE', self.max_entries)
+        )
+        app.extensions['story_index'] = self
+
+    def configure(self, threshold, max_entries):
+        """Set the match threshold and capacity. Clears the index."""
+        with self._lock:
+            self.threshold = threshold
+            self.max_entries = max_entries
+            self._entries = OrderedDict()
+            self._buckets = defaultdict(set)
+            self._by_value = {}
+            self._next_id = 0
+            self._stats = {'lookups': 0, 'hits': 0, 'candidates': 0, 'evictions': 0}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and 0 < self.threshold <= 1
+
+    def signature(self, features):
+        count = self.bands * self.rows
+        return list(map(min, zip(*[_feature_hashes(feature, count) for feature in features])))
+
+    def add(self, features, value, group=''):
+        """Index value under a feature set within group; a value already indexed is left as it is."""
+        if not self.enabled or not features:
+            return
+        bands = self._band_keys(self.signature(features), group)
+        with self._lock:
+            if value in self._by_value:
+                return
+            while len(self._entries) >= self.max_entries:
+                self._evict_oldest()
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (features, bands, value)
+            self._by_value[value] = entry_id
+            for band in bands:
+                self._buckets[band].add(entry_id)
+
+    def search(self, features, group=''):
+        """Return (value, similarity) for the most similar entry at or above the threshold, or None."""
+        if not self.enabled or not features:
+            return None
+        bands = self._band_keys(self.signature(features), group)
+        with self._lock:
+            self._stats['lookups'] += 1
+            candidates = set()
+            for band in bands:
+                bucket = self._buckets.get(band)
+                if bucket:
+                    candidates.update(bucket)
+            self._stats['candidates'] += len(candidates)
+
+            best = None
+            for entry_id in candidates:
+                entry_features, _, value = self._entries[entry_id]
+                similarity = len(features & entry_features) / len(features | entry_features)
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (value, similarity)
+            if best is not None:
+                self._stats['hits'] += 1
+            return best
+
+    def discard(self, value):
+        """Remove the entry pointing at value (e.g. once its story is gone)."""
+        with self._lock:
+            entry_id = self._by_value.get(value)
+            if entry_id is not None:
+                self._remove(entry_id)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['threshold'] = self.threshold
+        stats['avg_candidates'] = stats['candidates'] / stats['lookups'] if stats['lookups'] else 0.0
+        return stats
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _band_keys(self, signature, group):
+        rows = self.rows
+        return [(group, band, tuple(signature[band * rows:(band + 1) * rows])) for band in range(self.bands)]
+
+    def _evict_oldest(self):
+        entry_id = next(iter(self._entries))
+        self._remove(entry_id)
+        self._stats['evictions'] += 1
+
+    def _remove(self, entry_id):
+        _, bands, value = self._entries.pop(entry_id)
+        self._by_value.pop(value, None)
+        for band in bands:
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[band]
+
+
+@lru_cache(maxsize=65536)
+def _feature_hashes(feature, count):
+    """A feature's value under count hash functions, from one extendable-output digest (16 bits each)."""
+    return struct.unpack(f'<{count}H', hashlib.shake_128(feature.encode()).digest(2 * count))
+
+
+# Similar story requests -> story_cache / story library keys
+story_index = MinHashIndex()
@@ -0,0 +1,129 @@
+import asyncio
+import threading
+
+from src.app.utils.deadline import remaining
+
+
+class _Call:
+    """One in-flight execution that followers can wait on."""
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls with the same key into one execution.
+
+    The first caller for a key (the leader) runs the work; callers that
+    arrive while it is running (followers) wait and receive the leader's
+    result or exception. Once the leader finishes the key is released, so
+    later callers are expected to hit the cache instead.
+
+    Threaded code uses do() (or begin()/wait()/finish() when the work can't
+    be wrapped in one call, e.g. a streamed response); asyncio code uses ado().
+    """
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+        self._stats = {'leaders': 0, 'followers': 0, 'errors': 0}
+
+    def begin(self, key):
+        """Join or start the flight for key. Returns (call, is_leader)."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._stats['followers'] += 1
+                return call, False
+            call = _Call()
+            self._calls[key] = call
+            self._stats['leaders'] += 1
+            return call, True
+
+    def finish(self, key, call, result=None, error=None):
+        """Publish the leader's outcome and release the key."""
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+            if error is not None:
+                self._stats['errors'] += 1
+        call.result = result
+        call.error = error
+        call.event.set()
+
+    def wait(self, call, timeout=None):
+        """Block until the leader finishes, then return its result or raise its error."""
+        if not call.event.wait(timeout):
+            raise TimeoutError(f"Timed out waiting for in-flight {self.name} request")
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn once per key across threads. Returns (result, shared)."""
+        call, is_leader = self.begin(key)
+        if not is_leader:
+            # A follower gives up when its own request's deadline does
+            left = remaining()
+            return self.wait(call, timeout=None if left is None else max(0.0, left)), True
+
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result=result)
+        return result, False
+
+    async def ado(self, key, fn, *args, **kwargs):
+        """
+        Await fn(*args, **kwargs) once per key on the event loop. Returns (result, shared).
+
+        The work runs in its own task, so one waiter being cancelled doesn't
+        cancel it for the others; it is only cancelled once every waiter has gone.
+        """
+        with self._lock:
+            entry = self._tasks.get(key)
+            shared = entry is not None
+            if shared:
+                self._stats['followers'] += 1
+            else:
+                task = asyncio.ensure_future(fn(*args, **kwargs))
+                entry = self._tasks[key] = {'task': task, 'waiters': 0}
+                task.add_done_callback(lambda t, key=key: self._forget(key, t))
+                self._stats['leaders'] += 1
+            entry['waiters'] += 1
+
+        task = entry['task']
+        try:
+            return await asyncio.shield(task), shared
+        except asyncio.CancelledError:
+            entry['waiters'] -= 1
+            if entry['waiters'] == 0 and not task.done():
+                task.cancel()
+            raise
+
+    def stats(self):
+        """Return leader/follower counts; followers are upstream calls saved."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls) + len(self._tasks)
+        return stats
+
+    def _forget(self, key, task):
+        with self._lock:
+            entry = self._tasks.get(key)
+            if entry is not None and entry['task'] is task:
+                del self._tasks[key]
+            if not task.cancelled() and task.exception() is not None:
+                self._stats['errors'] += 1
+
+
+# Story generation keyed by the story cache key; artwork analysis by image hash + keywords
+story_flights = SingleFlight('story')
+artwork_flights = SingleFlight('artwork')
@@ -0,0 +1,123 @@
+import threading
+from collections import deque
+from statistics import median
+
+
+class TokenBudget:
+    """
+    max_tokens per request type, calibrated from the usage the upstream reports.
+
+    Each key (e.g. an age group) keeps its recent completions: tokens used,
+    whether the reply was cut off (finish_reason "length"), and tokens per
+    word of prompt and story. Until ``min_samples`` completions are in,
+    the budget is the target word count at the learned tokens per word,
+    times ``headroom``. After that it is the (1 - truncation_rate) quantile
+    of completion lengths, so about that share of stories hit the limit.
+    Cut-off replies count as longer than any natural one: if more than
+    that share were cut off the quantile lands on them, and the budget
+    steps up to ``growth`` times the highest limit they were cut at until
+    enough stories finish within it. Whatever the budget, it is capped by
+    what the context has left after the prompt, so stories longer than
+    that are still cut off.
+    """
+    def __init__(self, name, config_prefix, context_tokens=2000, truncation_rate=0.02, headroom=1.5,
+                 tokens_per_word=1.3, window=200, min_samples=20, growth=1.5):
+        self.name = name
+        self.config_prefix = config_prefix
+        self.context_tokens = context_tokens
+        self.truncation_rate = truncation_rate
+        self.headroom = headroom
+        self.tokens_per_word = tokens_per_word
+        self.window = window
+        self.min_samples = min_samples
+        self.growth = growth
+        self._lock = threading.Lock()
+        self._keys = {}
+
+    def init_app(self, app):
+        config = app.config
+        prefix = self.config_prefix
+        self.context_tokens = config.get(f'{prefix}_CONTEXT_TOKENS', self.context_tokens)
+        self.truncation_rate = config.get(f'{prefix}_TRUNCATION_RATE', self.truncation_rate)
+        self.headroom = config.get(f'{prefix}_TOKEN_HEADROOM', self.headroom)
+        self.window = config.get(f'{prefix}_TOKEN_WINDOW', self.window)
+        self.min_samples = config.get(f'{prefix}_TOKEN_MIN_SAMPLES', self.min_samples)
+        self.growth = config.get(f'{prefix}_TOKEN_GROWTH', self.growth)
+        with self._lock:
+            self._keys = {}
+        app.extensions[f'token_budget.{self.name}'] = self
+
+    def max_tokens(self, key, target_words, prompt_words=0):
+        """Completion budget for key's next request, whose prompt is prompt_words long."""
+        with self._lock:
+            state = self._state(key)
+            budget = self._budget(state, target_words)
+            state['budget'] = int(budget)
+            prompt_ratio = _ratio(state['prompt_ratios'], self.tokens_per_word, self.min_samples)
+        available = self.context_tokens - prompt_words * prompt_ratio
+        return max(1, int(min(budget, available)))
+
+    def record(self, key, usage, finish_reason, text, prompt_words=0):
+        """Learn from a finished completion; usage is the response's usage object."""
+        completion_tokens = (usage or {}).get('completion_tokens')
+        if not completion_tokens:
+            return
+        truncated = finish_reason == 'length'
+        words = len(text.split()) if text else 0
+        prompt_tokens = (usage or {}).get('prompt_tokens')
+        with self._lock:
+            state = self._state(key)
+            # Sorts cut-off replies after every natural one, lowest limit first
+            state['lengths'].append((truncated, completion_tokens))
+            state['truncated' if truncated else 'completed'] += 1
+            # A cut-off story ends mid-word and skews the ratio
+            if words and not truncated:
+                state['story_ratios'].append(completion_tokens / words)
+            if prompt_words and prompt_tokens:
+                state['prompt_ratios'].append(prompt_tokens / prompt_words)
+
+    def stats(self):
+        with self._lock:
+            return {
+                key: {
+                    'budget': state['budget'],
+                    'completed': state['completed'],
+                    'truncated': state['truncated'],
+                    'tokens_per_word': _ratio(state['story_ratios'], self.tokens_per_word, self.min_samples),
+                    'samples': len(state['lengths']),
+                }
+                for key, state in self._keys.items()
+            }
+
+    def _state(self, key):
+        state = self._keys.get(key)
+        if state is None:
+            state = self._keys[key] = {
+                'lengths': deque(maxlen=self.window),
+                'story_ratios': deque(maxlen=self.window),
+                'prompt_ratios': deque(maxlen=self.window),
+                'completed': 0,
+                'truncated': 0,
+                'budget': None,
+            }
+        return state
+
+    def _budget(self, state, target_words):
+        lengths = state['lengths']
+        if len(lengths) < self.min_samples:
+            ratio = _ratio(state['story_ratios'], self.tokens_per_word, self.min_samples)
+            return target_words * ratio * self.headroom
+        ordered = sorted(lengths)
+        truncated, tokens = ordered[min(len(ordered) - 1, int((1 - self.truncation_rate) * len(ordered)))]
+        if truncated:
+            # Too many cut off: how long those stories would have run is unknown, so go past the limit
+            return ordered[-1][1] * self.growth
+        return tokens
+
+
+def _ratio(samples, default, min_samples):
+    return median(samples) if len(samples) >= min_samples else default
+
+
+# Story completions per age group (STORY_* settings)
+story_token_budget = TokenBudget('story', 'STORY')
@@ -0,0 +1,189 @@
+from collections import deque
+import copy
+import os
+import sqlite3
+import threading
+import time
+
+from src.app.utils.cache import cache_story, get_cache_key, story_cache
+from src.app.utils.library import story_library
+from src.app.utils.deadline import start_deadline
+from src.app.utils.limiter import SQLiteStorage, limiter
+from src.app.utils.singleflight import story_flights
+
+
+class StoryWarmer:
+    """
+    Pre-generates stories for the most requested prompts before they expire.
+
+    Every story request is recorded under its canonical cache key with an
+    exponentially decaying count. A background thread periodically takes
+    the hottest keys of each age group and, if their cached story is
+    missing or expires within refresh_window seconds, refills it from the
+    story library, or regenerates it when the library doesn't have it.
+    At most budget upstream calls are spent per hour; 0 disables warming.
+
+    Counts are per process, but the expiry check reads the shared cache, so
+    workers don't refresh a key another worker has just refreshed. The
+    budget is a token bucket in the rate limiter's SQLite storage, shared
+    by every worker on the node; without it (rate limiting off or another
+    storage) each worker has the whole budget to itself.
+    """
+    def __init__(self, budget=0, interval=60, refresh_window=600, top_n=10, min_hits=2,
+                 half_life=3600, max_tracked=1000):
+        self.budget = budget
+        self.interval = interval
+        self.refresh_window = refresh_window
+        self.top_n = top_n
+        self.min_hits = min_hits
+        self.half_life = half_life
+        self.max_tracked = max_tracked
+        self.app = None
+        self._lock = threading.Lock()
+        self._tracked = {}
+        self._calls = deque()
+        self._thread = None
+        self._stats = {'recorded': 0, 'warmed': 0, 'refilled': 0, 'failures': 0, 'skipped_budget': 0}
+
+    def init_app(self, app):
+        self.app = app
+        self.budget = app.config.get('STORY_WARMER_BUDGET', self.budget)
+        self.interval = app.config.get('STORY_WARMER_INTERVAL', self.interval)
+        self.refresh_window = app.config.get('STORY_WARMER_REFRESH_WINDOW', self.refresh_window)
+        self.top_n = app.config.get('STORY_WARMER_TOP_N', self.top_n)
+        self.min_hits = app.config.get('STORY_WARMER_MIN_HITS', self.min_hits)
+        app.extensions['story_warmer'] = self
+
+    @property
+    def enabled(self):
+        return self.app is not None and self.budget > 0 and self.interval > 0
+
+    def record(self, data):
+        """Count a prepared story request; the request itself is kept to regenerate it later."""
+        if not self.enabled:
+            return
+        key = get_cache_key(data)
+        now = time.time()
+        with self._lock:
+            entry = self._tracked.get(key)
+            if entry is None:
+                if len(self._tracked) >= self.max_tracked:
+                    self._drop_coldest(now)
+                entry = self._tracked[key] = {'data': copy.deepcopy(data), 'score': 0.0, 'at': now}
+            entry['score'] = self._decayed(entry, now) + 1
+            entry['at'] = now
+            self._stats['recorded'] += 1
+        self._ensure_thread()
+
+    def hot_keys(self, now=None):
+        """Return [(key, data, score)] for the top_n keys of each age group, hottest first."""
+        now = now or time.time()
+        by_age = {}
+        with self._lock:
+            for key, entry in self._tracked.items():
+                score = self._decayed(entry, now)
+                # Allow for the little decay since the latest request
+                if score >= self.min_hits - 0.05:
+                    age_group = entry['data'].get('ageGroup', 'preK')
+                    by_age.setdefault(age_group, []).append((key, entry['data'], score))
+        hot = []
+        for entries in by_age.values():
+            entries.sort(key=lambda item: item[2], reverse=True)
+            hot.extend(entries[:self.top_n])
+        hot.sort(key=lambda item: item[2], reverse=True)
+        return hot
+
+    def warm(self):
+        """Refresh hot keys that are missing or about to expire, within the hourly budget."""
+        now = time.time()
+        for key, data, _ in self.hot_keys(now):
+            expires_at = story_cache.expires_at(key)
+            if expires_at is not None and expires_at - now > self.refresh_window:
+                continue
+            # Stored stories don't change; refilling the cache from the library costs no upstream call
+            story = story_library.lookup(key)
+            if story is not None:
+                story_cache[key] = story
+                with self._lock:
+                    self._stats['refilled'] += 1
+                continue
+            if not self._take_budget(now):
+                with self._lock:
+                    self._stats['skipped_budget'] += 1
+                return
+            try:
+                # Shares the flight with any live request for the same key
+                story_flights.do(key, self._generate, data)
+            except Exception as e:
+                with self._lock:
+                    self._stats['failures'] += 1
+                self.app.logger.warning(f"Story warmer stopped this round: {str(e)}")
+                # The upstream is struggling; don't spend the rest of the budget on it
+                return
+            with self._lock:
+                self._stats['warmed'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['tracked'] = len(self._tracked)
+            stats['budget_used'] = len(self._calls)
+        stats['budget'] = self.budget
+        return stats
+
+    def _generate(self, data):
+        from src.llm_models.story_generator import StoryGenerator
+        # Same budget as a user request, so a slow upstream can't stall the warmer
+        start_deadline(self.app.config.get('REQUEST_DEADLINE', 45))
+        story = StoryGenerator().generate_story(copy.deepcopy(data))
+        cache_story(data, story)
+        return story
+
+    def _take_budget(self, now):
+        storage = getattr(limiter.limiter, 'storage', None) if limiter.enabled else None
+        with self._lock:
+            while self._calls and self._calls[0] <= now - 3600:
+                self._calls.popleft()
+            if isinstance(storage, SQLiteStorage):
+                try:
+                    granted = storage.acquire(WARMER_BUDGET_KEY, self.budget, 3600)
+                except sqlite3.Error:
+                    granted = False
+            else:
+                granted = len(self._calls) < self.budget
+            if granted:
+                self._calls.append(now)
+            return granted
+
+    def _decayed(self, entry, now):
+        return entry['score'] * 0.5 ** ((now - entry['at']) / self.half_life)
+
+    def _drop_coldest(self, now):
+        coldest = min(self._tracked, key=lambda key: self._decayed(self._tracked[key], now))
+        del self._tracked[coldest]
+
+    def _ensure_thread(self):
+        # Threads don't survive fork, so each worker starts its own warmer
+        if self._thread is not None and self._thread[0] == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread[0] == os.getpid():
+                return
+            thread = threading.Thread(target=self._run, name='story-warmer', daemon=True)
+            self._thread = (os.getpid(), thread)
+        thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    self.warm()
+            except Exception as e:
+                self.app.logger.error(f"Story warmer failed: {str(e)}")
+
+
+# Token bucket in the rate limiter's storage holding the node's warming budget
+WARMER_BUDGET_KEY = 'story-warmer/budget'
+
+story_warmer = StoryWarmer()
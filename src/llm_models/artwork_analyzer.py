@@ -1,11 +1,21 @@
 from flask import current_app
+from src.app.utils.breaker import UpstreamUnavailable
+from src.app.utils.deadline import DeadlineExceeded
+from src.app.utils.hedging import artwork_hedger, artwork_stream_hedger
+from src.app.utils.http_client import iter_completion_text, upstream, OPENROUTER
+from src.app.utils.cache import artwork_cache
+from src.app.utils.metrics import observe_stage, stage_timer
+from src.app.utils.logs import PAYLOAD, lazy_json
+from src.app.utils.phash_index import artwork_index
+from src.llm_models.image_pipeline import prepare_image
+from src.llm_models.json_extract import StringValueStream, extract_json_object
+import asyncio
+import httpx
 import requests
 import json
-from PIL import Image
-import io
-from cachetools import TTLCache
 import hashlib
 import base64
+from contextlib import ExitStack
 from io import BytesIO
 import os
 import time
@@ -13,26 +23,66 @@ import re
 import logging
 import traceback
 
-# Cache that expires after 1 hour
-artwork_cache = TTLCache(maxsize=100, ttl=3600)
+
+DEFAULT_MODEL = "google/learnlm-1.5-pro-experimental:free"
+
+# Streamed JSON paths (without the array position) shown as they arrive, and their events
+STREAM_ITEMS = {
+    ('comments',): ('comment', None),
+    ('questions',): ('question', None),
+    ('story_elements', 'characters'): ('story_element', 'characters'),
+    ('story_elements', 'setting'): ('story_element', 'setting'),
+    ('story_elements', 'moral'): ('story_element', 'moral'),
+}
+
+
+class _AnalysisStream:
+    """
+    A streamed reply whose first text has arrived. Iterating yields that
+    text and then the rest; leaving the with block closes the response and
+    the provider guard, which sees any error raised while reading.
+    """
+    def __init__(self, stack, first, texts, summary):
+        self._stack = stack
+        self._first = first
+        self._texts = texts
+        self.summary = summary
+
+    def __iter__(self):
+        yield self._first
+        yield from self._texts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._stack.__exit__(*exc_info)
+
+    def close(self):
+        self._stack.close()
+
 
 class ArtworkAnalyzer:
     """
     Analyzes children's artwork using LearnLM API to generate story elements
     """
     def __init__(self):
-        self.model = "google/learnlm-1.5-pro-experimental:free"
-        self.api_url = "https://openrouter.ai/api/v1/chat/completions"
+        # In order of preference; the rest are hedges and fallbacks for the first
+        self.models = list(current_app.config.get('ARTWORK_MODELS') or [DEFAULT_MODEL])
+        self.model = self.models[0]
+        self.api_url = f"{current_app.config.get('OPENROUTER_BASE_URL', 'https://openrouter.ai')}/api/v1/chat/completions"
         self.max_file_size = 5 * 1024 * 1024 # 5MB
         self.allowed_extensions = {'.jpg', '.jpeg', '.png', '.gif'}
-        self.required_headers = {
-            "HTTP-Referer": "https://storytales.kids",
-            "X-Title": "StoryTales"
-        }
         self.logger = current_app.logger
-        self.logger.debug(f"Initialized ArtworkAnalyzer with model: {self.model}")
+        self.logger.debug("Initialized ArtworkAnalyzer with model: %s", self.model)
         self.max_field_length = 300
         
+        # Outbound image preprocessing (see image_pipeline.prepare_image)
+        self.image_max_side = current_app.config.get('ARTWORK_IMAGE_MAX_SIDE', 768)
+        self.image_byte_budget = current_app.config.get('ARTWORK_IMAGE_BYTE_BUDGET', 100 * 1024)
+        self.image_format = current_app.config.get('ARTWORK_IMAGE_FORMAT', 'JPEG')
+        self._prepared_images = {}
+        
         # Add default_analysis as an instance attribute
         self.default_analysis = {
             "comments": ["What a creative artwork!"],
@@ -81,95 +131,73 @@ class ArtworkAnalyzer:
         If provided, incorporate these keywords into your analysis and story elements: {keywords}   
        """
 
-    def _compress_image(self, image_file, max_size=(800, 800), quality=85):
-        """Compress uploaded image for API processing"""
-        img = Image.open(image_file)
-        
-        # Convert to RGB if needed
-        if img.mode in ('RGBA', 'P'):
-            img = img.convert('RGB')
-        
-        # Resize if too large
-        if img.size[0] > max_size[0] or img.size[1] > max_size[1]:
-            img.thumbnail(max_size, Image.Resampling.LANCZOS)
-        
-        # Save compressed image
-        buffer = io.BytesIO()
-        img.save(buffer, format='JPEG', quality=quality, optimize=True)
-        buffer.seek(0)
-        
-        return buffer
-
     def _get_cache_key(self, image_data, keywords):
         """Generate cache key from image data and keywords"""
         image_hash = hashlib.md5(image_data.getvalue()).hexdigest()
-        keywords_hash = hashlib.md5(keywords.encode()).hexdigest()
+        keywords_hash = hashlib.md5(self._normalize_keywords(keywords).encode()).hexdigest()
         return f"{image_hash}_{keywords_hash}"
 
+    def _normalize_keywords(self, keywords):
+        """Lowercase, trim and sort comma-separated keywords so equivalent input shares a key"""
+        words = {re.sub(r'\s+', ' ', word).strip() for word in (keywords or "").lower().split(',')}
+        return ', '.join(sorted(word for word in words if word))
+
+    def request_key(self, image_file, keywords):
+        """Content-hash key for an upload; identical image bytes and keywords share a key"""
+        image_file.seek(0)
+        key = self._get_cache_key(BytesIO(image_file.read()), keywords or "")
+        image_file.seek(0)
+        return key
+
     def _truncate_field(self, text):
         """Truncate text to max field length"""
         return text[:self.max_field_length] if text else ""
 
-    def _encode_image(self, image_file):
-        """Convert image to base64 string"""
+    def _prepare_image(self, image_file):
+        """Run the preprocessing pipeline once per upload and remember the result"""
+        prepared = self._prepared_images.get(id(image_file))
+        if prepared is not None:
+            return prepared
+        
         # Reset file pointer to start
         image_file.seek(0)
         image_data = image_file.read()
+        # Reset file pointer again for subsequent reads
+        image_file.seek(0)
         if len(image_data) == 0:
             raise ValueError("Empty image file")
         
-        self.logger.debug(f"Image data length: {len(image_data)} bytes")
-        self.logger.debug(f"First 20 bytes: {image_data[:20].hex()}")
+        try:
+            prepared = prepare_image(
+                image_data,
+                max_side=self.image_max_side,
+                byte_budget=self.image_byte_budget,
+                image_format=self.image_format
+            )
+        except Exception as e:
+            # Unreadable by Pillow; let the model try the original bytes
+            self.logger.warning(f"Image preprocessing failed, sending original upload: {str(e)}")
+            prepared = {'data': image_data, 'mime_type': 'image/jpeg', 'dhash': None}
         
-        # Reset file pointer again for subsequent reads
-        image_file.seek(0)
-        return base64.b64encode(image_data).decode('utf-8')
+        self._prepared_images[id(image_file)] = prepared
+        return prepared
 
-    def analyze_artwork(self, image_file, keywords=""):
+    def _encode_image(self, image_file):
+        """Preprocess the upload and return (base64 string, mime type)"""
+        prepared = self._prepare_image(image_file)
+        return base64.b64encode(prepared['data']).decode('utf-8'), prepared['mime_type']
+
+    def analyze_artwork(self, image_file, keywords="", cache_key=None):
         """Analyze artwork and return structured insights"""
         try:
-            analysis = self._try_analyze(image_file, keywords, self.model)
-            
-            # Debug log the raw analysis
-            current_app.logger.debug("Raw analysis from _try_analyze:")
-            current_app.logger.debug(json.dumps(analysis, indent=2))
-            
-            if not analysis:
-                current_app.logger.error("Analysis is None or empty")
-                raise ValueError("No analysis returned from _try_analyze")
-                
-            if not isinstance(analysis, dict):
-                current_app.logger.error(f"Analysis is not a dict, got {type(analysis)}")
-                raise ValueError(f"Invalid analysis type: {type(analysis)}")
-                
-            # Check story_elements existence
-            if "story_elements" not in analysis:
-                current_app.logger.error("story_elements missing from analysis")
-                current_app.logger.error(f"Available keys: {list(analysis.keys())}")
-                raise ValueError("Missing story_elements in analysis")
-                
-            # Format the response to match what the frontend expects
-            formatted_response = {
-                "success": True,
-                "analysis": {
-                    "comments": analysis.get("comments", []),
-                    "questions": analysis.get("questions", []),
-                    "story_elements": {
-                        "characters": analysis.get("story_elements", {}).get("characters", []),
-                        "setting": analysis.get("story_elements", {}).get("setting", ["A magical place", "A cozy home"]),
-                        "moral": analysis.get("story_elements", {}).get("moral", "")
-                    }
-                }
-            }
+            cache_key = cache_key or self.request_key(image_file, keywords)
+            reused = self._reuse_analysis(cache_key, image_file, keywords)
+            if reused is not None:
+                return self._format_analysis(reused)
             
-            # Verify the formatted response
-            current_app.logger.debug("Formatted response structure:")
-            current_app.logger.debug(json.dumps(formatted_response, indent=2))
-            
-            if "story_elements" not in formatted_response["analysis"]:
-                current_app.logger.error("story_elements missing from formatted response")
-                raise ValueError("Failed to include story_elements in formatted response")
-                
+            analysis = self._analyze_with_models(image_file, keywords)
+            formatted_response = self._format_analysis(analysis)
+            self._cache_analysis(cache_key, analysis, image_file, keywords)
             return formatted_response
             
         except Exception as e:
@@ -183,61 +211,325 @@ class ArtworkAnalyzer:
                 "details": str(e)
             }
 
-    def _clean_json_text(self, text):
-        """Clean and extract JSON from text that may contain markdown or other formatting"""
+    async def aanalyze_artwork(self, image_file, keywords="", cache_key=None):
+        """Async variant of analyze_artwork for the ASGI serving path"""
         try:
-            # Remove any markdown code blocks if present
-            if text.startswith('```json'):
-                text = text.replace('```json', '', 1)
-            if text.endswith('```'):
-                text = text[:-3]
+            cache_key = cache_key or self.request_key(image_file, keywords)
+            # Near-duplicate lookup may decode the image, so keep it off the event loop
+            reused = await asyncio.to_thread(self._reuse_analysis, cache_key, image_file, keywords)
+            if reused is not None:
+                return self._format_analysis(reused)
+            
+            analysis = await self._aanalyze_with_models(image_file, keywords)
+            formatted_response = self._format_analysis(analysis)
+            await asyncio.to_thread(self._cache_analysis, cache_key, analysis, image_file, keywords)
+            return formatted_response
             
-            # Find the JSON object
-            start = text.find('{')
-            end = text.rfind('}') + 1
-            if start >= 0 and end > start:
-                text = text[start:end]
-
-            # Let json.loads handle the parsing
-            parsed = json.loads(text)
-            return json.dumps(parsed)  # Return clean, formatted JSON
+        except Exception as e:
+            current_app.logger.error(f"Error in analyze_artwork: {str(e)}")
+            current_app.logger.error("Full stack trace:", exc_info=True)
             
-        except json.JSONDecodeError as e:
-            self.logger.error(f"JSON Parse Error: {str(e)}")
-            self.logger.error(f"Problematic text: {text}")
-            raise
+            # Return error response
+            return {
+                "success": False,
+                "error": "Failed to analyze artwork",
+                "details": str(e)
+            }
 
-    def _repair_json(self, json_text):
+    def stream_analysis(self, image_file, keywords="", cache_key=None):
         """
-        Attempt to repair common JSON syntax errors
+        analyze_artwork over a streamed model response.
+
+        Yields ('comment' | 'question' | 'story_element', item) as soon as
+        each item's JSON string is complete, then ('analysis', result) where
+        result is exactly what analyze_artwork would have returned. Cached
+        analyses are replayed the same way.
         """
         try:
-            # First try to parse as is
-            return json.loads(json_text)
-        except json.JSONDecodeError:
-            # Fix missing commas in arrays (e.g., "item1" "item2")
-            json_text = re.sub(r'"\s*"', '", "', json_text)
-            
-            # Fix the specific issue we saw in the questions array
-            # Look for patterns like: "question1" "question2" or "question1"\n "question2"
-            json_text = re.sub(r'"\s*\n?\s*"', '", "', json_text)
-            
-            # Fix trailing commas in arrays (e.g., [1, 2, 3,])
-            json_text = re.sub(r',\s*]', ']', json_text)
-            json_text = re.sub(r',\s*}', '}', json_text)
-            
-            # Fix missing quotes around keys
-            json_text = re.sub(r'([{,]\s*)([a-zA-Z0-9_]+)(\s*:)', r'\1"\2"\3', json_text)
-            
-            # Log the repaired JSON for debugging
-            self.logger.debug(f"Repaired JSON: {json_text}")
-            
-            try:
-                return json.loads(json_text)
-            except json.JSONDecodeError as e:
-                self.logger.error(f"Failed to repair JSON: {str(e)}")
-                self.logger.error(f"Attempted repair on: {json_text}")
-                raise
+            cache_key = cache_key or self.request_key(image_file, keywords)
+            reused = self._reuse_analysis(cache_key, image_file, keywords)
+            if reused is not None:
+                formatted_response = self._format_analysis(reused)
+                yield from self.analysis_items(formatted_response)
+                yield 'analysis', formatted_response
+                return
+
+            analysis, finished = yield from self._stream_try_analyze(image_file, keywords)
+            formatted_response = self._format_analysis(analysis)
+            if finished:
+                self._cache_analysis(cache_key, analysis, image_file, keywords)
+            else:
+                # What arrived is good enough for this caller, not to reuse for every similar drawing
+                current_app.logger.warning("Analysis stream did not finish, not caching the partial analysis")
+            yield 'analysis', formatted_response
+
+        except Exception as e:
+            current_app.logger.error(f"Error in stream_analysis: {str(e)}")
+            current_app.logger.error("Full stack trace:", exc_info=True)
+            yield 'analysis', {
+                "success": False,
+                "error": "Failed to analyze artwork",
+                "details": str(e)
+            }
+
+    def analysis_items(self, formatted_response):
+        """The item events stream_analysis would have sent for a finished analysis."""
+        analysis = formatted_response.get('analysis', {})
+        for index, text in enumerate(analysis.get('comments', [])):
+            yield 'comment', {'text': text, 'index': index}
+        for index, text in enumerate(analysis.get('questions', [])):
+            yield 'question', {'text': text, 'index': index}
+        for field, values in analysis.get('story_elements', {}).items():
+            if isinstance(values, str):
+                yield 'story_element', {'text': values, 'field': field}
+                continue
+            for index, text in enumerate(values):
+                yield 'story_element', {'text': text, 'field': field, 'index': index}
+
+    def _stream_item(self, path, value):
+        """Turn a completed string from the streamed JSON into an item event, or None."""
+        positioned = bool(path) and isinstance(path[-1], int)
+        spec = STREAM_ITEMS.get(path[:-1] if positioned else path)
+        if spec is None:
+            return None
+        event, field = spec
+        item = {'text': value[:self.max_field_length]}
+        if field:
+            item['field'] = field
+        if positioned:
+            item['index'] = path[-1]
+        return event, item
+
+    def _reuse_analysis(self, cache_key, image_file, keywords):
+        """Return a cached analysis for this exact upload or a near-duplicate of it, or None"""
+        cached = artwork_cache.get(cache_key)
+        if cached is not None:
+            self.logger.info("Returning cached artwork analysis")
+            return cached
+        
+        if not artwork_index.enabled:
+            return None
+        
+        phash = self._prepare_image(image_file).get('dhash')
+        match = artwork_index.search(phash, group=self._normalize_keywords(keywords))
+        if match is None:
+            return None
+        
+        similar_key, distance = match
+        similar = artwork_cache.get(similar_key)
+        if similar is None:
+            # The earlier analysis has expired; forget it
+            artwork_index.discard(similar_key)
+            return None
+        
+        self.logger.info("Reusing analysis of a near-duplicate upload (distance %d)", distance)
+        artwork_cache.set(cache_key, similar)
+        return similar
+
+    def _cache_analysis(self, cache_key, analysis, image_file=None, keywords=""):
+        """Cache a real analysis; the shared default_analysis fallback is never cached"""
+        if analysis is self.default_analysis:
+            self.logger.debug("Not caching fallback analysis")
+            return
+        artwork_cache.set(cache_key, analysis)
+        
+        if image_file is not None and artwork_index.enabled:
+            phash = self._prepare_image(image_file).get('dhash')
+            artwork_index.add(phash, cache_key, group=self._normalize_keywords(keywords))
+
+    def _format_analysis(self, analysis):
+        """Validate a raw analysis and shape it the way the frontend expects."""
+        # Debug log the raw analysis
+        current_app.logger.debug("Raw analysis from _try_analyze: %s", lazy_json(analysis), extra=PAYLOAD)
+
+        if not analysis:
+            current_app.logger.error("Analysis is None or empty")
+            raise ValueError("No analysis returned from _try_analyze")
+
+        if not isinstance(analysis, dict):
+            current_app.logger.error(f"Analysis is not a dict, got {type(analysis)}")
+            raise ValueError(f"Invalid analysis type: {type(analysis)}")
+
+        # Check story_elements existence
+        if "story_elements" not in analysis:
+            current_app.logger.error("story_elements missing from analysis")
+            current_app.logger.error(f"Available keys: {list(analysis.keys())}")
+            raise ValueError("Missing story_elements in analysis")
+
+        # Format the response to match what the frontend expects
+        formatted_response = {
+            "success": True,
+            "analysis": {
+                "comments": analysis.get("comments", []),
+                "questions": analysis.get("questions", []),
+                "story_elements": {
+                    "characters": analysis.get("story_elements", {}).get("characters", []),
+                    "setting": analysis.get("story_elements", {}).get("setting", ["A magical place", "A cozy home"]),
+                    "moral": analysis.get("story_elements", {}).get("moral", "")
+                }
+            }
+        }
+
+        # Verify the formatted response
+        current_app.logger.debug("Formatted response structure: %s", lazy_json(formatted_response), extra=PAYLOAD)
+
+        if "story_elements" not in formatted_response["analysis"]:
+            current_app.logger.error("story_elements missing from formatted response")
+            raise ValueError("Failed to include story_elements in formatted response")
+
+        return formatted_response
+
+    def _build_request(self, image_file, keywords, model):
+        """Build the chat-completions payload, or return None if analysis can't run."""
+        # Reset file pointer
+        image_file.seek(0)
+
+        # Downscale, re-encode and base64 the image
+        image_b64, mime_type = self._encode_image(image_file)
+
+        # Prepare the API request
+        self.logger.debug("Preparing API request...")
+
+        # Get the API key
+        api_key = os.environ.get('OPENROUTER_API_KEY')
+        if not api_key:
+            self.logger.error("OPENROUTER_API_KEY not found in environment variables")
+            return None
+
+        # Format the prompt
+        prompt = self.prompt_template.format(keywords=keywords or "None provided")
+
+        # Log image data length for debugging
+        self.logger.debug("Image data length: %d bytes", len(image_b64))
+        image_file.seek(0)  # Reset file pointer
+
+        # Prepare the payload
+        payload = {
+            "model": model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{image_b64}"}}
+                    ]
+                }
+            ]
+        }
+
+        self.logger.debug("Payload prepared")
+        
+        return payload
+
+    def _parse_response(self, result):
+        """Validate an OpenRouter response and return the analysis dict (or the default)."""
+        # Log the full response for debugging
+        self.logger.debug("API Response: %s", lazy_json(result), extra=PAYLOAD)
+
+        # Check if the response has the expected structure
+        if 'choices' not in result:
+            self.logger.error(f"Unexpected API response format: {json.dumps(result, indent=2)}")
+            return self.default_analysis
+
+        analysis_text = result['choices'][0]['message']['content']
+
+        # Extract the JSON object, repairing it in the same pass if need be
+        try:
+            with stage_timer('json_parse'):
+                analysis, repaired = extract_json_object(analysis_text)
+        except ValueError:
+            self.logger.error(f"Could not extract JSON from response: {analysis_text}")
+            return self.default_analysis
+        if repaired:
+            self.logger.info("Repaired malformed JSON in the analysis response")
+            self.logger.debug("Original analysis text: %s", analysis_text, extra=PAYLOAD)
+
+        # Validate the analysis structure
+        if not isinstance(analysis, dict):
+            self.logger.error(f"Analysis is not a dictionary: {type(analysis)}")
+            return self.default_analysis
+
+        required_keys = ['comments', 'questions', 'story_elements']
+        for key in required_keys:
+            if key not in analysis:
+                self.logger.error(f"Missing required key in analysis: {key}")
+                return self.default_analysis
+
+        # Validate story_elements
+        story_elements = analysis.get('story_elements', {})
+        if not isinstance(story_elements, dict):
+            self.logger.error(f"story_elements is not a dictionary: {type(story_elements)}")
+            return self.default_analysis
+
+        required_story_keys = ['characters', 'setting', 'moral']
+        for key in required_story_keys:
+            if key not in story_elements:
+                self.logger.error(f"Missing required key in story_elements: {key}")
+                story_elements[key] = self.default_analysis['story_elements'][key]
+
+        # Ensure lists are lists
+        for key in ['comments', 'questions']:
+            if not isinstance(analysis[key], list):
+                self.logger.error(f"{key} is not a list: {type(analysis[key])}")
+                analysis[key] = self.default_analysis[key]
+
+        for key in ['characters', 'setting']:
+            if not isinstance(story_elements[key], list):
+                self.logger.error(f"{key} is not a list: {type(story_elements[key])}")
+                story_elements[key] = self.default_analysis['story_elements'][key]
+
+        # Truncate long fields
+        for key in ['comments', 'questions']:
+            analysis[key] = [item[:self.max_field_length] for item in analysis[key]]
+
+        for key in ['characters', 'setting']:
+            story_elements[key] = [item[:self.max_field_length] for item in story_elements[key]]
+
+        if isinstance(story_elements['moral'], str):
+            story_elements['moral'] = story_elements['moral'][:self.max_field_length]
+
+        return analysis
+
+    def _analyze_with_models(self, image_file, keywords):
+        """
+        Analyze with the configured models in order, hedging the first when
+        it is slow and falling back when it fails (see Hedger).
+        """
+        if len(self.models) == 1:
+            return self._try_analyze(image_file, keywords, self.model)
+
+        # Encoded once; the upload can't be read by two threads at a time
+        payload = self._build_request(image_file, keywords, self.model)
+        if payload is None:
+            return self.default_analysis
+        analysis, model = artwork_hedger.run(
+            self.models, lambda model: self._request_analysis(dict(payload, model=model)), self._answered
+        )
+        return self._hedged_result(analysis, model)
+
+    async def _aanalyze_with_models(self, image_file, keywords):
+        """Async variant of _analyze_with_models; the slower request is cancelled."""
+        if len(self.models) == 1:
+            return await self._atry_analyze(image_file, keywords, self.model)
+
+        payload = await asyncio.to_thread(self._build_request, image_file, keywords, self.model)
+        if payload is None:
+            return self.default_analysis
+        analysis, model = await artwork_hedger.arun(
+            self.models, lambda model: self._arequest_analysis(dict(payload, model=model)), self._answered
+        )
+        return self._hedged_result(analysis, model)
+
+    def _answered(self, analysis):
+        # Every failure path returns the shared default_analysis
+        return analysis is not None and analysis is not self.default_analysis
+
+    def _hedged_result(self, analysis, model):
+        if model is None:
+            return self.default_analysis
+        if model != self.model:
+            self.logger.info("Artwork analysis answered by %s", model)
+        return analysis
 
     def _try_analyze(self, image_file, keywords, model):
         """
@@ -252,159 +544,186 @@ class ArtworkAnalyzer:
             dict: Analysis results
         """
         try:
-            # Reset file pointer
-            image_file.seek(0)
-            
-            # Encode the image as base64
-            image_b64 = self._encode_image(image_file)
-            
-            # Prepare the API request
-            self.logger.debug("Preparing API request...")
-            
-            # Get the API key
-            api_key = os.environ.get('OPENROUTER_API_KEY')
-            if not api_key:
-                self.logger.error("OPENROUTER_API_KEY not found in environment variables")
+            payload = self._build_request(image_file, keywords, model)
+            if payload is None:
                 return self.default_analysis
-            
-            # Prepare headers
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {api_key}"
-            }
-            
-            # Add required headers
-            for key, value in self.required_headers.items():
-                headers[key] = value
+            return self._request_analysis(payload)
                 
-            self.logger.debug("Headers prepared")
-            
-            # Format the prompt
-            prompt = self.prompt_template.format(keywords=keywords or "None provided")
-            
-            # Log image data length for debugging
-            self.logger.debug(f"Image data length: {len(image_b64)} bytes")
-            self.logger.debug(f"First 20 bytes: {image_file.read(20).hex()}")
-            image_file.seek(0)  # Reset file pointer
-            
-            # Prepare the payload
-            payload = {
-                "model": model,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_b64}"}}
-                        ]
-                    }
-                ]
-            }
-            
-            self.logger.debug("Payload prepared")
-            
+        except Exception as e:
+            self.logger.error(f"Unexpected error in _try_analyze: {str(e)}")
+            self.logger.error(f"Full stack trace:\n{traceback.format_exc()}")
+            return self.default_analysis
+
+    def _request_analysis(self, payload):
+        """Send a prepared analysis request and parse the reply. Returns the analysis or the default."""
+        try:
             # Make the API request
             try:
                 self.logger.debug("Making API request to OpenRouter...")
-                response = requests.post(
-                    self.api_url,
-                    headers=headers,
-                    json=payload,
-                    timeout=30,
-                    verify=True
-                )
-                self.logger.debug(f"API Response Status: {response.status_code}")
-                result = response.json()
-                
-                # Log the full response for debugging
-                self.logger.debug(f"API Response: {json.dumps(result, indent=2)}")
-                
-                # Check if the response has the expected structure
-                if 'choices' not in result:
-                    self.logger.error(f"Unexpected API response format: {json.dumps(result, indent=2)}")
-                    return self.default_analysis
+                # Shared keep-alive session; auth and referer headers are preset
+                with upstream.guard(OPENROUTER).call():
+                    with stage_timer('upstream_total'):
+                        response = upstream.send(OPENROUTER, lambda timeout: upstream.session(OPENROUTER).post(
+                            self.api_url,
+                            json=payload,
+                            timeout=timeout
+                        ), read_timeout=30)
+                    self.logger.debug("API Response Status: %s", response.status_code)
+                    # Error statuses count against the provider's circuit breaker
+                    response.raise_for_status()
+                return self._parse_response(response.json())
                 
-                analysis_text = result['choices'][0]['message']['content']
-                
-                # Extract the JSON part
-                json_match = re.search(r'```json\s*(.*?)\s*```', analysis_text, re.DOTALL)
-                if json_match:
-                    analysis_json = json_match.group(1)
-                else:
-                    # Try to find any JSON object in the text
-                    json_match = re.search(r'(\{.*\})', analysis_text, re.DOTALL)
-                    if json_match:
-                        analysis_json = json_match.group(1)
-                    else:
-                        self.logger.error(f"Could not extract JSON from response: {analysis_text}")
-                        return self.default_analysis
-                
-                # Parse the JSON
-                try:
-                    analysis = json.loads(analysis_json)
-                except json.JSONDecodeError as e:
-                    self.logger.error(f"Failed to parse JSON: {str(e)}")
-                    self.logger.error(f"JSON text: {analysis_json}")
-                    
-                    # Try to repair the JSON
-                    try:
-                        analysis = self._repair_json(analysis_json)
-                        self.logger.info("Successfully repaired and parsed JSON after fixing syntax errors")
-                    except Exception as repair_error:
-                        self.logger.error(f"Failed to repair JSON: {str(repair_error)}")
-                        return self.default_analysis
-                
-                # Validate the analysis structure
-                if not isinstance(analysis, dict):
-                    self.logger.error(f"Analysis is not a dictionary: {type(analysis)}")
-                    return self.default_analysis
-                
-                required_keys = ['comments', 'questions', 'story_elements']
-                for key in required_keys:
-                    if key not in analysis:
-                        self.logger.error(f"Missing required key in analysis: {key}")
-                        return self.default_analysis
-                
-                # Validate story_elements
-                story_elements = analysis.get('story_elements', {})
-                if not isinstance(story_elements, dict):
-                    self.logger.error(f"story_elements is not a dictionary: {type(story_elements)}")
-                    return self.default_analysis
-                
-                required_story_keys = ['characters', 'setting', 'moral']
-                for key in required_story_keys:
-                    if key not in story_elements:
-                        self.logger.error(f"Missing required key in story_elements: {key}")
-                        story_elements[key] = self.default_analysis['story_elements'][key]
-                
-                # Ensure lists are lists
-                for key in ['comments', 'questions']:
-                    if not isinstance(analysis[key], list):
-                        self.logger.error(f"{key} is not a list: {type(analysis[key])}")
-                        analysis[key] = self.default_analysis[key]
-                
-                for key in ['characters', 'setting']:
-                    if not isinstance(story_elements[key], list):
-                        self.logger.error(f"{key} is not a list: {type(story_elements[key])}")
-                        story_elements[key] = self.default_analysis['story_elements'][key]
-                
-                # Truncate long fields
-                for key in ['comments', 'questions']:
-                    analysis[key] = [item[:self.max_field_length] for item in analysis[key]]
-                
-                for key in ['characters', 'setting']:
-                    story_elements[key] = [item[:self.max_field_length] for item in story_elements[key]]
+            except (UpstreamUnavailable, DeadlineExceeded) as e:
+                self.logger.warning(f"Skipping analysis: {str(e)}")
+                return self.default_analysis
+            except requests.exceptions.RequestException as e:
+                self.logger.error(f"Request error: {str(e)}")
+                return self.default_analysis
                 
-                if isinstance(story_elements['moral'], str):
-                    story_elements['moral'] = story_elements['moral'][:self.max_field_length]
+        except Exception as e:
+            self.logger.error(f"Unexpected error in _request_analysis ({payload.get('model')}): {str(e)}")
+            self.logger.error(f"Full stack trace:\n{traceback.format_exc()}")
+            return self.default_analysis
+
+    def _stream_try_analyze(self, image_file, keywords):
+        """
+        _analyze_with_models with stream=True. Yields item events as the
+        reply arrives and returns (analysis, finished): the parsed analysis
+        (or the default) and whether the reply came to its end rather than
+        being cut off.
+
+        Streams can't be merged once one has started, so the models are
+        hedged on time to first token: the first stream to produce text is
+        read to the end and the others are closed (see _start_stream).
+        """
+        payload = self._build_request(image_file, keywords, self.model)
+        if payload is None:
+            return self.default_analysis, False
+        payload["stream"] = True
+
+        started = time.perf_counter()
+        stream = self._start_stream(payload)
+        if stream is None:
+            return self.default_analysis, False
+        observe_stage('upstream_first_token', time.perf_counter() - started)
+
+        parts = []
+        finished = False
+        strings = StringValueStream()
+        try:
+            with stream:
+                for text in stream:
+                    parts.append(text)
+                    for path, value in strings.feed(text):
+                        item = self._stream_item(path, value)
+                        if item is not None:
+                            yield item
+            observe_stage('upstream_total', time.perf_counter() - started)
+            # A connection closed early or a reply stopped at max_tokens holds only part of the analysis
+            finish_reason = stream.summary.get('finish_reason')
+            finished = (finish_reason is not None or stream.summary.get('done', False)) and finish_reason != 'length'
+
+        except (UpstreamUnavailable, DeadlineExceeded) as e:
+            self.logger.warning(f"Analysis stream cut off: {str(e)}")
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f"Request error: {str(e)}")
+
+        # A reply cut off part way is still parsed for what it holds
+        return self._parse_response({'choices': [{'message': {'content': ''.join(parts)}}]}), finished
+
+    def _start_stream(self, payload):
+        """
+        Open the analysis stream of the first model to send text, hedging
+        the first model when it is slow to start and falling back when it
+        fails (see Hedger). Returns the open _AnalysisStream, or None.
+        """
+        if len(self.models) == 1:
+            return self._open_stream(payload)
+
+        stream, model = artwork_stream_hedger.run(
+            self.models,
+            lambda model: self._open_stream(dict(payload, model=model)),
+            lambda stream: stream is not None,
+            discard=lambda stream: stream.close()
+        )
+        if model is not None and model != self.model:
+            self.logger.info("Artwork analysis streamed by %s", model)
+        return stream
+
+    def _open_stream(self, payload):
+        """
+        Send a streamed analysis request and wait for its first text.
+        Returns an _AnalysisStream holding the provider guard and the
+        response open, or None if the request failed or the reply was
+        empty.
+        """
+        try:
+            self.logger.debug("Making streaming API request to OpenRouter (%s)...", payload.get('model'))
+            with ExitStack() as stack:
+                # Held for the whole stream, like story streaming
+                stack.enter_context(upstream.guard(OPENROUTER).call())
+                # Retried only until the stream starts; the read timeout applies between chunks
+                response = stack.enter_context(upstream.send(OPENROUTER, lambda timeout: upstream.session(OPENROUTER).post(
+                    self.api_url,
+                    json=payload,
+                    timeout=(min(5, timeout), timeout),
+                    stream=True,
+                    headers={"Accept": "text/event-stream"}
+                ), read_timeout=30))
+                self.logger.debug("API Response Status: %s", response.status_code)
+                response.raise_for_status()
+                summary = {}
+                texts = iter_completion_text(response, summary)
+                first = next(texts, None)
+                if first is None:
+                    self.logger.warning(f"Empty analysis stream from {payload.get('model')}")
+                    return None
+                # The caller reads the rest and closes the guard and response
+                return _AnalysisStream(stack.pop_all(), first, texts, summary)
+
+        except (UpstreamUnavailable, DeadlineExceeded) as e:
+            self.logger.warning(f"Skipping analysis: {str(e)}")
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f"Request error ({payload.get('model')}): {str(e)}")
+        return None
+
+    async def _atry_analyze(self, image_file, keywords, model):
+        """Async variant of _try_analyze for the ASGI serving path."""
+        try:
+            # Image encoding is CPU-bound; keep it off the event loop
+            payload = await asyncio.to_thread(self._build_request, image_file, keywords, model)
+            if payload is None:
+                return self.default_analysis
+            return await self._arequest_analysis(payload)
                 
-                return analysis
+        except Exception as e:
+            self.logger.error(f"Unexpected error in _atry_analyze: {str(e)}")
+            self.logger.error(f"Full stack trace:\n{traceback.format_exc()}")
+            return self.default_analysis
+
+    async def _arequest_analysis(self, payload):
+        """Async variant of _request_analysis."""
+        try:
+            try:
+                self.logger.debug("Making async API request to OpenRouter...")
+                client = upstream.async_client(OPENROUTER)
+                async with upstream.guard(OPENROUTER).acall():
+                    with stage_timer('upstream_total'):
+                        response = await upstream.asend(OPENROUTER, lambda timeout: client.post(
+                            self.api_url, json=payload, timeout=timeout
+                        ), read_timeout=30)
+                    self.logger.debug("API Response Status: %s", response.status_code)
+                    response.raise_for_status()
+                return self._parse_response(response.json())
                 
-            except requests.exceptions.RequestException as e:
+            except (UpstreamUnavailable, DeadlineExceeded) as e:
+                self.logger.warning(f"Skipping analysis: {str(e)}")
+                return self.default_analysis
+            except httpx.HTTPError as e:
                 self.logger.error(f"Request error: {str(e)}")
                 return self.default_analysis
                 
         except Exception as e:
-            self.logger.error(f"Unexpected error in _try_analyze: {str(e)}")
+            self.logger.error(f"Unexpected error in _arequest_analysis ({payload.get('model')}): {str(e)}")
             self.logger.error(f"Full stack trace:\n{traceback.format_exc()}")
-            return self.default_analysis 
\ No newline at end of file
+            return self.default_analysis
@@ -0,0 +1,128 @@
+from PIL import Image, ImageOps
+import io
+import logging
+import time
+
+from src.app.utils.metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+# Vision models downscale internally; larger uploads only cost transfer time
+DEFAULT_MAX_SIDE = 768
+DEFAULT_BYTE_BUDGET = 100 * 1024
+QUALITY_STEPS = (85, 75, 65, 55)
+MIN_SIDE = 256
+
+MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+    'PNG': 'image/png',
+}
+
+
+def prepare_image(image_data, max_side=DEFAULT_MAX_SIDE, byte_budget=DEFAULT_BYTE_BUDGET, image_format='JPEG'):
+    """
+    Shrink an uploaded image to what the vision model actually needs.
+
+    Decodes with JPEG draft mode (so big phone photos are decoded at a
+    reduced scale), applies EXIF orientation, flattens transparency onto
+    white, resizes so the longest side is at most max_side, and re-encodes
+    stepping quality (then size) down until the result fits byte_budget.
+
+    Returns a dict with the encoded bytes, mime type, dimensions, a 64-bit
+    perceptual hash (see dhash), before and after sizes and decode/encode
+    timings in milliseconds.
+    """
+    started = time.perf_counter()
+    img = Image.open(io.BytesIO(image_data))
+    source_format = img.format
+
+    # Let libjpeg decode at 1/2, 1/4 or 1/8 scale when that still covers max_side
+    if source_format == 'JPEG':
+        img.draft('RGB', (max_side, max_side))
+
+    img = ImageOps.exif_transpose(img)
+    img = _flatten(img)
+    if max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    image_hash = dhash(img)
+    decoded = time.perf_counter()
+
+    encoded_data, quality = _encode_within_budget(img, image_format, byte_budget)
+    while len(encoded_data) > byte_budget and min(img.size) > MIN_SIDE:
+        # Quality alone wasn't enough; trade resolution instead
+        img = img.resize((int(img.width * 0.75), int(img.height * 0.75)), Image.Resampling.LANCZOS)
+        encoded_data, quality = _encode_within_budget(img, image_format, byte_budget)
+    finished = time.perf_counter()
+
+    result = {
+        'data': encoded_data,
+        'mime_type': MIME_TYPES.get(image_format, 'image/jpeg'),
+        'width': img.width,
+        'height': img.height,
+        'quality': quality,
+        'source_format': source_format,
+        'dhash': image_hash,
+        'original_size': len(image_data),
+        'size': len(encoded_data),
+        'decode_ms': (decoded - started) * 1000,
+        'encode_ms': (finished - decoded) * 1000,
+    }
+    observe_stage('image_decode', decoded - started)
+    observe_stage('image_encode', finished - decoded)
+    logger.info(
+        "Prepared artwork image: %s %d bytes -> %s %dx%d %d bytes (q%s, decode %.1fms, encode %.1fms)",
+        source_format, result['original_size'], image_format, result['width'], result['height'],
+        result['size'], quality, result['decode_ms'], result['encode_ms']
+    )
+    return result
+
+
+def dhash(img, hash_size=8):
+    """
+    Difference hash: a hash_size**2-bit integer describing the image's gradients.
+
+    Re-photographs, re-encodes and small exposure or crop changes of the same
+    drawing land within a few bits of each other (compare with hamming_distance).
+    """
+    small = img.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BOX)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a, b):
+    """Number of differing bits between two hashes."""
+    return bin(a ^ b).count('1')
+
+
+def _flatten(img):
+    """Convert to RGB, compositing transparent drawings onto white rather than black."""
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A'))
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def _encode_within_budget(img, image_format, byte_budget):
+    """Encode at decreasing quality until under budget. Returns (bytes, quality)."""
+    data = b''
+    quality = None
+    for quality in QUALITY_STEPS:
+        buffer = io.BytesIO()
+        if image_format == 'PNG':
+            img.save(buffer, format='PNG', optimize=True)
+            return buffer.getvalue(), None
+        img.save(buffer, format=image_format, quality=quality, optimize=True)
+        data = buffer.getvalue()
+        if len(data) <= byte_budget:
+            break
+    return data, quality
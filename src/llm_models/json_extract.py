@@ -0,0 +1,310 @@
+import json
+import re
+from json.decoder import scanstring
+
+# Opening quote -> closing quote; models sometimes emit curly quotes
+QUOTES = {'"': '"', "'": "'", '“': '”'}
+LITERALS = {
+    'true': True, 'false': False, 'null': None,
+    'True': True, 'False': False, 'None': None, 'undefined': None,
+}
+ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+_decoder = json.JSONDecoder()
+_SKIP = re.compile(r'(?:\s+|//[^\n]*|/\*.*?(?:\*/|$))*', re.DOTALL)
+_NUMBER = re.compile(r'-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?(?![\w.])')
+_WORD = re.compile(r'[A-Za-z_$][\w$-]*')
+_BARE_VALUE = re.compile(r'[^,}\]\n]*')
+_STRING_CHUNKS = {closing: re.compile(f'[^{re.escape(closing)}\\\\]*') for closing in QUOTES.values()}
+
+
+def extract_json_object(text):
+    """
+    The first JSON object in a model's reply, repaired if need be.
+
+    Starts at the first ``{`` (inside a ```json fence if there is one) and
+    tries the C decoder, which also ignores any prose after the object.
+    Only if that fails does a tolerant parser go over the object once,
+    accepting what models get wrong: missing or trailing commas, unquoted
+    or single-quoted keys, stray quotes inside strings, comments, Python
+    literals and output cut off mid-object (open strings and containers
+    are closed).
+
+    Returns (obj, repaired). Raises ValueError if there is no object.
+    """
+    fence = text.find('```json')
+    start = text.find('{', fence if fence != -1 else 0)
+    unquoted = None
+    while start != -1:
+        try:
+            return _decoder.raw_decode(text, start)[0], False
+        except json.JSONDecodeError:
+            pass
+        parser = _TolerantParser(text, start)
+        try:
+            obj = parser.parse_object()
+        except RecursionError:
+            obj = None
+        if obj and parser.quoted:
+            return obj, True
+        # Without a single quoted string it's more likely a brace in the prose before the object
+        unquoted = unquoted or obj
+        start = text.find('{', start + 1)
+    if unquoted:
+        return unquoted, True
+    raise ValueError("No JSON object found in model output")
+
+
+class _TolerantParser:
+    """Recursive-descent parser over text[pos:] that repairs as it goes instead of raising."""
+    def __init__(self, text, pos):
+        self.text = text
+        self.pos = pos
+        self.end = len(text)
+        self.quoted = 0
+
+    def parse_object(self):
+        self.pos += 1  # '{'
+        obj = {}
+        while True:
+            self._skip()
+            if self.pos >= self.end:
+                return obj  # Cut off; close it
+            char = self.text[self.pos]
+            if char == '}':
+                self.pos += 1
+                return obj
+            if char == ']':
+                return obj  # Missing '}'; leave the ']' to the enclosing array
+            if char == ',':
+                self.pos += 1
+                continue
+            key = self._key()
+            if key is None:
+                self.pos += 1  # Not a key; drop the character
+                continue
+            self._skip()
+            if self.pos < self.end and self.text[self.pos] in ':=':
+                self.pos += 1
+                self._skip()
+            if self.pos >= self.end or self.text[self.pos] in ',}]':
+                obj[key] = None
+            else:
+                obj[key] = self._value()
+
+    def parse_array(self):
+        self.pos += 1  # '['
+        items = []
+        while True:
+            self._skip()
+            if self.pos >= self.end:
+                return items
+            char = self.text[self.pos]
+            if char == ']':
+                self.pos += 1
+                return items
+            if char == '}':
+                return items  # Missing ']'
+            if char == ',':
+                self.pos += 1
+                continue
+            items.append(self._value())
+
+    def _value(self):
+        char = self.text[self.pos]
+        if char in '{[':
+            # Most of a broken reply is usually fine; let the C decoder take intact containers whole
+            try:
+                value, self.pos = _decoder.raw_decode(self.text, self.pos)
+                self.quoted += 1
+                return value
+            except json.JSONDecodeError:
+                pass
+            return self.parse_object() if char == '{' else self.parse_array()
+        if char in QUOTES:
+            return self._string()
+        match = _NUMBER.match(self.text, self.pos)
+        if match:
+            self.pos = match.end()
+            number = match.group()
+            return float(number) if '.' in number or 'e' in number or 'E' in number else int(number)
+        match = _WORD.match(self.text, self.pos)
+        if match and match.group() in LITERALS:
+            self.pos = match.end()
+            return LITERALS[match.group()]
+        # Unquoted text: take it up to the next delimiter
+        match = _BARE_VALUE.match(self.text, self.pos)
+        self.pos = max(match.end(), self.pos + 1)
+        return self.text[match.start():self.pos].strip()
+
+    def _key(self):
+        char = self.text[self.pos]
+        if char in QUOTES:
+            return self._string()
+        match = _WORD.match(self.text, self.pos)
+        if match:
+            self.pos = match.end()
+            return match.group()
+        return None
+
+    def _string(self):
+        text = self.text
+        closing = QUOTES[text[self.pos]]
+        self.pos += 1
+        self.quoted += 1
+        if closing == '"':
+            try:
+                value, end = scanstring(text, self.pos, False)
+            except json.JSONDecodeError:
+                pass
+            else:
+                start, self.pos = self.pos, end
+                if self._ends_string():
+                    return value
+                self.pos = start
+        chunk = _STRING_CHUNKS[closing]
+        parts = []
+        while True:
+            match = chunk.match(text, self.pos)
+            parts.append(match.group())
+            self.pos = match.end()
+            if self.pos >= self.end:
+                break  # Unterminated
+            if text[self.pos] == '\\':
+                parts.append(self._escape())
+                continue
+            self.pos += 1
+            if self._ends_string():
+                break
+            parts.append(closing)  # A quote inside the text, not the end of the string
+        return ''.join(parts)
+
+    def _ends_string(self):
+        # A real closing quote is followed by a delimiter, a line break or the end
+        after = _SKIP.match(self.text, self.pos).end()
+        if after >= self.end or self.text[after] in ',:}]':
+            return True
+        return after > self.pos and ('\n' in self.text[self.pos:after] or self.text[after] in QUOTES)
+
+    def _escape(self):
+        text = self.text
+        char = text[self.pos + 1:self.pos + 2]
+        self.pos += 2
+        if char == 'u':
+            code = text[self.pos:self.pos + 4]
+            if len(code) < 4:
+                self.pos = self.end  # Cut off mid-escape; drop it
+                return ''
+            try:
+                value = int(code, 16)
+            except ValueError:
+                return 'u'
+            self.pos += 4
+            # Join a UTF-16 surrogate pair
+            if 0xD800 <= value < 0xDC00 and text.startswith('\\u', self.pos):
+                try:
+                    low = int(text[self.pos + 2:self.pos + 6], 16)
+                except ValueError:
+                    low = 0
+                if 0xDC00 <= low < 0xE000:
+                    self.pos += 6
+                    value = 0x10000 + ((value - 0xD800) << 10) + (low - 0xDC00)
+            return chr(value)
+        return ESCAPES.get(char, char)
+
+    def _skip(self):
+        if self.pos < self.end and self.text[self.pos] in ' \t\r\n/':
+            self.pos = _SKIP.match(self.text, self.pos).end()
+
+
+class StringValueStream:
+    """
+    Follows a model's JSON reply as it streams in and reports each string
+    value the moment its closing quote arrives, with its path: a tuple of
+    keys and array positions, e.g. ('story_elements', 'characters', 0).
+
+    Text before the first ``{`` (a fence, a preamble) is skipped and the
+    stream stops at the brace that closes the object. It only tracks
+    structure and double-quoted strings, which is all progressive display
+    needs; the finished text still goes through extract_json_object.
+    """
+    _STRING_END = re.compile(r'["\\]')
+
+    def __init__(self):
+        self._started = False
+        self.done = False
+        self._stack = []  # [key or next index, is_array] per open container
+        self._expect_key = False
+        self._in_string = False
+        self._escaped = False
+        self._raw = []
+
+    def feed(self, text):
+        """Consume the next chunk of the reply. Returns [(path, value)] for strings it completed."""
+        found = []
+        pos = 0
+        end = len(text)
+        if not self._started:
+            pos = text.find('{')
+            if pos == -1:
+                return found
+            self._started = True
+        while pos < end and not self.done:
+            if self._in_string:
+                pos = self._read_string(text, pos, found)
+                continue
+            char = text[pos]
+            pos += 1
+            if char == '"':
+                self._in_string = True
+                self._raw = []
+            elif char == '{':
+                self._stack.append([None, False])
+                self._expect_key = True
+            elif char == '[':
+                self._stack.append([0, True])
+                self._expect_key = False
+            elif char in '}]':
+                if self._stack:
+                    self._stack.pop()
+                if not self._stack:
+                    self.done = True
+            elif char == ':':
+                self._expect_key = False
+            elif char == ',':
+                # Counting commas keeps array positions right past numbers and literals, which aren't tracked
+                if self._stack and self._stack[-1][1]:
+                    self._stack[-1][0] += 1
+                self._expect_key = bool(self._stack) and not self._stack[-1][1]
+        return found
+
+    def _read_string(self, text, pos, found):
+        if self._escaped:
+            self._raw.append(text[pos])
+            self._escaped = False
+            return pos + 1
+        match = self._STRING_END.search(text, pos)
+        if match is None:
+            self._raw.append(text[pos:])
+            return len(text)
+        self._raw.append(text[pos:match.start()])
+        if match.group() == '\\':
+            self._raw.append('\\')
+            self._escaped = True
+            return match.end()
+
+        self._in_string = False
+        raw = ''.join(self._raw)
+        try:
+            value = scanstring(raw + '"', 0, False)[0]
+        except json.JSONDecodeError:
+            value = raw
+        top = self._stack[-1] if self._stack else None
+        if top is not None and not top[1] and self._expect_key:
+            top[0] = value
+        elif top is not None:
+            found.append((self._path(), value))
+        return match.end()
+
+    def _path(self):
+        return tuple(frame[0] for frame in self._stack)
@@ -1,18 +1,77 @@
-from src.app.utils.limiter import limiter
+from src.app.utils.http_client import iter_completion_text, upstream, PERPLEXITY
+from src.app.utils.metrics import observe_stage, stage_timer
+from src.app.utils.logs import PAYLOAD, PROMPT, Lazy
+from src.app.utils.token_budget import story_token_budget
 from flask import current_app
+import httpx
 import requests
 import json
 import random
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 import time
-import logging
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
-requests_log = logging.getLogger("urllib3")
-requests_log.setLevel(logging.DEBUG)
-requests_log.propagate = True
+# Age-specific story lengths in words; story_token_budget turns them into max_tokens
+TARGET_WORDS = {
+    'baby': {
+        'normal': 100,
+        'short': 50
+    },
+    'preK': {
+        'normal': 500,
+        'short': 400
+    },
+    'growing': {
+        'normal': 1500,
+        'short': 800
+    }
+}
+
+# Story templates with matching criteria
+STORY_TEMPLATES = [
+    {"name": "The Magic Surprise", "description": "A magical object changes something in an unexpected way.", "matches": ["magic"]},
+    {"name": "The Silly Problem", "description": "A funny obstacle makes things harder before it gets solved.", "matches": []},
+    {"name": "The Big Mix-Up", "description": "A misunderstanding leads to a humorous situation.", "matches": ["moral"]},
+    {"name": "The Opposite Day", "description": "Everything works backward, causing funny chaos.", "matches": ["magic", "vibe"]},
+    {"name": "The Wacky Rule", "description": "A strange rule must be followed, but why?", "matches": ["vibe"]},
+    {"name": "The Friendly Trick", "description": "A trick backfires or surprises the character.", "matches": []},
+    {"name": "The Helping Hand", "description": "A character helps someone and learns something important.", "matches": ["moral", "creature"]},
+    {"name": "The Countdown Race", "description": "Something must be done before time runs out.", "matches": ["vibe"]},
+    {"name": "The Swap Story", "description": "The character swaps places with another in a funny or magical way.", "matches": ["magic", "creature"]},
+    {"name": "The Mysterious Object", "description": "A strange object leads to an unexpected discovery.", "matches": ["magic"]},
+    {"name": "Oops, That Worked?", "description": "A mistake turns out to be the perfect solution.", "matches": ["moral"]},
+    {"name": "The Backfired Plan", "description": "The character tries something clever, but it backfires hilariously.", "matches": ["moral"]},
+    {"name": "The Wrong Assumption", "description": "The character believes something false, leading to a funny or surprising realization.", "matches": ["magic", "creature"]}
+]
+
+def best_story_templates(data):
+    """Return the templates that best match the request's optional fields, and their score."""
+    scores = {template["name"]: 0 for template in STORY_TEMPLATES}
+
+    # Score each template based on matching inputs
+    for template in STORY_TEMPLATES:
+        for key in ["moral", "magic", "creature", "vibe"]:
+            if data.get(key) and key in template["matches"]:
+                scores[template["name"]] += 1
+
+    max_score = max(scores.values())
+    return [template for template in STORY_TEMPLATES if scores[template["name"]] == max_score], max_score
+
+def find_story_template(name):
+    """Look up a story template by name, or None."""
+    for template in STORY_TEMPLATES:
+        if template["name"] == name:
+            return template
+    return None
+
+def pick_story_template(data, seed):
+    """
+    Pick one of the best-matching templates, deterministically for a given seed.
+    
+    Seeding with the request's cache key keeps the template choice stable for
+    identical requests, so the choice can be part of the key without lowering
+    the hit rate.
+    """
+    best_templates, _ = best_story_templates(data)
+    return random.Random(seed).choice(best_templates)
 
 class StoryGenerator:
     """
@@ -21,82 +80,39 @@ class StoryGenerator:
     """
     def __init__(self):
         self.model = "sonar"
-        self.api_url = "https://api.perplexity.ai/chat/completions"
+        self.api_url = f"{current_app.config.get('PERPLEXITY_BASE_URL', 'https://api.perplexity.ai')}/chat/completions"
         
-        # Age-specific token limits
-        self.token_limits = {
-            'baby': {
-                'normal': 130,   # ~100 words
-                'short': 65      # ~50 words
-            },
-            'preK': {
-                'normal': 650,   # ~500 words
-                'short': 520     # ~400 words
-            },
-            'growing': {
-                'normal': 1950,  # ~1500 words
-                'short': 1040    # ~800 words
-            }
-        }
+        # Shared, read-only tables; built once at import
+        self.target_words = TARGET_WORDS
+        self.story_templates = STORY_TEMPLATES
         
         if not current_app.config['PERPLEXITY_API_KEY']:
             raise ValueError("Perplexity API key not found in environment variables")
         
-        # Story templates with matching criteria
-        self.story_templates = [
-            {"name": "The Magic Surprise", "description": "A magical object changes something in an unexpected way.", "matches": ["magic"]},
-            {"name": "The Silly Problem", "description": "A funny obstacle makes things harder before it gets solved.", "matches": []},
-            {"name": "The Big Mix-Up", "description": "A misunderstanding leads to a humorous situation.", "matches": ["moral"]},
-            {"name": "The Opposite Day", "description": "Everything works backward, causing funny chaos.", "matches": ["magic", "vibe"]},
-            {"name": "The Wacky Rule", "description": "A strange rule must be followed, but why?", "matches": ["vibe"]},
-            {"name": "The Friendly Trick", "description": "A trick backfires or surprises the character.", "matches": []},
-            {"name": "The Helping Hand", "description": "A character helps someone and learns something important.", "matches": ["moral", "creature"]},
-            {"name": "The Countdown Race", "description": "Something must be done before time runs out.", "matches": ["vibe"]},
-            {"name": "The Swap Story", "description": "The character swaps places with another in a funny or magical way.", "matches": ["magic", "creature"]},
-            {"name": "The Mysterious Object", "description": "A strange object leads to an unexpected discovery.", "matches": ["magic"]},
-            {"name": "Oops, That Worked?", "description": "A mistake turns out to be the perfect solution.", "matches": ["moral"]},
-            {"name": "The Backfired Plan", "description": "The character tries something clever, but it backfires hilariously.", "matches": ["moral"]},
-            {"name": "The Wrong Assumption", "description": "The character believes something false, leading to a funny or surprising realization.", "matches": ["magic", "creature"]}
-        ]
-        
-        # Configure session for better performance
-        self.session = requests.Session()
-        adapter = HTTPAdapter(
-            pool_connections=20,
-            pool_maxsize=20,
-            max_retries=Retry(
-                total=3,
-                backoff_factor=1,
-                status_forcelist=[408, 429, 500, 502, 503, 504],
-                allowed_methods=None,  # Allow retries on all methods
-            )
+        # Pooled keep-alive session shared by every request in this process
+        self.session = upstream.session(PERPLEXITY)
+    
+    def calculate_max_tokens(self, prompt: str, age_group: str = 'preK', constrain_length: bool = False) -> int:
+        """Calculate max tokens from the age group's story length and observed token usage"""
+        key = self._budget_key(age_group, constrain_length)
+        words = self.target_words[key[0]][key[1]]
+        return story_token_budget.max_tokens(key, words, len(prompt.split()))
+    
+    def record_usage(self, data, payload, usage, finish_reason, story):
+        """Feed a finished completion's token usage back into the budget for its age group."""
+        prompt_words = sum(len(message["content"].split()) for message in payload["messages"])
+        story_token_budget.record(
+            self._budget_key(data.get('ageGroup', 'preK')), usage, finish_reason, story, prompt_words
         )
-        self.session.mount("https://", adapter)
-        self.session.headers.update({
-            "Authorization": f"Bearer {current_app.config['PERPLEXITY_API_KEY']}",
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-            "Connection": "keep-alive",
-            "Keep-Alive": "timeout=60, max=1000"
-        })
+        if finish_reason == 'length':
+            current_app.logger.warning(f"Story cut off at max_tokens={payload.get('max_tokens')}")
     
-    def calculate_max_tokens(self, prompt: str, age_group: str = 'growing', constrain_length: bool = False) -> int:
-        """Calculate max tokens based on prompt length"""
-        # Estimate prompt tokens (rough estimation)
-        estimated_prompt_tokens = len(prompt.split()) * 1.3
-        
-        # Get age-appropriate token limit
-        limits = self.token_limits.get(age_group, self.token_limits['growing'])
-        base_limit = limits['short'] if constrain_length else limits['normal']
-        
-        # Calculate remaining tokens for response
-        available_tokens = 2000 - estimated_prompt_tokens
-        
-        # Ensure we have enough tokens for a complete story
-        max_response_tokens = min(available_tokens, base_limit)
-        return int(max_response_tokens)
+    def _budget_key(self, age_group, constrain_length=False):
+        # Same fallback as the prompt's length guidance
+        if age_group not in self.target_words:
+            age_group = 'preK'
+        return age_group, 'short' if constrain_length else 'normal'
     
-    @limiter.limit("5 per minute")  # Keep rate limiting for API protection
     def generate_story(self, data):
         """
         Generate a story based on the provided data.
@@ -118,71 +134,28 @@ class StoryGenerator:
             if not data.get('mainPrompt'):
                 raise ValueError("Main prompt is required")
             
-            # Log the flow type
-            current_app.logger.debug(f"Story generation flow: {'Artwork' if data.get('isArtworkFlow') else 'Direct'}")
-            
-            # Format the prompt based on flow
-            if data.get('isArtworkFlow'):
-                # For artwork flow, mainPrompt is already formatted as "A story about X in Y who Z"
-                prompt = self._format_prompt(data, use_template=True)
-            else:
-                # For direct text input flow, use the original prompt formatting
-                prompt = self._format_prompt(data, use_template=False)
-            
-            current_app.logger.info(f"Final prompt:\n{prompt}")
-            current_app.logger.debug(f"Using template: {data.get('isArtworkFlow', False)}")
-            
-            payload = {
-                "model": self.model,
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "You are a creative children's story writer. Create engaging, age-appropriate stories that are imaginative and educational."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                "temperature": 0.7,     # Balanced creativity
-                "frequency_penalty": 1,  # Standard repetition control
-                "max_tokens": self.calculate_max_tokens(prompt, data.get('ageGroup', 'preK')),
-            }
+            payload = self._build_payload(data)
             
             current_app.logger.info("Starting API request...")
             
-            response = self.session.post(
-                self.api_url,
-                json=payload,
-                timeout=(5, 60),  # (connect timeout, read timeout)
-                stream=False
-            )
-            
-            current_app.logger.debug(f"API Response status: {response.status_code}")
-            current_app.logger.debug(f"API Response: {response.text[:500]}...")
-            
-            # Check response immediately
-            if not response.ok:
-                current_app.logger.error(f"API error {response.status_code}: {response.text}")
-                if response.status_code == 429:
-                    raise Exception("We're generating too many stories too quickly. Please wait a moment.")
-                elif response.status_code == 401:
-                    raise Exception("Story service authentication failed. Please try again later.")
-                else:
-                    raise Exception("Story generation encountered an error. Please try again.")
-            
-            try:
-                response_data = response.json()
-            except json.JSONDecodeError:
-                current_app.logger.error(f"Invalid JSON response: {response.text}")
-                raise Exception("Received invalid response from story service")
-            
-            if "choices" not in response_data or not response_data["choices"]:
-                raise Exception("No story generated")
-            
-            story = response_data["choices"][0]["message"]["content"].strip()
+            with upstream.guard(PERPLEXITY).call():
+                with stage_timer('upstream_total'):
+                    # Retries and timeouts stay within the request deadline
+                    response = upstream.send(PERPLEXITY, lambda timeout: self.session.post(
+                        self.api_url,
+                        json=payload,
+                        timeout=(min(5, timeout), timeout),  # (connect timeout, read timeout)
+                        stream=False
+                    ), read_timeout=60)
+                
+                current_app.logger.debug("API Response status: %s", response.status_code)
+                current_app.logger.debug("API Response: %.500s...", Lazy(getattr, response, 'text'), extra=PAYLOAD)
+                
+                # Check response immediately
+                self._check_response(response)
             
-            current_app.logger.debug(f"Generated story length: {len(story)}")
+            story, usage, finish_reason = self._parse_completion(response)
+            self.record_usage(data, payload, usage, finish_reason, story)
             
             return story
 
@@ -200,26 +173,181 @@ class StoryGenerator:
             current_app.logger.error(f"Story generation failed: {str(e)}")
             raise
 
+    async def agenerate_story(self, data):
+        """
+        Async variant of generate_story for the ASGI serving path.
+        
+        Uses the shared httpx client so the event loop is free while the
+        upstream is writing. Cancelling the awaiting task aborts the request.
+        """
+        try:
+            start_time = time.time()
+            
+            if not data.get('mainPrompt'):
+                raise ValueError("Main prompt is required")
+            
+            payload = self._build_payload(data)
+            
+            current_app.logger.info("Starting async API request...")
+            
+            client = upstream.async_client(PERPLEXITY)
+            async with upstream.guard(PERPLEXITY).acall():
+                with stage_timer('upstream_total'):
+                    response = await upstream.asend(PERPLEXITY, lambda timeout: client.post(
+                        self.api_url, json=payload, timeout=httpx.Timeout(timeout, connect=min(5, timeout))
+                    ), read_timeout=60)
+                
+                current_app.logger.debug("API Response status: %s", response.status_code)
+                self._check_response(response)
+            
+            story, usage, finish_reason = self._parse_completion(response)
+            self.record_usage(data, payload, usage, finish_reason, story)
+            return story
+
+        except httpx.TimeoutException:
+            current_app.logger.error(f"Async request timed out after {time.time() - start_time:.2f} seconds")
+            raise Exception(
+                "The story is taking longer than usual to generate. "
+                "This might be because we're making it extra special! "
+                "Please try again in a moment."
+            )
+        except httpx.TransportError:
+            current_app.logger.error("Connection error occurred.")
+            raise Exception("Could not connect to story generation service. Please try again.")
+
+    def stream_story(self, data):
+        """
+        Generate a story and yield the text as it arrives from the API.
+        
+        Takes the same data as generate_story. Yields text deltas; joining
+        them gives the complete story.
+        """
+        try:
+            start_time = time.time()
+            
+            if not data.get('mainPrompt'):
+                raise ValueError("Main prompt is required")
+            
+            payload = self._build_payload(data)
+            payload["stream"] = True
+            
+            current_app.logger.info("Starting streaming API request...")
+            
+            # Held for the whole stream: a slow stream occupies a bulkhead slot
+            with upstream.guard(PERPLEXITY).call():
+                # Retried only until the stream starts; the read timeout applies between chunks
+                response = upstream.send(PERPLEXITY, lambda timeout: self.session.post(
+                    self.api_url,
+                    json=payload,
+                    timeout=(min(5, timeout), timeout),
+                    stream=True,
+                    headers={"Accept": "text/event-stream"}
+                ), read_timeout=60)
+            
+                with response:
+                    current_app.logger.debug("API Response status: %s", response.status_code)
+                    self._check_response(response)
+                
+                    first_chunk = True
+                    summary = {}
+                    parts = []
+                    for text in iter_completion_text(response, summary):
+                        if first_chunk:
+                            current_app.logger.info("First story tokens after %.2f seconds", time.time() - start_time)
+                            first_chunk = False
+                        parts.append(text)
+                        yield text
+            observe_stage('upstream_total', time.time() - start_time)
+            self.record_usage(data, payload, summary.get('usage'), summary.get('finish_reason'), ''.join(parts))
+
+        except requests.Timeout:
+            current_app.logger.error(f"Streaming request timed out after {time.time() - start_time:.2f} seconds")
+            raise Exception(
+                "The story is taking longer than usual to generate. "
+                "Please try again in a moment."
+            )
+        except requests.ConnectionError:
+            current_app.logger.error("Connection error occurred while streaming.")
+            raise Exception("Could not connect to story generation service. Please try again.")
+
+    def _build_payload(self, data):
+        """Build the chat-completions payload for a story request."""
+        # Log the flow type
+        current_app.logger.debug("Story generation flow: %s", 'Artwork' if data.get('isArtworkFlow') else 'Direct')
+        
+        # Format the prompt based on flow
+        with stage_timer('prompt_build'):
+            if data.get('isArtworkFlow'):
+                # For artwork flow, mainPrompt is already formatted as "A story about X in Y who Z"
+                prompt = self._format_prompt(data, use_template=True)
+            else:
+                # For direct text input flow, use the original prompt formatting
+                prompt = self._format_prompt(data, use_template=False)
+        
+        current_app.logger.debug("Final prompt:\n%s", prompt, extra=PROMPT)
+        current_app.logger.debug("Using template: %s", data.get('isArtworkFlow', False))
+        
+        return {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "You are a creative children's story writer. Create engaging, age-appropriate stories that are imaginative and educational."
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "temperature": 0.7,     # Balanced creativity
+            "frequency_penalty": 1,  # Standard repetition control
+            "max_tokens": self.calculate_max_tokens(prompt, data.get('ageGroup', 'preK')),
+        }
+
+    def _check_response(self, response):
+        """Raise a user-facing error if the API returned a failure status."""
+        if response.status_code < 400:
+            return
+        current_app.logger.error(f"API error {response.status_code}: {response.text}")
+        if response.status_code == 429:
+            raise Exception("We're generating too many stories too quickly. Please wait a moment.")
+        elif response.status_code == 401:
+            raise Exception("Story service authentication failed. Please try again later.")
+        else:
+            raise Exception("Story generation encountered an error. Please try again.")
+
+    def _parse_completion(self, response):
+        """Extract (story, usage, finish_reason) from a chat-completions response."""
+        try:
+            with stage_timer('json_parse'):
+                response_data = response.json()
+        except json.JSONDecodeError:
+            current_app.logger.error(f"Invalid JSON response: {response.text}")
+            raise Exception("Received invalid response from story service")
+        
+        if "choices" not in response_data or not response_data["choices"]:
+            raise Exception("No story generated")
+        
+        choice = response_data["choices"][0]
+        story = choice["message"]["content"].strip()
+        
+        current_app.logger.debug("Generated story length: %d", len(story))
+        
+        return story, response_data.get("usage"), choice.get("finish_reason")
+
     def _choose_story_template(self, data):
         """Choose the most relevant story template based on user inputs."""
-        scores = {template["name"]: 0 for template in self.story_templates}
-
-        # Score each template based on matching inputs
-        for template in self.story_templates:
-            for key in ["moral", "magic", "creature", "vibe"]:
-                if data.get(key) and key in template["matches"]:
-                    scores[template["name"]] += 1
+        # Honour a template already pinned to the request (it is part of the cache key)
+        pinned = find_story_template(data.get('template'))
+        if pinned:
+            current_app.logger.info("Using pinned template: %s", pinned['name'])
+            return pinned
 
-        # Get the highest scoring templates
-        max_score = max(scores.values())
-        best_templates = [
-            template for template in self.story_templates 
-            if scores[template["name"]] == max_score
-        ]
+        best_templates, max_score = best_story_templates(data)
 
         # Pick a random template from the best matches
         chosen_template = random.choice(best_templates)
-        current_app.logger.info(f"Selected template: {chosen_template['name']} (Score: {max_score})")
+        current_app.logger.info("Selected template: %s (Score: %s)", chosen_template['name'], max_score)
         return chosen_template
 
     def _format_prompt(self, data, use_template=False):
@@ -232,15 +360,19 @@ class StoryGenerator:
         
         # Age-appropriate guidelines
         age_guides = {
-            'baby': "Use very simple words and lots of repetition. Keep it under 200 words",
-            'preK': "Use simple words and short sentences. Include some repetition. Keep it under 600 words",
-            'growing': "Use varied vocabulary and longer sentences. Add some challenging words. Keep it under 1500 words"
+            'baby': "Use very simple words and lots of repetition",
+            'preK': "Use simple words and short sentences. Include some repetition",
+            'growing': "Use varied vocabulary and longer sentences. Add some challenging words"
         }
+        if age_group not in age_guides:
+            age_group = 'preK'
         
         # Simplified prompt structure
         prompt_parts = [
             f"Write a children's story about {data['mainPrompt']}",
-            age_guides.get(age_group, age_guides['preK']),  # Add age-appropriate guidance
+            age_guides[age_group],  # Add age-appropriate guidance
+            # The same length max_tokens is budgeted for
+            f"Keep it under {self.target_words[age_group]['normal']} words",
             "Write as continuous text without chapters",
         ]
         
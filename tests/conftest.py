@@ -0,0 +1,25 @@
+import pytest
+
+from config.settings import Config
+from src.app import create_app
+from src.app.utils.library import story_library
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """An app whose databases and caches live in tmp_path."""
+    # Upstream calls are stubbed in the tests, but the clients still refuse to build a request without a key
+    monkeypatch.setenv('OPENROUTER_API_KEY', 'test')
+    monkeypatch.setenv('PERPLEXITY_API_KEY', 'test')
+    class TestConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "storytales.db"}'
+        RATELIMIT_STORAGE_URI = f'sqlite:///{tmp_path / "ratelimit.sqlite3"}'
+        CACHE_DISK_PATH = str(tmp_path / 'story_cache.sqlite3')
+        ARTWORK_CACHE_DISK_PATH = str(tmp_path / 'artwork_cache.sqlite3')
+        STORY_FALLBACK_PATH = str(tmp_path / 'fallback_stories.sqlite3')
+        STORY_JOBS_PATH = str(tmp_path / 'story_jobs.sqlite3')
+        STORY_WARMER_BUDGET = 0
+
+    yield create_app(TestConfig)
+    # The library's writer thread serves whichever app is current; don't leave it this one's stories
+    story_library.flush()
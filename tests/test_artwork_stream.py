@@ -0,0 +1,141 @@
+import io
+import json
+import time
+
+import pytest
+import requests
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+from src.app.utils.cache import artwork_cache
+from src.app.utils.hedging import artwork_stream_hedger
+from src.app.utils.http_client import upstream
+from src.llm_models.artwork_analyzer import ArtworkAnalyzer
+
+ANALYSIS = json.dumps({
+    'comments': ['I love the bright colors you used!', 'Your lines are so bold and confident!'],
+    'questions': ['Who lives in this picture?', 'What happens next?'],
+    'story_elements': {'characters': ['a little dragon'], 'setting': ['a tall hill'], 'moral': 'Be kind'},
+})
+# Inside the last value: every required key has arrived, so the partial reply parses
+CUT = ANALYSIS.index('Be kind') + 3
+
+
+class StreamedReply:
+    """A streamed chat completion of text in small chunks, optionally slow to start or cut off part way."""
+    def __init__(self, text, cut_at=None, finish_reason='stop', first_token_delay=0):
+        self.text = text
+        self.cut_at = cut_at
+        self.finish_reason = finish_reason
+        self.first_token_delay = first_token_delay
+        self.status_code = 200
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.closed = True
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self, decode_unicode=False):
+        time.sleep(self.first_token_delay)
+        end = len(self.text) if self.cut_at is None else self.cut_at
+        for start in range(0, end, 20):
+            chunk = self.text[start:min(start + 20, end)]
+            yield 'data: ' + json.dumps({'choices': [{'delta': {'content': chunk}}]})
+        if self.cut_at is not None:
+            raise requests.exceptions.ChunkedEncodingError('Connection broken')
+        yield 'data: ' + json.dumps({'choices': [{'delta': {}, 'finish_reason': self.finish_reason}]})
+        yield 'data: [DONE]'
+
+
+def upload():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), 'orange').save(buffer, 'PNG')
+    buffer.seek(0)
+    return FileStorage(buffer, filename='drawing.png', content_type='image/png')
+
+
+def run_stream(app, monkeypatch, reply):
+    monkeypatch.setattr(upstream, 'send', lambda *args, **kwargs: reply)
+    with app.test_request_context():
+        analyzer = ArtworkAnalyzer()
+        image = upload()
+        cache_key = analyzer.request_key(image, '')
+        events = list(analyzer.stream_analysis(image, '', cache_key))
+        return events[-1][1], artwork_cache.get(cache_key)
+
+
+def test_finished_stream_is_cached(app, monkeypatch):
+    result, cached = run_stream(app, monkeypatch, StreamedReply(ANALYSIS))
+    assert result['analysis']['comments'] == json.loads(ANALYSIS)['comments']
+    assert cached is not None
+
+
+@pytest.mark.parametrize('reply', [
+    StreamedReply(ANALYSIS, cut_at=CUT),
+    StreamedReply(ANALYSIS[:CUT], finish_reason='length'),
+])
+def test_cut_off_stream_is_returned_but_not_cached(app, monkeypatch, reply):
+    result, cached = run_stream(app, monkeypatch, reply)
+    assert result['analysis']['comments'] == json.loads(ANALYSIS)['comments']
+    assert cached is None
+
+
+class Models:
+    """Upstream stand-in answering each model's requests with its own reply, or failing them."""
+    def __init__(self, replies):
+        self.replies = replies
+        self.asked = []
+
+    def post(self, url, json=None, **kwargs):
+        model = json['model']
+        self.asked.append(model)
+        reply = self.replies[model]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+
+def run_models(app, monkeypatch, replies):
+    models = Models(replies)
+    app.config['ARTWORK_MODELS'] = list(replies)
+    monkeypatch.setattr(upstream, 'session', lambda name: models)
+    monkeypatch.setattr(upstream, 'send', lambda name, request, read_timeout=60: request(read_timeout))
+    # Hedge quickly, and on every request
+    monkeypatch.setattr(artwork_stream_hedger, 'default_delay', 0.05)
+    monkeypatch.setattr(artwork_stream_hedger, 'min_delay', 0.05)
+    monkeypatch.setattr(artwork_stream_hedger, 'max_rate', 1.0)
+    with app.test_request_context():
+        analyzer = ArtworkAnalyzer()
+        events = list(analyzer.stream_analysis(upload(), ''))
+    return events[-1][1], models
+
+
+def test_failed_stream_falls_back_to_the_next_model(app, monkeypatch):
+    result, models = run_models(app, monkeypatch, {
+        'primary': requests.exceptions.ConnectionError('refused'),
+        'fallback': StreamedReply(ANALYSIS),
+    })
+    assert result['analysis']['comments'] == json.loads(ANALYSIS)['comments']
+    assert models.asked == ['primary', 'fallback']
+
+
+def test_slow_to_start_stream_is_hedged_and_closed(app, monkeypatch):
+    slow = StreamedReply(ANALYSIS, first_token_delay=0.5)
+    result, models = run_models(app, monkeypatch, {
+        'primary': slow,
+        'hedge': StreamedReply(ANALYSIS),
+    })
+    assert result['analysis']['comments'] == json.loads(ANALYSIS)['comments']
+    assert models.asked == ['primary', 'hedge']
+    assert artwork_stream_hedger.stats()['won_hedge'] >= 1
+    # The primary's stream is closed as soon as its first text arrives
+    deadline = time.monotonic() + 2
+    while not slow.closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert slow.closed
@@ -0,0 +1,43 @@
+import asyncio
+
+import httpx
+import pytest
+
+from src.app.asgi import AsyncStoryApp
+
+# Differ between any two responses
+VOLATILE_HEADERS = {'date', 'content-security-policy'}
+
+
+def asgi_post(app, path, **kwargs):
+    async def post():
+        transport = httpx.ASGITransport(app=AsyncStoryApp(app))
+        async with httpx.AsyncClient(transport=transport, base_url='https://localhost') as client:
+            return await client.post(path, **kwargs)
+    return asyncio.run(post())
+
+
+@pytest.mark.parametrize('body', [{}, {'mainPrompt': ''}])
+def test_async_route_headers_match_wsgi(app, body):
+    wsgi = app.test_client().post('/story/generate', json=body, base_url='https://localhost')
+    asgi = asgi_post(app, '/story/generate', json=body)
+
+    assert asgi.status_code == wsgi.status_code
+    assert asgi.json() == wsgi.get_json()
+    wsgi_headers = {name.lower(): value for name, value in wsgi.headers.items()}
+    asgi_headers = {name.lower(): value for name, value in asgi.headers.items()}
+    assert asgi_headers.keys() == wsgi_headers.keys()
+    for name in wsgi_headers.keys() - VOLATILE_HEADERS:
+        assert asgi_headers[name] == wsgi_headers[name], name
+    # Same policy, fresh nonce
+    assert 'content-security-policy' in asgi_headers
+
+
+def test_async_route_redirects_plain_http(app):
+    async def post():
+        transport = httpx.ASGITransport(app=AsyncStoryApp(app))
+        async with httpx.AsyncClient(transport=transport, base_url='http://localhost') as client:
+            return await client.post('/story/generate', json={})
+    response = asyncio.run(post())
+    assert response.status_code in (301, 302)
+    assert response.headers['location'].startswith('https://')
@@ -0,0 +1,17 @@
+from src.app.utils.cache import cache_story, get_fallback_story
+
+
+def test_fallback_is_the_requested_or_a_similar_story(app):
+    with app.app_context():
+        cache_story({'mainPrompt': 'a brave dragon in a castle', 'ageGroup': 'preK'}, 'A dragon story.')
+
+        assert get_fallback_story({'mainPrompt': 'a brave dragon in a castle', 'ageGroup': 'preK'}) == 'A dragon story.'
+        assert get_fallback_story({'mainPrompt': 'brave dragon, castle', 'ageGroup': 'preK'}) == 'A dragon story.'
+
+
+def test_no_fallback_for_an_unrelated_request(app):
+    with app.app_context():
+        cache_story({'mainPrompt': 'a brave dragon in a castle', 'ageGroup': 'preK'}, 'A dragon story.')
+
+        assert get_fallback_story({'mainPrompt': 'a shy turtle at the beach', 'ageGroup': 'preK'}) is None
+        assert get_fallback_story({'mainPrompt': 'a brave dragon in a castle', 'ageGroup': 'baby'}) is None
@@ -0,0 +1,54 @@
+import asyncio
+import itertools
+import time
+
+from src.app.utils.hedging import Hedger
+
+MIN_DELAY = 0.01
+
+
+def hedger():
+    # Every request may hedge, and the delay is learned after a handful of calls
+    return Hedger('test', 'TEST', default_delay=0.05, min_delay=MIN_DELAY, max_rate=1.0, min_samples=6)
+
+
+def latency(model, calls):
+    # Half of the primary's calls are fast, half slow enough that the hedge wins
+    if model == 'primary':
+        return 0.002 if next(calls) % 2 else 0.2
+    return 0.02
+
+
+def test_slow_primary_keeps_its_hedge_delay():
+    hedging = hedger()
+    calls = itertools.count()
+
+    def call(model):
+        time.sleep(latency(model, calls))
+        return model
+
+    for _ in range(30):
+        hedging.run(['primary', 'hedge'], call, lambda result: True)
+    time.sleep(0.25)  # Let the last slow primaries finish and be timed
+
+    assert hedging.stats()['won_hedge'] > 0
+    assert hedging.delay('primary') >= 0.15
+
+
+def test_slow_primary_keeps_its_hedge_delay_async():
+    hedging = hedger()
+    calls = itertools.count()
+
+    async def call(model):
+        await asyncio.sleep(latency(model, calls))
+        return model
+
+    async def requests():
+        for _ in range(30):
+            await hedging.arun(['primary', 'hedge'], call, lambda result: True)
+
+    asyncio.run(requests())
+
+    # Cancelled primaries count with how long they had run: at least the delay plus the hedge's latency
+    assert hedging.stats()['won_hedge'] > 0
+    assert hedging.delay('primary') > 3 * MIN_DELAY
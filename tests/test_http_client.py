@@ -0,0 +1,47 @@
+import json
+
+from src.app.utils.http_client import iter_completion_text, upstream
+from src.app.utils.token_budget import story_token_budget
+from src.llm_models.story_generator import StoryGenerator
+
+USAGE = {'prompt_tokens': 80, 'completion_tokens': 12, 'total_tokens': 92}
+
+
+class StreamedStory:
+    """A streamed chat completion sending its usage the OpenAI way: in a chunk of its own after the finish."""
+    status_code = 200
+
+    def __init__(self, words):
+        self.words = words
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_lines(self, decode_unicode=False):
+        for word in self.words:
+            yield 'data: ' + json.dumps({'choices': [{'delta': {'content': word}}]})
+        yield 'data: ' + json.dumps({'choices': [{'delta': {}, 'finish_reason': 'stop'}]})
+        yield ''
+        yield 'data: ' + json.dumps({'choices': [], 'usage': USAGE})
+        yield 'data: [DONE]'
+
+
+def test_usage_after_the_finish_chunk_is_read():
+    summary = {}
+    text = ''.join(iter_completion_text(StreamedStory(['Once ', 'upon ', 'a time.']), summary))
+
+    assert text == 'Once upon a time.'
+    assert summary == {'finish_reason': 'stop', 'usage': USAGE, 'done': True}
+
+
+def test_streamed_story_feeds_the_token_budget(app, monkeypatch):
+    monkeypatch.setattr(upstream, 'send', lambda *args, **kwargs: StreamedStory(['Once ', 'upon ', 'a time.']))
+    with app.test_request_context():
+        before = story_token_budget.stats().get(('preK', 'normal'), {}).get('completed', 0)
+        story = ''.join(StoryGenerator().stream_story({'mainPrompt': 'a brave dragon', 'ageGroup': 'preK'}))
+
+    assert story == 'Once upon a time.'
+    assert story_token_budget.stats()[('preK', 'normal')]['completed'] == before + 1
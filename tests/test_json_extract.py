@@ -0,0 +1,88 @@
+import pytest
+
+from src.llm_models.json_extract import StringValueStream, extract_json_object
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('{"a": 1, "b": [1, 2,], }', {'a': 1, 'b': [1, 2]}),  # Trailing commas
+    ('{"a": 1 "b": 2}', {'a': 1, 'b': 2}),  # Missing comma between members
+    ('{"a": ["x" "y"]}', {'a': ['x', 'y']}),  # ...and between items
+    ("{'a': 'hello', 'b': ['x', 'y']}", {'a': 'hello', 'b': ['x', 'y']}),  # Single quotes
+    ('{“a”: “curly”, “b”: 2}', {'a': 'curly', 'b': 2}),  # Curly quotes
+    ('{a: 1, b_c: "x"}', {'a': 1, 'b_c': 'x'}),  # Unquoted keys
+    ('{"a": "she said "hi" to me", "b": 1}', {'a': 'she said "hi" to me', 'b': 1}),  # Stray inner quotes
+    ("{'a': 'it's fine', 'b': 1}", {'a': "it's fine", 'b': 1}),
+    ('{"a": 1, // note\n "b": /* inline */ 2}', {'a': 1, 'b': 2}),  # Comments
+    ('{"a": True, "b": None, "c": False, "d": undefined}', {'a': True, 'b': None, 'c': False, 'd': None}),
+    ('{"a": {"b": [1, 2, {"c": "cut', {'a': {'b': [1, 2, {'c': 'cut'}]}}),  # Truncated nesting
+    ('{"comments": ["one", "tw', {'comments': ['one', 'tw']}),
+    ('{"a": [1, 2}', {'a': [1, 2]}),  # Missing ']'
+    ('{"a": {"b": 1]}', {'a': {'b': 1}}),  # Missing '}'
+    ('{"a": "x\\u00', {'a': 'x'}),  # Cut off mid-escape
+])
+def test_repairs(text, expected):
+    assert extract_json_object(text) == (expected, True)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('{"a": 1}', {'a': 1}),
+    ('Here you go:\n```json\n{"a": [1, 2]}\n```\nEnjoy!', {'a': [1, 2]}),
+    ('Use {braces} like this. ```json\n{"a": 1}\n```', {'a': 1}),  # The fence wins over earlier braces
+    ('{"a": 1} trailing prose {"b": 2}', {'a': 1}),
+    ('{"a": "line\\nbreak \\u00e9 \\ud83d\\ude00 \\"q\\"", "n": -1.5e3}', {'a': 'line\nbreak é 😀 "q"', 'n': -1500.0}),
+])
+def test_valid_json_is_not_repaired(text, expected):
+    assert extract_json_object(text) == (expected, False)
+
+
+def test_brace_in_prose_before_the_object_is_skipped():
+    # "{bad thing}" parses tolerantly too, but has no quoted string, so the real object is preferred
+    text = 'A {bad thing} happened before: {"a": "x", "b": [1, 2,]}'
+    assert extract_json_object(text) == ({'a': 'x', 'b': [1, 2]}, True)
+
+
+def test_unquoted_object_is_used_when_nothing_better_follows():
+    assert extract_json_object('Prefix {not json} and nothing else') == ({'not': 'json'}, True)
+
+
+def test_no_object_raises():
+    with pytest.raises(ValueError):
+        extract_json_object('no object at all')
+
+
+def feed_by_character(text):
+    stream = StringValueStream()
+    found = []
+    for char in text:
+        found += stream.feed(char)
+    return found, stream.done
+
+
+def test_stream_reports_each_string_with_its_path():
+    text = (
+        'Sure!\n```json\n{"comments": ["a \\"quoted\\" word", "caf\\u00e9"], "questions": [], '
+        '"story_elements": {"characters": ["x", "y"], "setting": ["back\\\\slash"], "moral": "Be kind"}, '
+        '"n": [1, {"k": "deep"}]}\n``` {"after": "ignored"}'
+    )
+    found, done = feed_by_character(text)
+
+    assert found == [
+        (('comments', 0), 'a "quoted" word'),
+        (('comments', 1), 'café'),
+        (('story_elements', 'characters', 0), 'x'),
+        (('story_elements', 'characters', 1), 'y'),
+        (('story_elements', 'setting', 0), 'back\\slash'),
+        (('story_elements', 'moral'), 'Be kind'),
+        (('n', 1, 'k'), 'deep'),
+    ]
+    assert done
+
+
+def test_stream_matches_whole_chunks():
+    text = '{"a": ["x", "y\\n"], "b": {"c": "z"}}'
+    stream = StringValueStream()
+    assert stream.feed(text) == feed_by_character(text)[0]
+
+
+def test_stream_holds_back_an_open_string():
+    assert feed_by_character('{"a": ["done", "cut off') == ([(('a', 0), 'done')], False)
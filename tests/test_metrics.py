@@ -0,0 +1,32 @@
+import pytest
+
+TOKEN = 'scrape-me'
+
+
+def get_metrics(app, headers=None, base_url='https://localhost'):
+    return app.test_client().get('/metrics', headers=headers or {}, base_url=base_url)
+
+
+def test_metrics_are_hidden_without_a_token(app):
+    assert get_metrics(app).status_code == 404
+
+
+@pytest.mark.parametrize('authorization', [None, 'Bearer wrong', TOKEN])
+def test_metrics_need_the_bearer_token(app, authorization):
+    app.config['METRICS_TOKEN'] = TOKEN
+    response = get_metrics(app, {'Authorization': authorization} if authorization else None)
+    assert response.status_code == 401
+    assert response.headers['WWW-Authenticate'] == 'Bearer'
+
+
+def test_metrics_are_served_to_the_scraper(app):
+    app.config['METRICS_TOKEN'] = TOKEN
+    response = get_metrics(app, {'Authorization': f'Bearer {TOKEN}'})
+    assert response.status_code == 200
+    assert b'storytales_' in response.data
+
+
+def test_metrics_are_not_served_over_plain_http(app):
+    app.config['METRICS_TOKEN'] = TOKEN
+    response = get_metrics(app, {'Authorization': f'Bearer {TOKEN}'}, base_url='http://localhost')
+    assert response.status_code in (301, 302)
@@ -0,0 +1,35 @@
+from src.app.models import Story, db
+from src.app.utils.cache import cache_story, get_cached_story, get_story_id, story_fallbacks
+from src.app.utils.library import story_library
+from src.app.utils.similarity import story_index
+
+ASKED = {'mainPrompt': 'a brave dragon in a castle', 'ageGroup': 'preK'}
+SIMILAR = {'mainPrompt': 'brave dragon, castle', 'ageGroup': 'preK'}
+
+
+def test_similar_request_is_served_the_matched_story_under_its_id(app):
+    with app.app_context():
+        cache_story(dict(ASKED), 'Once upon a time, a dragon.')
+        asked_id = get_story_id(dict(ASKED))
+
+        for _ in range(2):  # Similarity match, then the cached match
+            data = dict(SIMILAR)
+            assert get_cached_story(data) == 'Once upon a time, a dragon.'
+            assert get_story_id(data) == asked_id
+
+
+def test_similar_match_is_not_stored_beyond_the_cache(app):
+    with app.app_context():
+        cache_story(dict(ASKED), 'Once upon a time, a dragon.')
+        get_cached_story(dict(SIMILAR))
+        story_library.flush()
+
+        assert len(story_index) == 1
+        assert story_fallbacks.stats()['size'] == 1
+        assert db.session.query(Story).count() == 1
+
+
+def test_other_age_group_is_not_matched(app):
+    with app.app_context():
+        cache_story(dict(ASKED), 'Once upon a time, a dragon.')
+        assert get_cached_story(dict(SIMILAR, ageGroup='baby')) is None
@@ -0,0 +1,27 @@
+import pytest
+
+from src.app.utils.cache import cache_story, get_story_id
+from src.llm_models.story_generator import StoryGenerator
+
+REQUEST = {'mainPrompt': 'a brave dragon in a castle', 'ageGroup': 'preK'}
+
+
+def run_job(app):
+    client = app.test_client()
+    job = client.post('/story/jobs', json=REQUEST, base_url='https://localhost').get_json()
+    return client.get(f"{job['status_url']}?wait=5", base_url='https://localhost').get_json()
+
+
+@pytest.mark.parametrize('cached', [False, True])
+def test_finished_job_carries_the_story_id(app, monkeypatch, cached):
+    monkeypatch.setattr(StoryGenerator, 'generate_story', lambda self, data: 'A new story.')
+    if cached:
+        with app.app_context():
+            cache_story(dict(REQUEST), 'A dragon story.')
+
+    job = run_job(app)
+
+    assert job['status'] == 'done'
+    assert job['cached'] is cached
+    with app.app_context():
+        assert job['id'] == get_story_id(dict(REQUEST))
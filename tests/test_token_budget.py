@@ -0,0 +1,38 @@
+import random
+
+import pytest
+
+from src.app.utils.token_budget import TokenBudget
+
+PROMPT_WORDS = 60
+
+
+def simulate(budget, key, target_words, requests=2000, tokens_per_word=1.45, length_share=1.1, seed=1):
+    """Share of stories cut off when natural lengths run past the target word count."""
+    rng = random.Random(seed)
+    truncated = 0
+    for _ in range(requests):
+        max_tokens = budget.max_tokens(key, target_words, PROMPT_WORDS)
+        words = max(20, int(rng.lognormvariate(0, 0.25) * length_share * target_words))
+        tokens = int(words * tokens_per_word)
+        finish_reason = 'stop'
+        if tokens > max_tokens:
+            tokens, finish_reason = max_tokens, 'length'
+            words = int(max_tokens / tokens_per_word)
+            truncated += 1
+        usage = {'completion_tokens': tokens, 'prompt_tokens': int(PROMPT_WORDS * tokens_per_word)}
+        budget.record(key, usage, finish_reason, ' '.join(['word'] * words), PROMPT_WORDS)
+    return truncated / requests
+
+
+@pytest.mark.parametrize('target_words', [100, 500])
+def test_cut_off_share_stays_near_truncation_rate(target_words):
+    # Stories run 10% past the target on average, so a budget pinned to the target cuts off most of them
+    budget = TokenBudget('test', 'TEST', truncation_rate=0.02)
+    assert simulate(budget, 'preK', target_words) <= 0.04
+
+
+def test_budget_stays_within_context():
+    budget = TokenBudget('test', 'TEST', context_tokens=2000, truncation_rate=0.02)
+    simulate(budget, 'growing', 1500, requests=500)
+    assert budget.max_tokens('growing', 1500, PROMPT_WORDS) <= 2000 - PROMPT_WORDS * 1.45
@@ -0,0 +1,40 @@
+import time
+
+from src.app.utils.cache import cache_story, get_cache_key, story_cache
+from src.app.utils.library import story_library
+from src.app.utils.warmer import StoryWarmer, story_warmer
+from src.llm_models.story_generator import StoryGenerator
+
+STORED = {'mainPrompt': 'a brave dragon in a castle', 'ageGroup': 'preK'}
+NEW = {'mainPrompt': 'a shy turtle at the beach', 'ageGroup': 'preK'}
+
+
+def test_warmer_refills_from_the_library_and_generates_the_rest(app, monkeypatch):
+    generated = []
+    monkeypatch.setattr(StoryGenerator, 'generate_story',
+                        lambda self, data: generated.append(data['mainPrompt']) or 'A new story.')
+    story_warmer.budget = 5
+    with app.app_context():
+        cache_story(dict(STORED), 'A dragon story.')
+        story_library.flush()
+        # Both are hot; the stored story has dropped out of the cache
+        story_cache.delete(get_cache_key(STORED))
+        for _ in range(3):
+            story_warmer.record(dict(STORED))
+            story_warmer.record(dict(NEW))
+
+        story_warmer.warm()
+
+        assert story_cache.get(get_cache_key(STORED)) == 'A dragon story.'
+        assert story_cache.get(get_cache_key(NEW)) == 'A new story.'
+    assert generated == [NEW['mainPrompt']]
+    assert story_warmer.stats()['refilled'] == 1
+    assert story_warmer.stats()['warmed'] == 1
+
+
+def test_budget_is_shared_by_every_worker(app):
+    # Each worker process has its own warmer; the limiter's SQLite file is shared between them
+    workers = [StoryWarmer(budget=3) for _ in range(4)]
+    with app.app_context():
+        granted = sum(worker._take_budget(time.time()) for worker in workers for _ in range(3))
+    assert granted == 3